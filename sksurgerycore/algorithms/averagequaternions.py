@@ -75,26 +75,11 @@ def average_quaternions(quaternions):
 
     :returns: the average quaternion of the input. Note that the signs
         of the output quaternion can be reversed, since q and -q
-        describe the same orientation
+        describe the same orientation. The sign returned is the
+        one that agrees with the input quaternion closest to the average.
     """
-
-    # Number of quaternions to average
-    samples = quaternions.shape[0]
-    mat_a = numpy.zeros(shape=(4, 4), dtype=numpy.float64)
-
-    for i in range(0, samples):
-        quat = quaternions[i, :]
-        # multiply quat with its transposed version quat' and add mat_a
-        mat_a = numpy.outer(quat, quat) + mat_a
-
-    # scale
-    mat_a = (1.0/ samples)*mat_a
-    # compute eigenvalues and -vectors
-    eigen_values, eigen_vectors = numpy.linalg.eig(mat_a)
-    # Sort by largest eigenvalue
-    eigen_vectors = eigen_vectors[:, eigen_values.argsort()[::-1]]
-    # return the real part of the largest eigenvector (has only real part)
-    return numpy.real(numpy.ravel(eigen_vectors[:, 0]))
+    weights = numpy.ones(quaternions.shape[0])
+    return _largest_eigenvector(quaternions, weights)
 
 
 def weighted_average_quaternions(quaternions, weights):
@@ -110,30 +95,61 @@ def weighted_average_quaternions(quaternions, weights):
 
     :returns: the average quaternion of the input. Note that the signs
         of the output quaternion can be reversed, since q and -q
-        describe the same orientation
+        describe the same orientation, see average_quaternions
     :raises: ValueError if all weights are zero
     """
-    # Number of quaternions to average
-    samples = quaternions.shape[0]
-    mat_a = numpy.zeros(shape=(4, 4), dtype=numpy.float64)
-    weight_sum = 0
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    if numpy.sum(weights) <= 0.0:
+        raise ValueError("At least one weight must be greater than zero")
 
-    for i in range(0, samples):
-        quat = quaternions[i, :]
-        mat_a = weights[i] * numpy.outer(quat, quat) + mat_a
-        weight_sum += weights[i]
+    return _largest_eigenvector(quaternions, weights)
 
-    if weight_sum <= 0.0:
-        raise ValueError("At least one weight must be greater than zero")
 
-    # scale
-    mat_a = (1.0/weight_sum) * mat_a
+def average_quaternions_batch(quaternions, weights=None):
+    """
+    Calculate B independent (weighted) average quaternions in one call.
+
+    :params quaternions: is a BxNx4 numpy array, containing B sets of N
+        quaternions to average, arranged as (w,x,y,z)
+    :params weights: optional BxN or N numpy array of weights, if None
+        all quaternions are weighted equally
+
+    :returns: Bx4 numpy array of average quaternions, see
+        average_quaternions for the sign convention
+    :raises: ValueError if quaternions isn't BxNx4, or if all the weights
+        for a set are zero
+    """
+    if quaternions.ndim != 3 or quaternions.shape[2] != 4:
+        raise ValueError("quaternions should be a BxNx4 array")
+
+    if weights is None:
+        weights = numpy.ones(quaternions.shape[0:2])
+    else:
+        weights = numpy.broadcast_to(
+            numpy.asarray(weights, dtype=numpy.float64),
+            quaternions.shape[0:2])
+        if numpy.any(numpy.sum(weights, axis=1) <= 0.0):
+            raise ValueError("At least one weight must be greater than zero")
 
-    # compute eigenvalues and -vectors
-    eigen_values, eigen_vectors = numpy.linalg.eig(mat_a)
+    return _largest_eigenvector(quaternions, weights)
 
-    # Sort by largest eigenvalue
-    eigen_vectors = eigen_vectors[:, eigen_values.argsort()[::-1]]
 
-    # return the real part of the largest eigenvector (has only real part)
-    return numpy.real(numpy.ravel(eigen_vectors[:, 0]))
+def _largest_eigenvector(quaternions, weights):
+    """
+    Returns the eigenvector with the largest eigenvalue of the weighted
+    sum of quaternion outer products, Q^T.diag(w).Q, for (...)xNx4
+    quaternions and (...)xN weights. As the matrix is symmetric we can
+    use eigh, which returns real eigenvalues in ascending order.
+    """
+    mat_a = numpy.matmul(numpy.swapaxes(quaternions, -1, -2),
+                         weights[..., numpy.newaxis] * quaternions)
+
+    _, eigen_vectors = numpy.linalg.eigh(mat_a)
+    average = eigen_vectors[..., 3]
+
+    # Pick the sign that agrees with the most aligned input quaternion.
+    dots = numpy.matmul(quaternions, average[..., numpy.newaxis])[..., 0]
+    most_aligned = numpy.argmax(weights * numpy.abs(dots), axis=-1)
+    aligned_dots = numpy.take_along_axis(
+        dots, most_aligned[..., numpy.newaxis], axis=-1)
+    return numpy.where(aligned_dots < 0.0, -average, average)
@@ -43,6 +43,41 @@ def validate_procrustes_inputs(fixed, moving):
                          + "the same number of points (rows)")
 
 
+def validate_procrustes_stacks(fixed, moving):
+    """
+    Validates stacks of fixed and moving sets of points, as
+    validate_procrustes_inputs, for each pair in the stack.
+
+    1. fixed and moving must be numpy array
+    2. fixed and moving should be B x N x 3
+    3. fixed and moving should have at least 3 points
+    4. fixed and moving should have the same shape
+
+    :param fixed: point sets, B x N x 3 ndarray
+    :param moving: point sets, B x N x 3 ndarray of corresponding points
+    :returns: nothing
+    :raises: TypeError, ValueError
+    """
+    if not isinstance(fixed, np.ndarray):
+        raise TypeError("fixed is not a numpy array'")
+
+    if not isinstance(moving, np.ndarray):
+        raise TypeError("moving is not a numpy array")
+
+    if fixed.ndim != 3 or not fixed.shape[2] == 3:
+        raise ValueError("fixed should be B x N x 3")
+
+    if moving.ndim != 3 or not moving.shape[2] == 3:
+        raise ValueError("moving should be B x N x 3")
+
+    if fixed.shape[1] < 3:
+        raise ValueError("fixed should have at least 3 points")
+
+    if not fixed.shape == moving.shape:
+        raise ValueError("fixed and moving should have "
+                         + "the same number of point sets and points")
+
+
 def compute_fre(fixed, moving, rotation, translation):
     """
     Computes the Fiducial Registration Error, equal
@@ -68,17 +103,127 @@ def compute_fre(fixed, moving, rotation, translation):
     return fre
 
 
-def compute_tre_from_fle(fiducials, mean_fle_squared, target_point):
+def compute_weighted_fre(fixed, moving, rotation, translation, weights):
+    """
+    Computes the weighted Fiducial Registration Error, the root weighted
+    mean squared error between corresponding fiducials. With N
+    scalar weights w_i this is sqrt(sum(w_i * e_i^T e_i) / sum(w_i)),
+    and with N 3x3 weight matrices W_i, for example inverse FLE
+    covariances, sqrt(sum(e_i^T W_i e_i) / sum(trace(W_i) / 3)), so
+    W_i = w_i * I gives the same result as w_i.
+
+    :param fixed: point set, N x 3 ndarray
+    :param moving: point set, N x 3 ndarray of corresponding points
+    :param rotation: 3 x 3 ndarray
+    :param translation: 3 x 1 ndarray
+    :param weights: N ndarray, or N x 3 x 3 ndarray
+    :returns: weighted Fiducial Registration Error
+    :raises: TypeError, ValueError
+    """
+    validate_procrustes_inputs(fixed, moving)
+    validate_registration_weights(weights, fixed.shape[0])
+
+    errors = np.matmul(moving, rotation.transpose()) \
+        + translation.transpose() - fixed
+    if weights.ndim == 1:
+        return np.sqrt(np.sum(weights * np.sum(np.square(errors), axis=1))
+                       / np.sum(weights))
+    return np.sqrt(np.einsum('ni,nij,nj->', errors, weights, errors)
+                   / (np.trace(weights, axis1=1, axis2=2).sum() / 3.0))
+
+
+def validate_registration_weights(weights, number_of_points):
+    """
+    Validates weights for weighted registration.
+
+    1. weights must be a numpy array
+    2. weights should be N, or N x 3 x 3
+    3. scalar weights should not be negative
+    4. weight matrices should be symmetric positive semi-definite
+    5. the weights should not sum to zero
+
+    :param weights: N ndarray, or N x 3 x 3 ndarray
+    :param number_of_points: N
+    :returns: nothing
+    :raises: TypeError, ValueError
+    """
+    if not isinstance(weights, np.ndarray):
+        raise TypeError("weights is not a numpy array")
+
+    if weights.shape not in ((number_of_points,),
+                             (number_of_points, 3, 3)):
+        raise ValueError("weights should be N, or N x 3 x 3, "
+                         + "for N points")
+
+    if weights.ndim == 1:
+        if np.any(weights < 0):
+            raise ValueError("weights should not be negative")
+        if not np.sum(weights) > 0:
+            raise ValueError("weights should not sum to zero")
+    else:
+        if not np.allclose(weights, np.swapaxes(weights, 1, 2)):
+            raise ValueError("weight matrices should be symmetric")
+        eigenvalues = np.linalg.eigvalsh(weights)
+        tolerance = 1e-12 * max(np.max(np.abs(eigenvalues)), 1.0)
+        if np.any(eigenvalues < -tolerance):
+            raise ValueError("weight matrices should be positive "
+                             + "semi-definite")
+        if not np.trace(weights, axis1=1, axis2=2).sum() > 0:
+            raise ValueError("weight matrices should not sum to zero")
+
+
+def compute_tre_from_fle(fiducials, mean_fle_squared, target_point,
+                         chunk_size=65536):
     """
     Computes an estimation of TRE from FLE and a list of fiducial locations.
 
     See:
     `Fitzpatrick (1998), equation 46 <http://dx.doi.org/10.1109/42.736021>`_.
 
+    Many target points, for example every voxel of an image, can be passed
+    at once. They are processed chunk_size at a time, so the memory
+    used, beyond the result, is bounded. To stream targets that don't fit
+    in memory, use compute_tre_from_fle_chunks.
+
+    :param fiducials: Nx3 ndarray of fiducial points
+    :param mean_fle_squared: expected (mean) FLE squared
+    :param target_point: a 1x3 ndarray point for which to compute TRE,
+        or an Mx3 ndarray of points
+    :param chunk_size: the number of targets to process at a time
+    :return: mean TRE squared, or an M ndarray of mean TRE squared for
+        M > 1 target points
+    """
+    _validate_tre_targets(target_point)
+    if chunk_size < 1:
+        raise ValueError("chunk_size should be at least 1")
+
+    mean_tre_squared = np.empty(target_point.shape[0])
+    chunks = (target_point[start:start + chunk_size]
+              for start in range(0, target_point.shape[0], chunk_size))
+    start = 0
+    for chunk_tre_squared in compute_tre_from_fle_chunks(
+            fiducials, mean_fle_squared, chunks):
+        end = start + chunk_tre_squared.shape[0]
+        mean_tre_squared[start:end] = chunk_tre_squared
+        start = end
+
+    if target_point.shape[0] == 1:
+        return mean_tre_squared[0]
+    return mean_tre_squared
+
+
+def compute_tre_from_fle_chunks(fiducials, mean_fle_squared, target_chunks):
+    """
+    Computes an estimation of TRE from FLE, as compute_tre_from_fle,
+    for a stream of chunks of target points, for example the slices
+    of an image. The fiducials' principal axes are computed once, before
+    the first chunk.
+
     :param fiducials: Nx3 ndarray of fiducial points
     :param mean_fle_squared: expected (mean) FLE squared
-    :param target_point: a point for which to compute TRE.
-    :return: mean TRE squared
+    :param target_chunks: iterable of Mx3 ndarrays of target points
+    :return: generator of M ndarrays of mean TRE squared, one per chunk
+    :raises: TypeError, ValueError
     """
     # pylint: disable=literal-comparison
     if not isinstance(fiducials, np.ndarray):
@@ -87,12 +232,6 @@ def compute_tre_from_fle(fiducials, mean_fle_squared, target_point):
         raise ValueError("fiducials should have 3 columns")
     if fiducials.shape[0] < 3:
         raise ValueError("fiducials should have at least 3 rows")
-    if not isinstance(target_point, np.ndarray):
-        raise TypeError("target_point is not a numpy array'")
-    if not target_point.shape[1] == 3:
-        raise ValueError("target_point should have 3 columns")
-    if not target_point.shape[0] == 1:
-        raise ValueError("target_point should have 1 row")
 
     number_of_fiducials = fiducials.shape[0]
     centroid = np.mean(fiducials, axis=0)
@@ -101,28 +240,49 @@ def compute_tre_from_fle(fiducials, mean_fle_squared, target_point):
     assert covariance.shape[1] == 3
     _, eigen_vectors_matrix = np.linalg.eig(covariance)
 
-    f_array = np.zeros(3)
-    for axis_index in range(3):
-        sum_f_k_squared = 0
-        for fiducial_index in range(fiducials.shape[0]):
-            f_k = vm.distance_from_line(centroid,
-                                        eigen_vectors_matrix[axis_index],
-                                        fiducials[fiducial_index])
-            sum_f_k_squared = sum_f_k_squared + f_k * f_k
-        f_k_rms = np.sqrt(sum_f_k_squared / number_of_fiducials)
-        f_array[axis_index] = f_k_rms
-
-    inner_sum = 0
+    f_squared = np.zeros(3)
     for axis_index in range(3):
-        d_k = vm.distance_from_line(centroid,
-                                    eigen_vectors_matrix[axis_index],
-                                    target_point)
-        inner_sum = inner_sum + (d_k * d_k / (f_array[axis_index] *
-                                              f_array[axis_index]))
-
-    mean_tre_squared = (mean_fle_squared / fiducials.shape[0]) * \
-                       (1 + (1./3.) * inner_sum)
-    return mean_tre_squared
+        f_k = vm.distances_from_line(centroid,
+                                     eigen_vectors_matrix[axis_index],
+                                     fiducials)
+        f_squared[axis_index] = np.sum(f_k * f_k) / number_of_fiducials
+
+    return _tre_from_fle_chunks(centroid, eigen_vectors_matrix, f_squared,
+                                mean_fle_squared / number_of_fiducials,
+                                target_chunks)
+
+
+def _tre_from_fle_chunks(centroid, eigen_vectors_matrix, f_squared,
+                         scale, target_chunks):
+    """
+    Generates the mean TRE squared for each chunk of targets, once the
+    fiducials' principal axes are known, so that
+    compute_tre_from_fle_chunks validates the fiducials when it's called.
+    """
+    for targets in target_chunks:
+        _validate_tre_targets(targets)
+        inner_sum = np.zeros(targets.shape[0])
+        for axis_index in range(3):
+            d_k = vm.distances_from_line(centroid,
+                                         eigen_vectors_matrix[axis_index],
+                                         targets)
+            inner_sum += d_k * d_k / f_squared[axis_index]
+        yield scale * (1 + (1./3.) * inner_sum)
+
+
+def _validate_tre_targets(target_point):
+    """
+    Validates target points for compute_tre_from_fle.
+
+    :raises: TypeError, ValueError
+    """
+    # pylint: disable=literal-comparison
+    if not isinstance(target_point, np.ndarray):
+        raise TypeError("target_point is not a numpy array'")
+    if target_point.ndim != 2 or not target_point.shape[1] == 3:
+        raise ValueError("target_point should have 3 columns")
+    if target_point.shape[0] < 1:
+        raise ValueError("target_point should have at least 1 row")
 
 
 def compute_fre_from_fle(fiducials, mean_fle_squared):
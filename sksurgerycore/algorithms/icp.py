@@ -0,0 +1,160 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Iterative closest point (ICP) registration of a set of points to a
+surface, using sksurgerycore.algorithms.kdtree for the correspondences.
+"""
+
+import numpy as np
+from sksurgerycore.algorithms.kdtree import KDTree
+from sksurgerycore.algorithms.procrustes import orthogonal_procrustes
+from sksurgerycore.algorithms.tracking_smoothing import \
+    quaternions_to_matrices, rvecs_to_quaternions
+
+
+class IterativeClosestPoint():
+    """
+    Registers sets of points to a fixed surface, given as points, and
+    optionally their normals, with iterative closest point.
+
+    The KD-tree of the surface is built once, when the class is
+    constructed, so many point sets can be registered to the same
+    surface without rebuilding it.
+
+    Two variants are available. 'point_to_point' registers each point to
+    its closest surface point with orthogonal_procrustes. 'point_to_plane'
+    minimises the distances from each point to the tangent plane at its
+    closest surface point, with a linearised rotation, which usually
+    converges in fewer iterations on smooth surfaces, but needs normals.
+
+    Usage::
+
+        icp = IterativeClosestPoint(surface_points, surface_normals)
+        rotation, translation, rms = icp.register(points)
+    """
+    def __init__(self, fixed, fixed_normals=None, leaf_size=16):
+        """
+        :param fixed: N x 3 ndarray of surface points
+        :param fixed_normals: optional N x 3 ndarray of surface normals,
+            needed for 'point_to_plane'
+        :param leaf_size: the maximum number of points in a KD-tree leaf
+        :raises: TypeError, ValueError
+        """
+        self.tree = KDTree(fixed, leaf_size=leaf_size)
+        self.fixed = self.tree.points
+        self.fixed_normals = None
+        if fixed_normals is not None:
+            if not isinstance(fixed_normals, np.ndarray):
+                raise TypeError("fixed_normals is not a numpy array")
+            if fixed_normals.shape != self.fixed.shape:
+                raise ValueError("fixed_normals should be N x 3, "
+                                 + "for N fixed points")
+            lengths = np.linalg.norm(fixed_normals, axis=1, keepdims=True)
+            if np.any(lengths == 0):
+                raise ValueError("fixed_normals should not be zero")
+            self.fixed_normals = fixed_normals / lengths
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    # pylint: disable=too-many-locals
+    def register(self, moving, rotation=None, translation=None,
+                 method='point_to_point', max_iterations=50,
+                 tolerance=1e-6, max_distance=None):
+        """
+        Registers the moving points to the fixed surface, so that
+        fixed = rotation * moving + translation.
+
+        The iterations stop when the change in the RMS distance between
+        the corresponding points is less than tolerance, or after
+        max_iterations.
+
+        :param moving: M x 3 ndarray of points to register
+        :param rotation: optional 3x3 initial rotation
+        :param translation: optional 3x1 initial translation
+        :param method: 'point_to_point' or 'point_to_plane'
+        :param max_iterations: the maximum number of iterations
+        :param tolerance: stop when the RMS changes by less than this
+        :param max_distance: optional, ignore points further than this
+            from the surface, to reject points that aren't on it
+        :returns: 3x3 rotation ndarray, 3x1 translation ndarray, the RMS
+            distance between the corresponding points, before the last
+            update
+        :raises: TypeError, ValueError
+        """
+        self._validate_register_inputs(moving, method, max_iterations)
+
+        moving = np.asarray(moving, dtype=np.float64)
+        if rotation is None:
+            rotation = np.eye(3)
+        if translation is None:
+            translation = np.zeros((3, 1))
+        rotation = np.array(rotation, dtype=np.float64)
+        translation = np.reshape(np.array(translation, dtype=np.float64),
+                                 (3, 1))
+
+        previous_rms = np.inf
+        rms = np.inf
+        for _ in range(max_iterations):
+            transformed = np.matmul(moving, rotation.transpose()) \
+                + translation.transpose()
+            distances, indices = self.tree.query(transformed,
+                                                 max_distance=max_distance)
+            matched = indices >= 0
+            if np.count_nonzero(matched) < 3:
+                raise ValueError("Registration fails as fewer than 3 "
+                                 "points are close to the surface")
+
+            if method == 'point_to_point':
+                rms = np.sqrt(np.mean(np.square(distances[matched])))
+                if abs(previous_rms - rms) < tolerance:
+                    break
+                rotation, translation, _ = orthogonal_procrustes(
+                    self.fixed[indices[matched]], moving[matched])
+            else:
+                points = transformed[matched]
+                normals = self.fixed_normals[indices[matched]]
+                residuals = np.einsum(
+                    'ij,ij->i', points - self.fixed[indices[matched]],
+                    normals)
+                rms = np.sqrt(np.mean(np.square(residuals)))
+                if abs(previous_rms - rms) < tolerance:
+                    break
+                rotation, translation = self._point_to_plane_step(
+                    points, normals, residuals, rotation, translation)
+            previous_rms = rms
+
+        return rotation, translation, rms
+
+    def _validate_register_inputs(self, moving, method, max_iterations):
+        """
+        Validates the inputs to register.
+
+        :raises: TypeError, ValueError
+        """
+        if not isinstance(moving, np.ndarray):
+            raise TypeError("moving is not a numpy array")
+        if moving.ndim != 2 or moving.shape[1] != 3:
+            raise ValueError("moving should be M x 3")
+        if method not in ('point_to_point', 'point_to_plane'):
+            raise ValueError("method should be 'point_to_point' or "
+                             + "'point_to_plane'")
+        if method == 'point_to_plane' and self.fixed_normals is None:
+            raise ValueError("point_to_plane needs fixed_normals")
+        if max_iterations < 1:
+            raise ValueError("max_iterations should be at least 1")
+
+    @staticmethod
+    def _point_to_plane_step(points, normals, residuals, rotation,
+                             translation):
+        """
+        Solves the point to plane distances, linearised about the
+        current registration, for a small rotation and translation,
+        and composes it with the current registration.
+        """
+        jacobian = np.concatenate((np.cross(points, normals), normals),
+                                  axis=1)
+        update = np.linalg.lstsq(jacobian, -residuals, rcond=None)[0]
+        update_rotation = quaternions_to_matrices(
+            rvecs_to_quaternions(update[np.newaxis, 0:3]))[0]
+        return np.matmul(update_rotation, rotation), \
+            np.matmul(update_rotation, translation) \
+            + np.reshape(update[3:6], (3, 1))
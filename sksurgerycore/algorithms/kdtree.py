@@ -0,0 +1,202 @@
+#  -*- coding: utf-8 -*-
+
+"""
+A KD-tree for nearest neighbour search, written with numpy only, for
+example to find correspondences between surfaces.
+"""
+
+import numpy as np
+
+
+def _box_squared_distances(points, box_minimums, box_maximums):
+    """
+    Returns the squared distances from points to axis aligned boxes,
+    zero for points inside the box.
+    """
+    gaps = np.maximum(np.maximum(box_minimums - points, points - box_maximums),
+                      0.0)
+    return np.einsum('ij,ij->i', gaps, gaps)
+
+
+class KDTree():
+    """
+    A balanced KD-tree, built once for a fixed set of points, then
+    queried for the nearest point to each of many query points.
+
+    The tree is built a level at a time, splitting every node at its
+    median along its widest axis, so it has equal sized leaves, and can
+    be stored as arrays, indexed by level and node. Queries are
+    vectorised over the query points, rather than looping over them in
+    Python. Each query point first descends to its own leaf, giving an
+    upper bound on its nearest neighbour distance. Then only the nodes
+    off that path are searched, a level at a time, starting from the
+    siblings of the path's nodes whose splitting planes are closer than
+    the bound, and keeping only nodes whose bounding boxes are closer
+    than the bound, so the result is exact.
+
+    Usage::
+
+        tree = KDTree(surface_points)
+        distances, indices = tree.query(other_points)
+    """
+    def __init__(self, points, leaf_size=16):
+        """
+        :param points: N x 3 ndarray of points to search
+        :param leaf_size: the maximum number of points in a leaf
+        :raises: TypeError, ValueError
+        """
+        if not isinstance(points, np.ndarray):
+            raise TypeError("points is not a numpy array")
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError("points should be N x 3")
+        if points.shape[0] < 1:
+            raise ValueError("points should have at least one point")
+        if leaf_size < 1:
+            raise ValueError("leaf_size should be at least 1")
+
+        self.points = np.array(points, dtype=np.float64)
+        number_of_points = self.points.shape[0]
+
+        # Split until the leaves are small enough, but not empty.
+        depth = 0
+        while -(-number_of_points // 2 ** depth) > leaf_size \
+                and number_of_points // 2 ** (depth + 1) >= 1:
+            depth += 1
+
+        order = np.arange(number_of_points)
+        bounds = np.array([0, number_of_points])
+        self._box_minimums = []
+        self._box_maximums = []
+        self._split_axes = []
+        self._split_values = []
+        for _ in range(depth + 1):
+            segments = np.repeat(np.arange(bounds.shape[0] - 1),
+                                 np.diff(bounds))
+            ordered_points = self.points[order]
+            minimums = np.minimum.reduceat(ordered_points, bounds[:-1])
+            maximums = np.maximum.reduceat(ordered_points, bounds[:-1])
+            self._box_minimums.append(minimums)
+            self._box_maximums.append(maximums)
+            if len(self._box_minimums) == depth + 1:
+                break
+
+            # Sort each node's points along its widest axis, and split
+            # at the median.
+            axes = np.argmax(maximums - minimums, axis=1)
+            order = order[np.lexsort(
+                (ordered_points[np.arange(number_of_points),
+                                axes[segments]], segments))]
+            middles = (bounds[:-1] + bounds[1:]) // 2
+            self._split_axes.append(axes)
+            self._split_values.append(self.points[order[middles], axes])
+            new_bounds = np.empty(2 * bounds.shape[0] - 1, dtype=np.intp)
+            new_bounds[0::2] = bounds
+            new_bounds[1::2] = middles
+            bounds = new_bounds
+
+        # Leaf point indices, padded with -1 to the largest leaf
+        leaf_sizes = np.diff(bounds)
+        self._leaf_points = np.full((leaf_sizes.shape[0],
+                                     max(1, leaf_sizes.max())), -1,
+                                    dtype=np.intp)
+        columns = np.arange(number_of_points) \
+            - np.repeat(bounds[:-1], leaf_sizes)
+        self._leaf_points[np.repeat(np.arange(leaf_sizes.shape[0]),
+                                    leaf_sizes), columns] = order
+        # and their coordinates, padded with inf, stored together by
+        # leaf, so each leaf is read from memory in one block.
+        self._leaf_coordinates = np.concatenate(
+            (self.points, np.full((1, 3), np.inf)))[self._leaf_points]
+
+    def __len__(self):
+        """
+        Returns the number of points in the tree.
+        """
+        return self.points.shape[0]
+
+    def query(self, points, max_distance=None):
+        """
+        Finds the nearest point in the tree to each query point.
+
+        :param points: M x 3 ndarray of query points
+        :param max_distance: optional, only look for neighbours closer
+            than this, which is quicker for query points far from the tree
+        :return: M ndarray of distances, and M ndarray of indices of the
+            nearest points, inf and -1 where there is no neighbour
+            within max_distance
+        :raises: TypeError, ValueError
+        """
+        if not isinstance(points, np.ndarray):
+            raise TypeError("points is not a numpy array")
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError("points should be M x 3")
+        points = np.asarray(points, dtype=np.float64)
+        all_queries = np.arange(points.shape[0])
+
+        # Descend to each query's own leaf, for an initial bound,
+        # keeping the node at each level on the way.
+        paths = np.zeros((len(self._split_axes) + 1, points.shape[0]),
+                         dtype=np.intp)
+        for level, (axes, values) in enumerate(zip(self._split_axes,
+                                                   self._split_values)):
+            parents = paths[level]
+            paths[level + 1] = 2 * parents + (
+                points[all_queries, axes[parents]] >= values[parents])
+        best_squared, best_indices = self._search_leaves(points, all_queries,
+                                                         paths[-1])
+        if max_distance is not None:
+            too_far = best_squared >= max_distance * max_distance
+            best_squared[too_far] = max_distance * max_distance
+            best_indices[too_far] = -1
+
+        # The nearest point can only be in a node off that path. At each
+        # level, add the sibling of the path's node, if the splitting
+        # plane between them is within the bound, and the children of
+        # the nodes kept at the level above, keeping only the nodes whose
+        # bounding boxes are within the bound, so the result is exact.
+        queries = np.zeros(0, dtype=np.intp)
+        nodes = np.zeros(0, dtype=np.intp)
+        for level in range(1, paths.shape[0]):
+            queries = np.repeat(queries, 2)
+            nodes = 2 * np.repeat(nodes, 2) + np.tile([0, 1], nodes.shape[0])
+            parents = paths[level - 1]
+            planes = points[all_queries, self._split_axes[level - 1][parents]] \
+                - self._split_values[level - 1][parents]
+            near = planes * planes <= best_squared
+            queries = np.concatenate((queries, all_queries[near]))
+            nodes = np.concatenate((nodes, paths[level][near] ^ 1))
+
+            close = _box_squared_distances(
+                points[queries], self._box_minimums[level][nodes],
+                self._box_maximums[level][nodes]) <= best_squared[queries]
+            queries = queries[close]
+            nodes = nodes[close]
+
+        squared, indices = self._search_leaves(points, queries, nodes)
+        # Keep the closest result for each query.
+        order = np.lexsort((squared, queries))
+        queries, squared, indices = \
+            queries[order], squared[order], indices[order]
+        first = np.ones(queries.shape[0], dtype=bool)
+        first[1:] = queries[1:] != queries[:-1]
+        queries, squared, indices = \
+            queries[first], squared[first], indices[first]
+        better = squared < best_squared[queries]
+        best_squared[queries[better]] = squared[better]
+        best_indices[queries[better]] = indices[better]
+
+        distances = np.sqrt(best_squared)
+        distances[best_indices < 0] = np.inf
+        return distances, best_indices
+
+    def _search_leaves(self, points, queries, leaves):
+        """
+        Returns the squared distance and index of the nearest point
+        in the given leaf for each query.
+        """
+        differences = self._leaf_coordinates[leaves] \
+            - points[queries][:, np.newaxis, :]
+        squared = np.einsum('ijk,ijk->ij', differences, differences)
+        nearest = np.argmin(squared, axis=1)
+        rows = np.arange(queries.shape[0])
+        return squared[rows, nearest], self._leaf_points[leaves, nearest]
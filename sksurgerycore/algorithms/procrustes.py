@@ -4,12 +4,15 @@
 
 import numpy as np
 from sksurgerycore.algorithms.errors \
-    import validate_procrustes_inputs, compute_fre
+    import validate_procrustes_inputs, validate_procrustes_stacks, \
+    validate_registration_weights, compute_fre, compute_weighted_fre
+from sksurgerycore.algorithms.tracking_smoothing import \
+    quaternions_to_matrices, rvecs_to_quaternions
 
 # pylint: disable=invalid-name, line-too-long
 
 
-def orthogonal_procrustes(fixed, moving):
+def orthogonal_procrustes(fixed, moving, method='arun'):
     """
     Implements point based registration via the Orthogonal Procrustes method.
 
@@ -21,14 +24,39 @@ def orthogonal_procrustes(fixed, moving):
     Also see `this <http://eecs.vanderbilt.edu/people/mikefitzpatrick/papers/2009_Medim_Fitzpatrick_TRE_FRE_uncorrelated_as_published.pdf>`_
     and `this <http://tango.andrew.cmu.edu/~gustavor/42431-intro-bioimaging/readings/ch8.pdf>`_.
 
+    Alternatively, with method='horn', uses Horn's method:
+
+      Closed-form solution of absolute orientation using unit quaternions,
+      Horn, 1987, `10.1364/JOSAA.4.000629 <https://doi.org/10.1364/JOSAA.4.000629>`_.
+
+    which finds the rotation from the largest eigenvector of a symmetric
+    4x4 matrix, so is always a rotation, never a reflection, and is faster
+    for small numbers of points.
+
     :param fixed: point set, N x 3 ndarray
     :param moving: point set, N x 3 ndarray of corresponding points
+    :param method: 'arun' (default) or 'horn'
     :returns: 3x3 rotation ndarray, 3x1 translation ndarray, FRE
     :raises: ValueError
     """
 
     validate_procrustes_inputs(fixed, moving)
 
+    if method == 'horn':
+        p = np.mean(moving, axis=0)
+        p_prime = np.mean(fixed, axis=0)
+        q = moving - p
+        q_prime = fixed - p_prime
+        R = _horn_rotation(np.matmul(q.transpose(), q_prime))
+        T = np.reshape(p_prime - np.matmul(R, p), (3, 1))
+        # The inputs are already validated, so the FRE is computed from
+        # the demeaned points, rather than with compute_fre.
+        residuals = q_prime - np.matmul(q, R.transpose())
+        fre = np.sqrt(np.sum(np.square(residuals)) / fixed.shape[0])
+        return R, T, fre
+    if method != 'arun':
+        raise ValueError("method should be 'arun' or 'horn'")
+
     # This is what we are calculating
     R = np.eye(3)
     T = np.zeros((3, 1))
@@ -85,6 +113,181 @@ def orthogonal_procrustes(fixed, moving):
 
     return R, T, fre
 
+def orthogonal_procrustes_batch(fixed, moving, method='arun'):
+    """
+    Implements orthogonal_procrustes for many pairs of point sets at
+    once, for example for Monte Carlo simulation of registration error.
+    Each step is done for the whole stack at once, using a stacked SVD,
+    and Fitzpatrick's correction to avoid reflections, or with
+    method='horn', a stacked eigen decomposition.
+
+    :param fixed: point sets, B x N x 3 ndarray
+    :param moving: point sets, B x N x 3 ndarray of corresponding points
+    :param method: 'arun' (default) or 'horn'
+    :returns: B x 3 x 3 rotation ndarray, B x 3 x 1 translation ndarray,
+        B FRE ndarray
+    :raises: TypeError, ValueError
+    """
+    validate_procrustes_stacks(fixed, moving)
+    if method not in ('arun', 'horn'):
+        raise ValueError("method should be 'arun' or 'horn'")
+
+    # Arun equations 4 and 6
+    p = np.mean(moving, axis=1, keepdims=True)
+    p_prime = np.mean(fixed, axis=1, keepdims=True)
+
+    # Arun equations 7, 8 and 11
+    H = np.matmul(np.swapaxes(moving - p, 1, 2), fixed - p_prime)
+
+    if method == 'horn':
+        R = _horn_rotations(H)
+    else:
+        # Arun equation 12, then Fitzpatrick, chapter 8, page 470
+        U, _, Vt = np.linalg.svd(H)
+        V = np.swapaxes(Vt, 1, 2)
+        Ut = np.swapaxes(U, 1, 2)
+        diag = np.ones((fixed.shape[0], 1, 3))
+        diag[:, 0, 2] = np.where(np.linalg.det(np.matmul(V, Ut)) < 0,
+                                 -1.0, 1.0)
+        R = np.matmul(V * diag, Ut)
+
+    T = np.swapaxes(p_prime, 1, 2) - np.matmul(R, np.swapaxes(p, 1, 2))
+
+    residuals = fixed - np.swapaxes(np.matmul(R, np.swapaxes(moving, 1, 2))
+                                    + T, 1, 2)
+    fre = np.sqrt(np.mean(np.sum(np.square(residuals), axis=2), axis=1))
+
+    return R, T, fre
+
+
+def weighted_orthogonal_procrustes(fixed, moving, weights,
+                                   max_iterations=20, tolerance=1e-10):
+    """
+    Point based registration with a weight for each pair of points,
+    for example when the FLE of each fiducial is different.
+
+    With N scalar weights, minimises sum(w_i * |R m_i + T - f_i|^2),
+    in closed form, using the weighted centroids and weighted cross
+    covariance in Arun's method, with Fitzpatrick's correction to
+    avoid reflections.
+
+    With N 3x3 weight matrices W_i, for example the inverses of
+    anisotropic FLE covariances, minimises
+    sum((R m_i + T - f_i)^T W_i (R m_i + T - f_i)), which has no closed
+    form solution, so starting from the scalar weighted solution, with
+    w_i = trace(W_i) / 3, iterates Gauss-Newton updates of the rotation
+    and translation together. Each iteration is a few vectorised
+    operations over the points, and one 6x6 solve.
+
+    :param fixed: point set, N x 3 ndarray
+    :param moving: point set, N x 3 ndarray of corresponding points
+    :param weights: N ndarray of weights, or N x 3 x 3 ndarray of
+        symmetric positive semi-definite weight matrices
+    :param max_iterations: the maximum number of Gauss-Newton iterations,
+        for weight matrices
+    :param tolerance: stop iterating when the update is smaller than this
+    :returns: 3x3 rotation ndarray, 3x1 translation ndarray, weighted FRE,
+        see errors.compute_weighted_fre
+    :raises: TypeError, ValueError
+    """
+    validate_procrustes_inputs(fixed, moving)
+    validate_registration_weights(weights, fixed.shape[0])
+
+    scalar_weights = weights
+    if weights.ndim == 3:
+        scalar_weights = np.trace(weights, axis1=1, axis2=2) / 3.0
+    scalar_weights = scalar_weights / np.sum(scalar_weights)
+
+    p = np.matmul(scalar_weights, moving)
+    p_prime = np.matmul(scalar_weights, fixed)
+    H = np.matmul((moving - p).transpose() * scalar_weights, fixed - p_prime)
+    R = _fitzpatricks_X(np.linalg.svd(H))
+    T = np.reshape(p_prime - np.matmul(R, p), (3, 1))
+
+    if weights.ndim == 3:
+        for _ in range(max_iterations):
+            R, T, step = _anisotropic_step(fixed, moving, weights, R, T)
+            if step < tolerance:
+                break
+
+    return R, T, compute_weighted_fre(fixed, moving, R, T, weights)
+
+
+def _anisotropic_step(fixed, moving, weights, R, T):
+    """One Gauss-Newton step for the anisotropic weighted registration.
+       The residuals e_i = R m_i + T - f_i are linearised with respect to
+       a small rotation vector r, applied after R, and a change in
+       translation t, e_i + J_i [r, t], J_i = [-[R m_i]x, I], and the
+       6x6 weighted normal equations solved for [r, t].
+       Returns the updated R and T, and the size of the update.
+    """
+    rotated = np.matmul(moving, R.transpose())
+    errors = rotated + T.transpose() - fixed
+
+    jacobians = np.zeros((fixed.shape[0], 3, 6))
+    jacobians[:, 0, 1] = rotated[:, 2]
+    jacobians[:, 0, 2] = -rotated[:, 1]
+    jacobians[:, 1, 0] = -rotated[:, 2]
+    jacobians[:, 1, 2] = rotated[:, 0]
+    jacobians[:, 2, 0] = rotated[:, 1]
+    jacobians[:, 2, 1] = -rotated[:, 0]
+    jacobians[:, :, 3:6] = np.eye(3)
+
+    weighted_jacobians = np.matmul(weights, jacobians)
+    lhs = np.einsum('nki,nkj->ij', jacobians, weighted_jacobians)
+    rhs = -np.einsum('nki,nk->i', weighted_jacobians, errors)
+    update = np.linalg.lstsq(lhs, rhs, rcond=None)[0]
+
+    rotation_update = quaternions_to_matrices(
+        rvecs_to_quaternions(update[0:3]))[0]
+    R = np.matmul(rotation_update, R)
+    T = T + np.reshape(update[3:6], (3, 1))
+    return R, T, np.linalg.norm(update)
+
+
+def _horn_rotation(H):
+    """Horn's method, 1987, section 4, for a single 3x3 cross
+       covariance matrix, H = sum(moving_i * fixed_i^T) of the
+       demeaned points. As _horn_rotations, but working on Python floats,
+       as for one 3x3 matrix that is quicker than numpy's indexing.
+    """
+    (Sxx, Sxy, Sxz), (Syx, Syy, Syz), (Szx, Szy, Szz) = H.tolist()
+    N = np.array([[Sxx + Syy + Szz, Syz - Szy, Szx - Sxz, Sxy - Syx],
+                  [Syz - Szy, Sxx - Syy - Szz, Sxy + Syx, Szx + Sxz],
+                  [Szx - Sxz, Sxy + Syx, -Sxx + Syy - Szz, Syz + Szy],
+                  [Sxy - Syx, Szx + Sxz, Syz + Szy, -Sxx - Syy + Szz]])
+
+    # eigh sorts eigenvalues in ascending order
+    _, eigenvectors = np.linalg.eigh(N)
+    w, x, y, z = eigenvectors[:, 3].tolist()
+    return np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - z * w),
+                      2 * (x * z + y * w)],
+                     [2 * (x * y + z * w), 1 - 2 * (x * x + z * z),
+                      2 * (y * z - x * w)],
+                     [2 * (x * z - y * w), 2 * (y * z + x * w),
+                      1 - 2 * (x * x + y * y)]])
+
+
+def _horn_rotations(H):
+    """Horn's method, 1987, section 4, for a stack of B 3x3 cross
+       covariance matrices, H = sum(moving_i * fixed_i^T) of the
+       demeaned points. Returns the B x 3 x 3 rotations from moving to
+       fixed, from the eigenvectors of the largest eigenvalues of
+       Horn's symmetric 4x4 matrices.
+    """
+    trace = np.trace(H, axis1=1, axis2=2)
+    A = H - np.swapaxes(H, 1, 2)
+    N = np.empty((H.shape[0], 4, 4))
+    N[:, 0, 0] = trace
+    N[:, 0, 1:] = N[:, 1:, 0] = A[:, [1, 2, 0], [2, 0, 1]]
+    N[:, 1:, 1:] = H + np.swapaxes(H, 1, 2) \
+        - trace[:, np.newaxis, np.newaxis] * np.eye(3)
+
+    # eigh sorts eigenvalues in ascending order
+    _, eigenvectors = np.linalg.eigh(N)
+    return quaternions_to_matrices(eigenvectors[:, :, 3])
+
+
 def _fitzpatricks_X(svd):
     """This is from Fitzpatrick, chapter 8, page 470.
        it's used in preference to Arun's equation 13,
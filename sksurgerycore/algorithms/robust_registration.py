@@ -0,0 +1,143 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Functions for point based registration that are robust to outliers,
+for example mis-picked points, built on
+sksurgerycore.algorithms.procrustes.
+"""
+
+import math
+import numpy as np
+from sksurgerycore.algorithms.errors import validate_procrustes_inputs, \
+    compute_fre
+from sksurgerycore.algorithms.procrustes import orthogonal_procrustes, \
+    orthogonal_procrustes_batch
+
+
+def _squared_residuals(fixed, moving, rotations, translations):
+    """
+    Returns the squared distances between the fixed points and the
+    moving points transformed by each of B transforms, as B x N.
+    """
+    transformed = np.matmul(moving, np.swapaxes(rotations, 1, 2)) \
+        + np.swapaxes(translations, 1, 2)
+    return np.sum(np.square(transformed - fixed), axis=2)
+
+
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+def ransac_procrustes(fixed, moving, iterations=1000, threshold=1.0,
+                      seed=None, method='arun'):
+    """
+    Registers two point sets containing outliers using RANSAC.
+
+    Each hypothesis is a registration of 3 randomly chosen pairs of
+    points. The hypotheses are solved together with
+    orthogonal_procrustes_batch, and scored together against all
+    the points, with the MSAC score, the sum of squared residuals,
+    with residuals larger than the threshold counted as the threshold.
+    The best hypothesis's inliers, points with residuals less
+    than the threshold, are then registered with orthogonal_procrustes.
+
+    :param fixed: point set, N x 3 ndarray
+    :param moving: point set, N x 3 ndarray of corresponding points
+    :param iterations: the number of hypotheses to try
+    :param threshold: the largest residual, in the units of the points,
+        for a point to be an inlier
+    :param seed: seed for the random number generator, for repeatable
+        results, or None
+    :param method: solver for the final registration, 'arun' or 'horn',
+        see orthogonal_procrustes
+    :returns: 3x3 rotation ndarray, 3x1 translation ndarray, FRE of the
+        inliers, N boolean ndarray, True for the inliers
+    :raises: TypeError, ValueError
+    """
+    validate_procrustes_inputs(fixed, moving)
+    if iterations < 1:
+        raise ValueError("iterations should be at least 1")
+    if threshold <= 0:
+        raise ValueError("threshold should be greater than zero")
+
+    number_of_points = fixed.shape[0]
+    squared_threshold = threshold * threshold
+    rng = np.random.default_rng(seed)
+
+    # Process the hypotheses in chunks, to bound the size of the
+    # hypotheses x points arrays.
+    chunk_size = max(1, 1000000 // number_of_points)
+    best_score = np.inf
+    best_hypothesis = None
+    for first in range(0, iterations, chunk_size):
+        count = min(chunk_size, iterations - first)
+        samples = np.argpartition(rng.random((count, number_of_points)), 2,
+                                  axis=1)[:, 0:3]
+        rotations, translations, _ = orthogonal_procrustes_batch(
+            fixed[samples], moving[samples])
+
+        scores = np.sum(np.minimum(
+            _squared_residuals(fixed, moving, rotations, translations),
+            squared_threshold), axis=1)
+        best = np.argmin(scores)
+        if scores[best] < best_score:
+            best_score = scores[best]
+            best_hypothesis = (rotations[best], translations[best])
+
+    inliers = _squared_residuals(
+        fixed, moving, best_hypothesis[0][np.newaxis],
+        best_hypothesis[1][np.newaxis])[0] < squared_threshold
+    if np.count_nonzero(inliers) < 3:
+        raise ValueError("Registration fails as fewer than 3 points are "
+                         "within the threshold")
+
+    rotation, translation, fre = orthogonal_procrustes(
+        fixed[inliers], moving[inliers], method=method)
+    return rotation, translation, fre, inliers
+
+
+def trimmed_procrustes(fixed, moving, inlier_fraction=0.9,
+                       max_iterations=20, rotation=None, translation=None):
+    """
+    Registers two point sets containing outliers using trimmed least
+    squares. Starting from an initial registration, repeatedly
+    registers the fraction of the points with the smallest residuals,
+    until that subset stops changing.
+
+    :param fixed: point set, N x 3 ndarray
+    :param moving: point set, N x 3 ndarray of corresponding points
+    :param inlier_fraction: the fraction of the points to keep, at
+        least 3 points are always kept
+    :param max_iterations: the maximum number of registrations
+    :param rotation: optional 3x3 initial rotation, for example from
+        ransac_procrustes, otherwise all the points are registered
+    :param translation: optional 3x1 initial translation
+    :returns: 3x3 rotation ndarray, 3x1 translation ndarray, FRE of the
+        kept points, N boolean ndarray, True for the kept points
+    :raises: TypeError, ValueError
+    """
+    validate_procrustes_inputs(fixed, moving)
+    if not 0.0 < inlier_fraction <= 1.0:
+        raise ValueError("inlier_fraction should be greater than 0 "
+                         "and at most 1")
+    if max_iterations < 1:
+        raise ValueError("max_iterations should be at least 1")
+
+    if rotation is None or translation is None:
+        rotation, translation, _ = orthogonal_procrustes(fixed, moving)
+
+    number_of_points = fixed.shape[0]
+    number_to_keep = min(number_of_points,
+                         max(3, math.ceil(inlier_fraction * number_of_points)))
+    kept = np.zeros(number_of_points, dtype=bool)
+    for _ in range(max_iterations):
+        residuals = _squared_residuals(fixed, moving, rotation[np.newaxis],
+                                       translation[np.newaxis])[0]
+        new_kept = np.zeros(number_of_points, dtype=bool)
+        new_kept[np.argpartition(residuals,
+                                 number_to_keep - 1)[:number_to_keep]] = True
+        if np.array_equal(new_kept, kept):
+            break
+        kept = new_kept
+        rotation, translation, _ = orthogonal_procrustes(fixed[kept],
+                                                         moving[kept])
+
+    return rotation, translation, \
+        compute_fre(fixed[kept], moving[kept], rotation, translation), kept
@@ -0,0 +1,380 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Low latency filters for smoothing tracking data, as alternatives to the
+rolling mean in sksurgerycore.algorithms.tracking_smoothing.
+
+A rolling mean over a window of N samples lags the data by about N/2
+samples. The filters here are recursive, so they run in O(1) time per
+sample, and trade jitter for latency through their parameters rather
+than through a window length:
+
+* ExponentialFilterArray, an exponential moving average.
+* OneEuroFilterArray, the One Euro filter, which smooths heavily when
+  the tool is slow, and lightly when it is moving fast,
+  see `Casiez 2012 <https://doi.org/10.1145/2207676.2208639>`_.
+* KalmanFilterArray, a constant velocity Kalman filter, which does
+  not lag behind tools moving at constant speed.
+
+Each filter has the same interface as
+sksurgerycore.algorithms.tracking_smoothing.RollingMeanArray, with
+one row per tool, so can be used by TrackingSmoother. With rotation=True,
+a filter works on quaternions: each new quaternion's sign is aligned with
+the current estimate, the components are filtered, and the estimate
+is normalised.
+"""
+
+import math
+from abc import ABCMeta, abstractmethod
+import numpy as np
+from sksurgerycore.algorithms.tracking_smoothing import rvecs_to_quaternions
+
+
+class SmoothingFilterArray(metaclass=ABCMeta):
+    """
+    Abstract base class for recursive filters for many vectors at once,
+    one per row. Derived classes implement _update. Samples containing
+    nans are ignored, so the estimate is held while a tool is not visible.
+    """
+    def __init__(self, vector_size=3, rotation=False, frequency=60.0):
+        """
+        :params vector_size: the length of the vectors to filter, which is
+            4 if rotation is True.
+        :params rotation: if True filter rotations, as quaternions.
+        :params frequency: the expected sample rate in Hz, used when there
+            are no usable time stamps.
+        :raises: ValueError
+        """
+        if frequency <= 0.0:
+            raise ValueError("Frequency must be greater than zero")
+        if rotation:
+            vector_size = 4
+
+        self._rotation = rotation
+        self._default_period = 1.0 / frequency
+        self._estimate = np.zeros((0, vector_size))
+        self._initialised = np.zeros(0, dtype=bool)
+        # The time of each row's last valid sample, nan until there is one
+        self._last_time = np.zeros(0)
+
+    def __len__(self):
+        """
+        Returns the number of rows.
+        """
+        return self._estimate.shape[0]
+
+    def add_rows(self, count=1):
+        """
+        Adds empty rows to the end of the array.
+
+        :params count: the number of rows to add.
+        """
+        self._estimate = np.concatenate(
+            (self._estimate, np.zeros((count, self._estimate.shape[1]))))
+        self._initialised = np.concatenate(
+            (self._initialised, np.zeros(count, dtype=bool)))
+        self._last_time = np.concatenate((self._last_time,
+                                          np.full(count, np.nan)))
+
+    def pop(self, rows, vectors, is_quaternion = False, time_stamps = None):
+        """
+        Adds a new sample to the filter of each row.
+
+        :params rows: array of distinct row indices
+        :params vectors: the new vectors, one per row
+        :params is_quaternion: if filtering rotations, and True, the vectors
+            are quaternions, otherwise rotation vectors.
+        :params time_stamps: optional time stamps, in seconds, one per row
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if self._rotation and not is_quaternion:
+            vectors = rvecs_to_quaternions(vectors)
+        vectors = np.reshape(np.asarray(vectors, dtype=np.float64),
+                             (rows.shape[0], self._estimate.shape[1]))
+
+        valid = ~np.isnan(vectors).any(axis=1)
+        rows = rows[valid]
+        vectors = vectors[valid]
+
+        # The time step is from the row's last valid sample, so it spans
+        # any samples missed while the tool was hidden, and is the
+        # default period for a row's first sample, or without time stamps.
+        time_deltas = np.full(rows.shape[0], self._default_period)
+        if time_stamps is not None:
+            time_stamps = np.reshape(
+                np.asarray(time_stamps, dtype=np.float64), valid.shape)[valid]
+            with np.errstate(invalid='ignore'):
+                deltas = time_stamps - self._last_time[rows]
+                usable = deltas > 0.0
+            time_deltas[usable] = deltas[usable]
+            self._last_time[rows] = np.where(np.isnan(time_stamps),
+                                             self._last_time[rows],
+                                             time_stamps)
+
+        first = ~self._initialised[rows]
+        if self._rotation:
+            flip = np.sum(vectors * self._estimate[rows], axis=1) < 0.0
+            vectors[flip] = -vectors[flip]
+
+        self._update(rows, vectors, time_deltas, first)
+        self._initialised[rows] = True
+
+    def getmean(self, rows):
+        """
+        Returns the filtered vector for each row, nan for rows that
+        have had no valid samples.
+
+        :params rows: array of row indices
+        :return: the estimates, one row per row index
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        estimates = np.array(self._estimate[rows])
+        estimates[~self._initialised[rows]] = np.nan
+        if self._rotation:
+            estimates /= np.linalg.norm(estimates, axis=1, keepdims=True)
+        return estimates
+
+    @abstractmethod
+    def _update(self, rows, vectors, time_deltas, first):
+        """
+        Updates the estimates of rows with new, valid, samples.
+
+        :params rows: array of distinct row indices
+        :params vectors: the new samples, one per row
+        :params time_deltas: the time since the previous sample, one per row
+        :params first: True for rows which have no previous samples
+        """
+
+
+class ExponentialFilterArray(SmoothingFilterArray):
+    """
+    Exponential moving average, estimate = alpha * sample +
+    (1 - alpha) * estimate. Alpha close to 1 follows the data closely,
+    alpha close to 0 smooths more, with more lag.
+    """
+    def __init__(self, vector_size=3, rotation=False, alpha=0.5):
+        """
+        :params vector_size: the length of the vectors to filter.
+        :params rotation: if True filter rotations, as quaternions.
+        :params alpha: the smoothing factor, 0 < alpha <= 1.
+        :raises: ValueError
+        """
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("Alpha must be greater than 0 and at most 1")
+        super().__init__(vector_size, rotation)
+        self._alpha = alpha
+
+    def _update(self, rows, vectors, _time_deltas, first):
+        """
+        Exponential moving average update, see base class.
+        """
+        alpha = np.where(first, 1.0, self._alpha)[:, np.newaxis]
+        self._estimate[rows] = alpha * vectors \
+            + (1.0 - alpha) * self._estimate[rows]
+
+
+def _smoothing_factor(time_deltas, cutoff):
+    """
+    The exponential smoothing factor for a low pass filter with a
+    given cutoff frequency, in Hz, at a given sample interval.
+    """
+    time_constant = 1.0 / (2.0 * math.pi * cutoff)
+    return 1.0 / (1.0 + time_constant / time_deltas)
+
+
+class OneEuroFilterArray(SmoothingFilterArray):
+    """
+    The One Euro filter, an exponential filter whose cutoff frequency
+    rises with the speed of the signal, cutoff = min_cutoff +
+    beta * speed. Decrease min_cutoff to reduce jitter when
+    still, and increase beta to reduce lag when moving.
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def __init__(self, vector_size=3, rotation=False, frequency=60.0,
+                 min_cutoff=1.0, beta=0.0, derivative_cutoff=1.0):
+        """
+        :params vector_size: the length of the vectors to filter.
+        :params rotation: if True filter rotations, as quaternions.
+        :params frequency: the expected sample rate in Hz.
+        :params min_cutoff: the cutoff frequency, in Hz, when still.
+        :params beta: how much the cutoff rises with speed.
+        :params derivative_cutoff: the cutoff frequency, in Hz, used to
+            smooth the speed estimate.
+        :raises: ValueError
+        """
+        if min_cutoff <= 0.0 or derivative_cutoff <= 0.0:
+            raise ValueError("Cutoff frequencies must be greater than zero")
+        if beta < 0.0:
+            raise ValueError("Beta must not be negative")
+        super().__init__(vector_size, rotation, frequency)
+        self._min_cutoff = min_cutoff
+        self._beta = beta
+        self._derivative_cutoff = derivative_cutoff
+        self._derivative = np.zeros((0, self._estimate.shape[1]))
+
+    def add_rows(self, count=1):
+        """
+        Adds empty rows to the end of the array.
+
+        :params count: the number of rows to add.
+        """
+        super().add_rows(count)
+        self._derivative = np.concatenate(
+            (self._derivative, np.zeros((count, self._derivative.shape[1]))))
+
+    def _update(self, rows, vectors, time_deltas, first):
+        """
+        One Euro filter update, see base class.
+        """
+        estimate = np.where(first[:, np.newaxis], vectors,
+                            self._estimate[rows])
+        time_deltas = time_deltas[:, np.newaxis]
+
+        derivative_alpha = _smoothing_factor(time_deltas,
+                                             self._derivative_cutoff)
+        derivative = derivative_alpha * (vectors - estimate) / time_deltas \
+            + (1.0 - derivative_alpha) * self._derivative[rows]
+
+        speed = np.linalg.norm(derivative, axis=1, keepdims=True)
+        alpha = _smoothing_factor(time_deltas,
+                                  self._min_cutoff + self._beta * speed)
+
+        self._derivative[rows] = derivative
+        self._estimate[rows] = alpha * vectors + (1.0 - alpha) * estimate
+
+
+class KalmanFilterArray(SmoothingFilterArray):
+    """
+    A constant velocity Kalman filter, run independently on each
+    component of each vector. The state is position and velocity,
+    the process noise is white noise acceleration, with spectral
+    density process_noise, and the measurement noise
+    has variance measurement_noise. Increasing the ratio of
+    process_noise to measurement_noise follows the data more closely.
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def __init__(self, vector_size=3, rotation=False, frequency=60.0,
+                 process_noise=1.0, measurement_noise=1.0):
+        """
+        :params vector_size: the length of the vectors to filter.
+        :params rotation: if True filter rotations, as quaternions.
+        :params frequency: the expected sample rate in Hz.
+        :params process_noise: process noise spectral density.
+        :params measurement_noise: measurement noise variance.
+        :raises: ValueError
+        """
+        if process_noise <= 0.0 or measurement_noise <= 0.0:
+            raise ValueError("Noise parameters must be greater than zero")
+        super().__init__(vector_size, rotation, frequency)
+        self._process_noise = process_noise
+        self._measurement_noise = measurement_noise
+        # Velocity, and the position/velocity covariance, per component
+        self._velocity = np.zeros((0, self._estimate.shape[1]))
+        self._covariance = np.zeros((0, self._estimate.shape[1], 3))
+
+    def add_rows(self, count=1):
+        """
+        Adds empty rows to the end of the array.
+
+        :params count: the number of rows to add.
+        """
+        super().add_rows(count)
+        self._velocity = np.concatenate(
+            (self._velocity, np.zeros((count, self._velocity.shape[1]))))
+        self._covariance = np.concatenate(
+            (self._covariance,
+             np.zeros((count,) + self._covariance.shape[1:])))
+
+    def _update(self, rows, vectors, time_deltas, first):
+        """
+        Kalman filter predict and update, see base class.
+        """
+        time_deltas = time_deltas[:, np.newaxis]
+        position = self._estimate[rows]
+        velocity = self._velocity[rows]
+        covariance = self._covariance[rows]
+        pos_var = covariance[:, :, 0]
+        cross = covariance[:, :, 1]
+        vel_var = covariance[:, :, 2]
+
+        # Predict
+        position = position + velocity * time_deltas
+        pos_var = pos_var + 2.0 * time_deltas * cross \
+            + time_deltas * time_deltas * vel_var \
+            + self._process_noise * time_deltas ** 3 / 3.0
+        cross = cross + time_deltas * vel_var \
+            + self._process_noise * time_deltas ** 2 / 2.0
+        vel_var = vel_var + self._process_noise * time_deltas
+
+        # Update
+        innovation_var = pos_var + self._measurement_noise
+        position_gain = pos_var / innovation_var
+        velocity_gain = cross / innovation_var
+        innovation = vectors - position
+        position = position + position_gain * innovation
+        velocity = velocity + velocity_gain * innovation
+        vel_var = vel_var - velocity_gain * cross
+        cross = (1.0 - position_gain) * cross
+        pos_var = (1.0 - position_gain) * pos_var
+
+        # Start new rows at the first sample, not moving, with the
+        # velocity as uncertain as one step of measurement noise.
+        first = first[:, np.newaxis]
+        self._estimate[rows] = np.where(first, vectors, position)
+        self._velocity[rows] = np.where(first, 0.0, velocity)
+        self._covariance[rows] = np.stack(
+            (np.where(first, self._measurement_noise, pos_var),
+             np.where(first, 0.0, cross),
+             np.where(first, self._measurement_noise
+                      / (time_deltas * time_deltas), vel_var)), axis=2)
+
+
+def create_smoothing_filters(configuration = None):
+    """
+    Creates the rotation and translation filters selected by a tracker
+    configuration dictionary, for use by TrackingSmoother.
+
+    The 'smoothing filter' key selects the filter, one of
+    'rolling mean' (the default), 'exponential', 'one euro' or
+    'kalman'. The other keys, and their defaults, are:
+
+    * 'smoothing frequency': 60.0, the sample rate in Hz
+    * 'smoothing alpha': 0.5, for 'exponential'
+    * 'one euro min cutoff': 1.0, 'one euro beta': 0.0 and
+      'one euro derivative cutoff': 1.0, for 'one euro'
+    * 'kalman process noise': 1.0 and 'kalman measurement noise': 1.0,
+      for 'kalman'
+
+    :param configuration: optional dictionary, as passed to SKSBaseTracker
+    :returns: rotation filter, translation filter, or None, None for
+        the rolling mean
+    :raises: ValueError if the filter name is not recognised
+    """
+    if configuration is None:
+        configuration = {}
+
+    name = configuration.get('smoothing filter', 'rolling mean')
+    if name == 'rolling mean':
+        return None, None
+
+    frequency = configuration.get('smoothing frequency', 60.0)
+    filters = []
+    for rotation in [True, False]:
+        if name == 'exponential':
+            filters.append(ExponentialFilterArray(
+                3, rotation, configuration.get('smoothing alpha', 0.5)))
+        elif name == 'one euro':
+            filters.append(OneEuroFilterArray(
+                3, rotation, frequency,
+                configuration.get('one euro min cutoff', 1.0),
+                configuration.get('one euro beta', 0.0),
+                configuration.get('one euro derivative cutoff', 1.0)))
+        elif name == 'kalman':
+            filters.append(KalmanFilterArray(
+                3, rotation, frequency,
+                configuration.get('kalman process noise', 1.0),
+                configuration.get('kalman measurement noise', 1.0)))
+        else:
+            raise ValueError("Unknown smoothing filter: " + str(name))
+
+    return filters[0], filters[1]
@@ -2,12 +2,9 @@
 
 """ Classes and functions for smoothing tracking data """
 
-import warnings
 import math
 import numpy as np
 
-from sksurgerycore.algorithms.averagequaternions import average_quaternions
-
 def _rvec_to_quaternion(rvec):
     """
     Convert a rotation in opencv's rvec format to
@@ -63,9 +60,113 @@ def quaternion_to_matrix(quat):
 
     return rot_mat
 
+def rvecs_to_quaternions(rvecs):
+    """
+    Convert rotations in opencv's rvec format to quaternions,
+    vectorised over many rotations. Gives the same results as
+    _rvec_to_quaternion, row by row, so rows containing a nan
+    give a nan quaternion, and zero rotations give (1, 0, 0, 0).
+
+    :params rvecs: The rotation vectors (Nx3)
+    :return: The quaternions (Nx4), (qw, qx, qy, qz)
+    """
+    rvecs = np.reshape(np.asarray(rvecs, dtype=np.float64), (-1, 3))
+    angles = np.linalg.norm(rvecs, axis=1)
+
+    # sin(angle/2) / angle, which is 0 for zero angles, as there is no axis
+    scale = np.zeros(angles.shape)
+    np.divide(np.sin(angles / 2), angles, out=scale, where=angles > 0.0)
+
+    quaternions = np.empty((rvecs.shape[0], 4))
+    quaternions[:, 0] = np.cos(angles / 2)
+    np.multiply(rvecs, scale[:, np.newaxis], out=quaternions[:, 1:4])
+    quaternions[np.isnan(angles)] = np.nan
+    return quaternions
+
+
+def quaternions_to_matrices(quaternions, out = None):
+    """
+    Convert quaternions to rotation matrices, vectorised over many
+    rotations. Gives the same results as quaternion_to_matrix,
+    quaternion by quaternion.
+
+    :params quaternions: the quaternions (Nx4), (qw, qx, qy, qz)
+    :params out: optional Nx3x3 array to write the result to, which
+        may be a view, for example the rotation part of Nx4x4 transforms
+    :return: the rotation matrices (Nx3x3)
+    """
+    quaternions = np.reshape(np.asarray(quaternions, dtype=np.float64),
+                             (-1, 4))
+    q_w, q_x, q_y, q_z = quaternions.T
+
+    rot_mats = out
+    if rot_mats is None:
+        rot_mats = np.empty((quaternions.shape[0], 3, 3))
+
+    rot_mats[:, 0, 0] = 1.0 - 2 * q_y * q_y - 2 * q_z * q_z
+    rot_mats[:, 0, 1] = 2 * q_x * q_y - 2 * q_z * q_w
+    rot_mats[:, 0, 2] = 2 * q_x * q_z + 2 * q_y * q_w
+
+    rot_mats[:, 1, 0] = 2 * q_x * q_y + 2 * q_z * q_w
+    rot_mats[:, 1, 1] = 1.0 - 2 * q_x * q_x - 2 * q_z * q_z
+    rot_mats[:, 1, 2] = 2 * q_y * q_z - 2 * q_x * q_w
+
+    rot_mats[:, 2, 0] = 2 * q_x * q_z - 2 * q_y * q_w
+    rot_mats[:, 2, 1] = 2 * q_y * q_z + 2 * q_x * q_w
+    rot_mats[:, 2, 2] = 1 - 2 * q_x * q_x - 2 * q_y * q_y
+
+    return rot_mats
+
+
+def matrices_to_quaternions(matrices):
+    """
+    Convert rotation matrices to unit quaternions, vectorised over many
+    rotations, using Shepperd's method, which divides by the largest of
+    qw, qx, qy and qz for numerical stability. The inverse of
+    quaternions_to_matrices, up to the sign of the quaternion.
+
+    :params matrices: the rotation matrices (Nx3x3), or rigid
+        transforms (Nx4x4)
+    :return: the quaternions (Nx4), (qw, qx, qy, qz), nan where the
+        matrix contains nans
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    matrices = np.reshape(matrices, (-1,) + matrices.shape[-2:])[:, 0:3, 0:3]
+    m00, m01, m02 = matrices[:, 0].T
+    m10, m11, m12 = matrices[:, 1].T
+    m20, m21, m22 = matrices[:, 2].T
+
+    # products[:, i, j] is 4 * q_i * q_j
+    products = np.empty((matrices.shape[0], 4, 4))
+    products[:, 0, 0] = 1.0 + m00 + m11 + m22
+    products[:, 1, 1] = 1.0 + m00 - m11 - m22
+    products[:, 2, 2] = 1.0 - m00 + m11 - m22
+    products[:, 3, 3] = 1.0 - m00 - m11 + m22
+    products[:, 0, 1] = products[:, 1, 0] = m21 - m12
+    products[:, 0, 2] = products[:, 2, 0] = m02 - m20
+    products[:, 0, 3] = products[:, 3, 0] = m10 - m01
+    products[:, 1, 2] = products[:, 2, 1] = m01 + m10
+    products[:, 1, 3] = products[:, 3, 1] = m02 + m20
+    products[:, 2, 3] = products[:, 3, 2] = m12 + m21
+
+    diagonal = np.nan_to_num(np.diagonal(products, axis1=1, axis2=2),
+                             nan=1.0)
+    pivots = np.argmax(diagonal, axis=1)
+    rows = np.arange(matrices.shape[0])
+    pivot_rows = products[rows, pivots]
+    scales = 2.0 * np.sqrt(pivot_rows[rows, pivots])
+    return pivot_rows / scales[:, np.newaxis]
+
+
 class RollingMean():
     """
-    Performs rolling average calculations on numpy arrays
+    Performs rolling average calculations on numpy arrays.
+
+    The buffer is a ring, with a write index, and the class keeps
+    a running sum and count of the non nan values, so adding a
+    vector and getting the mean are both O(vector_size), independent
+    of the buffer size. The running sum is recomputed each
+    time the ring wraps around, so rounding errors can't accumulate.
     """
     def __init__(self, vector_size=3, buffer_size=1, datatype = float):
         """
@@ -85,6 +186,11 @@ class RollingMean():
             self._buffer[:] = -1
 
         self._vector_size = vector_size
+        self._next = 0
+        self._sum = np.zeros(vector_size, dtype=np.float64)
+        self._valid = np.zeros(vector_size, dtype=np.int64)
+        self._nan_mean = np.full(vector_size, np.nan)
+        self._resync()
 
     def pop(self, vector):
         """
@@ -92,23 +198,59 @@ class RollingMean():
 
         :params vector: A new vector to place at the start of the buffer.
         """
-        self._buffer = np.roll(self._buffer, shift=1, axis=0)
-        self._buffer[0, :] = np.reshape(vector, (1, self._vector_size))
+        oldest = self._buffer[self._next]
+        self._subtract(oldest)
+        oldest[:] = np.reshape(vector, (self._vector_size,))
+        self._accumulate(oldest)
+
+        self._next += 1
+        if self._next == self._buffer.shape[0]:
+            self._next = 0
+            self._resync()
 
     def getmean(self):
         """
         Returns the mean vector across the buffer, ignoring  nans
         """
-        with warnings.catch_warnings():
-            #nanmean raises a warning if all values are nan,
-            #we're not concerned with that, as long as it returns nan
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            return np.nanmean(self._buffer, 0)
+        return np.divide(self._sum, self._valid, out=self._nan_mean.copy(),
+                         where=self._valid > 0)
+
+    def _accumulate(self, vector):
+        """
+        Adds a vector entering the buffer to the running sum.
+        """
+        valid = ~np.isnan(vector)
+        self._sum += np.where(valid, vector, 0.0)
+        self._valid += valid
+
+    def _subtract(self, vector):
+        """
+        Removes a vector leaving the buffer from the running sum.
+        """
+        valid = ~np.isnan(vector)
+        self._sum -= np.where(valid, vector, 0.0)
+        self._valid -= valid
+
+    def _resync(self):
+        """
+        Recomputes the running sum and count from the buffer.
+        """
+        valid = ~np.isnan(self._buffer)
+        self._sum[:] = np.sum(self._buffer, axis=0, where=valid)
+        self._valid[:] = np.sum(valid, axis=0)
 
 
 class RollingMeanRotation(RollingMean):
     """
-    Performs rolling average calculations on rotation vectors
+    Performs rolling average calculations on rotation vectors.
+
+    The average is the eigenvector, with the largest eigenvalue, of the
+    sum of the outer products of the quaternions in the buffer, see
+    sksurgerycore.algorithms.averagequaternions. The 4x4 sum is kept up
+    to date as quaternions enter and leave the buffer, so getmean only
+    needs a symmetric 4x4 eigen decomposition, independent of the
+    buffer size. As q and -q are the same rotation, the sign of
+    the mean is chosen to agree with the newest quaternion.
     """
     def __init__(self, buffer_size=1):
         """
@@ -116,6 +258,9 @@ class RollingMeanRotation(RollingMean):
 
         :params buffer_size: the size of the rolling window.
         """
+        self._outer_sum = np.zeros((4, 4), dtype=np.float64)
+        self._samples = 0
+        self._last_valid = 0
         super().__init__(4, buffer_size)
 
     def pop(self, vector, is_quaternion = False):
@@ -135,15 +280,379 @@ class RollingMeanRotation(RollingMean):
 
     def getmean(self):
         """
-        Returns the mean quaternion across the buffer, ignoring nans
+        Returns the mean quaternion across the buffer, ignoring nans.
+        Quaternions containing any nan are ignored.
+        """
+        if self._samples == 0:
+            return np.full(4, np.nan)
+
+        _, eigen_vectors = np.linalg.eigh(self._outer_sum)
+        mean = eigen_vectors[:, 3]
+        if np.dot(mean, self._buffer[self._last_valid]) < 0.0:
+            mean = -mean
+        return mean
+
+    def _accumulate(self, vector):
+        """
+        Adds a quaternion entering the buffer to the outer product sum.
+        """
+        if not np.isnan(vector).any():
+            self._outer_sum += np.outer(vector, vector)
+            self._samples += 1
+            self._last_valid = self._next
+
+    def _subtract(self, vector):
+        """
+        Removes a quaternion leaving the buffer from the outer product sum.
+        """
+        if not np.isnan(vector).any():
+            self._outer_sum -= np.outer(vector, vector)
+            self._samples -= 1
+
+    def _resync(self):
+        """
+        Recomputes the outer product sum from the buffer.
+        """
+        valid = self._buffer[~np.isnan(self._buffer).any(axis=1)]
+        self._outer_sum[:] = np.matmul(valid.T, valid)
+        self._samples = valid.shape[0]
+
+
+class RollingMeanArray():
+    """
+    Performs rolling average calculations on many vectors at once,
+    for example one per tracked tool. This is equivalent to a list of
+    RollingMean objects, one per row, but the buffers are stored in a
+    single (rows, buffer_size, vector_size) array, so a batch of rows
+    can be updated, or averaged, with a few vectorised operations.
+    """
+    def __init__(self, vector_size=3, buffer_size=1, datatype = float):
+        """
+        Performs rolling average calculations on many vectors at once.
+        Starts with no rows, see add_rows.
+
+        :params vector_size: the length of the vectors to do rolling
+            averages on.
+        :params buffer_size: the size of the rolling window.
+        """
+        if buffer_size < 1:
+            raise ValueError("Buffer size must be a least 1")
+
+        self._fill_value = -1
+        if datatype in [float, np.float32, np.float64]:
+            self._fill_value = np.nan
+
+        self._buffer = np.empty((0, buffer_size, vector_size), dtype=datatype)
+        self._next = np.zeros(0, dtype=np.intp)
+        self._sum = np.zeros((0, vector_size), dtype=np.float64)
+        self._valid = np.zeros((0, vector_size), dtype=np.int64)
+
+    def __len__(self):
+        """
+        Returns the number of rows.
         """
-        no_nan_buffer = self._buffer[~np.isnan(self._buffer)]
-        samples = int(no_nan_buffer.shape[0]/4)
+        return self._buffer.shape[0]
 
-        if samples == 1:
-            return self._buffer[0]
+    def add_rows(self, count=1):
+        """
+        Adds empty rows to the end of the array.
+
+        :params count: the number of rows to add.
+        """
+        first_row = len(self)
+        new_buffer = np.full((count,) + self._buffer.shape[1:],
+                             self._fill_value, dtype=self._buffer.dtype)
+        self._buffer = np.concatenate((self._buffer, new_buffer))
+        self._next = np.concatenate((self._next,
+                                     np.zeros(count, dtype=np.intp)))
+        self._sum = np.concatenate((self._sum,
+                                    np.zeros((count, self._sum.shape[1]))))
+        self._valid = np.concatenate(
+            (self._valid,
+             np.zeros((count, self._valid.shape[1]), dtype=np.int64)))
+        self._resync(np.arange(first_row, len(self)))
+
+    def pop(self, rows, vectors, time_stamps = None):
+        """
+        Adds a new vector to the buffer of each row,
+        removing the oldest one.
+
+        :params rows: array of distinct row indices
+        :params vectors: the new vectors, one per row
+        :params time_stamps: unused, for compatibility with the filters
+            in sksurgerycore.algorithms.tracking_filters
+        """
+        # pylint: disable=unused-argument
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = self._next[rows]
+
+        self._subtract(rows, self._buffer[rows, columns])
+        self._buffer[rows, columns] = np.reshape(
+            vectors, (rows.shape[0], self._buffer.shape[2]))
+        self._accumulate(rows, columns, self._buffer[rows, columns])
+
+        columns += 1
+        wrapped = columns == self._buffer.shape[1]
+        columns[wrapped] = 0
+        self._next[rows] = columns
+        if wrapped.any():
+            self._resync(rows[wrapped])
+
+    def getmean(self, rows):
+        """
+        Returns the mean vector across the buffer for each row,
+        ignoring nans.
+
+        :params rows: array of row indices
+        :return: the means, one row per row index
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        valid = self._valid[rows]
+        return np.divide(self._sum[rows], valid,
+                         out=np.full(valid.shape, np.nan), where=valid > 0)
+
+    def _accumulate(self, rows, _columns, vectors):
+        """
+        Adds vectors entering the buffers to the running sums.
+        """
+        valid = ~np.isnan(vectors)
+        self._sum[rows] += np.where(valid, vectors, 0.0)
+        self._valid[rows] += valid
+
+    def _subtract(self, rows, vectors):
+        """
+        Removes vectors leaving the buffers from the running sums.
+        """
+        valid = ~np.isnan(vectors)
+        self._sum[rows] -= np.where(valid, vectors, 0.0)
+        self._valid[rows] -= valid
 
-        if no_nan_buffer.shape[0] > 0:
-            return average_quaternions(np.reshape(no_nan_buffer, (samples, 4)))
+    def _resync(self, rows):
+        """
+        Recomputes the running sums and counts of rows from the buffer.
+        """
+        buffers = self._buffer[rows]
+        valid = ~np.isnan(buffers)
+        self._sum[rows] = np.sum(buffers, axis=1, where=valid)
+        self._valid[rows] = np.sum(valid, axis=1)
+
+
+class RollingMeanRotationArray(RollingMeanArray):
+    """
+    Performs rolling average calculations on many rotations at once,
+    equivalent to a list of RollingMeanRotation objects, one per row.
+    """
+    def __init__(self, buffer_size=1):
+        """
+        Performs rolling average calculations on many rotations at once.
 
-        return [np.nan, np.nan, np.nan, np.nan]
+        :params buffer_size: the size of the rolling window.
+        """
+        super().__init__(4, buffer_size)
+        self._outer_sum = np.zeros((0, 4, 4), dtype=np.float64)
+        self._samples = np.zeros(0, dtype=np.int64)
+        self._last_valid = np.zeros(0, dtype=np.intp)
+
+    def add_rows(self, count=1):
+        """
+        Adds empty rows to the end of the array.
+
+        :params count: the number of rows to add.
+        """
+        self._outer_sum = np.concatenate((self._outer_sum,
+                                          np.zeros((count, 4, 4))))
+        self._samples = np.concatenate((self._samples,
+                                        np.zeros(count, dtype=np.int64)))
+        self._last_valid = np.concatenate(
+            (self._last_valid, np.zeros(count, dtype=np.intp)))
+        super().add_rows(count)
+
+    # pylint: disable=arguments-renamed
+    def pop(self, rows, vectors, is_quaternion = False, time_stamps = None):
+        """
+        Adds a new rotation to the buffer of each row,
+        removing the oldest one.
+
+        :params rows: array of distinct row indices
+        :params vectors: the new rotation vectors, one per row
+        :params is_quaternion: if true treat the vectors as quaternions
+        :params time_stamps: unused, for compatibility with the filters
+            in sksurgerycore.algorithms.tracking_filters
+        """
+        # pylint: disable=unused-argument
+        if not is_quaternion:
+            vectors = rvecs_to_quaternions(vectors)
+        super().pop(rows, vectors)
+
+    def getmean(self, rows):
+        """
+        Returns the mean quaternion across the buffer for each row,
+        ignoring nans, see RollingMeanRotation.getmean.
+
+        :params rows: array of row indices
+        :return: the mean quaternions, one row per row index
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        means = np.full((rows.shape[0], 4), np.nan)
+        have_samples = self._samples[rows] > 0
+        rows = rows[have_samples]
+        if rows.shape[0] == 0:
+            return means
+
+        _, eigen_vectors = np.linalg.eigh(self._outer_sum[rows])
+        mean = eigen_vectors[:, :, 3]
+        newest = self._buffer[rows, self._last_valid[rows]]
+        flip = np.sum(mean * newest, axis=1) < 0.0
+        mean[flip] = -mean[flip]
+        means[have_samples] = mean
+        return means
+
+    def _accumulate(self, rows, columns, vectors):
+        """
+        Adds quaternions entering the buffers to the outer product sums.
+        """
+        valid = ~np.isnan(vectors).any(axis=1)
+        vectors = np.where(valid[:, np.newaxis], vectors, 0.0)
+        self._outer_sum[rows] += vectors[:, :, np.newaxis] \
+            * vectors[:, np.newaxis, :]
+        self._samples[rows] += valid
+        self._last_valid[rows] = np.where(valid, columns,
+                                          self._last_valid[rows])
+
+    def _subtract(self, rows, vectors):
+        """
+        Removes quaternions leaving the buffers from the outer product sums.
+        """
+        valid = ~np.isnan(vectors).any(axis=1)
+        vectors = np.where(valid[:, np.newaxis], vectors, 0.0)
+        self._outer_sum[rows] -= vectors[:, :, np.newaxis] \
+            * vectors[:, np.newaxis, :]
+        self._samples[rows] -= valid
+
+    def _resync(self, rows):
+        """
+        Recomputes the outer product sums of rows from the buffer.
+        """
+        buffers = self._buffer[rows]
+        valid = ~np.isnan(buffers).any(axis=2)
+        buffers = np.where(valid[:, :, np.newaxis], buffers, 0.0)
+        self._outer_sum[rows] = np.matmul(np.swapaxes(buffers, 1, 2), buffers)
+        self._samples[rows] = np.sum(valid, axis=1)
+
+
+class TrackingSmoother():
+    """
+    Smooths tracking data for many tools at once, using one
+    RollingMeanArray per quantity, with one row per tool.
+    The rotations and translations can instead be smoothed by any
+    object with the same interface, such as the filters in
+    sksurgerycore.algorithms.tracking_filters.
+    Port handles are mapped to rows through a dictionary, so a
+    whole frame, for all tools, is added, or averaged, with a few
+    vectorised operations.
+    """
+    def __init__(self, buffer_size=1, port_handles=None,
+                 rotation_filter=None, translation_filter=None):
+        """
+        :params buffer_size: the size of the rolling window.
+        :params port_handles: optional list of port handles to
+            create buffers for.
+        :params rotation_filter: optional filter for the rotations,
+            with no rows, defaults to a RollingMeanRotationArray.
+        :params translation_filter: optional filter for the translations,
+            with no rows, defaults to a RollingMeanArray.
+        """
+        self.port_handles = []
+        self._rows = {}
+        self.time_stamps = RollingMeanArray(1, buffer_size)
+        #let's not average the frame numbers, set buffer = 1, and
+        #keep them as floats, so missing frame numbers can be nan
+        self.frame_numbers = RollingMeanArray(1, 1)
+        self.qualities = RollingMeanArray(1, buffer_size)
+        self.rvec_rolling_means = rotation_filter
+        if rotation_filter is None:
+            self.rvec_rolling_means = RollingMeanRotationArray(buffer_size)
+        self.tvec_rolling_means = translation_filter
+        if translation_filter is None:
+            self.tvec_rolling_means = RollingMeanArray(3, buffer_size)
+        if port_handles is not None:
+            self.rows(port_handles, add_missing=True)
+
+    def rows(self, port_handles, add_missing=False):
+        """
+        Returns the rows for a list of port handles.
+
+        :params port_handles: a list of port handles
+        :params add_missing: if True, create buffers for port
+            handles we haven't seen before
+        :return: array of row indices
+        :raises: ValueError if a port handle isn't found, and not
+            add_missing
+        """
+        rows = np.empty(len(port_handles), dtype=np.intp)
+        for index, port_handle in enumerate(port_handles):
+            row = self._rows.get(port_handle)
+            if row is None:
+                if not add_missing:
+                    raise ValueError(str(port_handle) + " not found in " +
+                                     "tracking buffers, did you call " +
+                                     "smooth_tracking before add_frame?")
+                row = len(self.port_handles)
+                self._rows[port_handle] = row
+                self.port_handles.append(port_handle)
+                for buffer in self._buffers():
+                    buffer.add_rows(1)
+            rows[index] = row
+        return rows
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def add_frame(self, port_handles, time_stamps, frame_numbers,
+                  tracking_rot, tracking_trans, quality,
+                  rot_is_quaternion = False):
+        """
+        Adds a frame of tracking data for any number of tools.
+        See SKSBaseTracker.add_frame_to_buffer for the parameters.
+        """
+        rows = self.rows(port_handles, add_missing=True)
+        if np.unique(rows).shape[0] != rows.shape[0]:
+            # Repeated port handles are added in turn.
+            for index in range(rows.shape[0]):
+                self.add_frame(
+                    port_handles[index:index + 1],
+                    time_stamps[index:index + 1],
+                    frame_numbers[index:index + 1],
+                    tracking_rot[index:index + 1],
+                    tracking_trans[index:index + 1],
+                    quality[index:index + 1], rot_is_quaternion)
+            return
+
+        self.time_stamps.pop(rows, time_stamps)
+        self.frame_numbers.pop(rows, frame_numbers)
+        self.rvec_rolling_means.pop(rows, tracking_rot, rot_is_quaternion,
+                                    time_stamps = time_stamps)
+        self.tvec_rolling_means.pop(rows, tracking_trans,
+                                    time_stamps = time_stamps)
+        self.qualities.pop(rows, quality)
+
+    def get_means(self, port_handles):
+        """
+        Returns the smoothed tracking data for a list of port handles.
+
+        :params port_handles: a list of port handles
+        :return: time stamps (N), frame numbers (N), quaternions (Nx4),
+            translations (Nx3), qualities (N)
+        :raises: ValueError if a port handle isn't found
+        """
+        rows = self.rows(port_handles)
+        return (self.time_stamps.getmean(rows)[:, 0],
+                self.frame_numbers.getmean(rows)[:, 0],
+                self.rvec_rolling_means.getmean(rows),
+                self.tvec_rolling_means.getmean(rows),
+                self.qualities.getmean(rows)[:, 0])
+
+    def _buffers(self):
+        """
+        Returns all the rolling mean arrays.
+        """
+        return (self.time_stamps, self.frame_numbers, self.qualities,
+                self.rvec_rolling_means, self.tvec_rolling_means)
@@ -21,3 +21,21 @@ def distance_from_line(p_1, p_2, p_3):
     vector_to_line = a_minus_p - (np.dot(a_minus_p, n) * n)
     distance = np.linalg.norm(vector_to_line)
     return distance
+
+
+def distances_from_line(p_1, p_2, points):
+    """
+    Computes distances of many points from a line defined by p_1 and p_2,
+    as distance_from_line, but for an N x 3 array of points at once.
+
+    :param p_1: a point on the line
+    :param p_2: another point on the line
+    :param points: N x 3 ndarray of points
+    :return: N ndarray of euclidean distances
+    """
+    direction = p_2 - p_1
+    direction = direction / np.linalg.norm(direction)
+    a_minus_p = p_1 - points
+    vectors_to_line = a_minus_p \
+        - np.outer(np.matmul(a_minus_p, direction), direction)
+    return np.linalg.norm(vectors_to_line, axis=1)
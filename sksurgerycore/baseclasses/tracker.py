@@ -1,15 +1,158 @@
 """An abstract base class for trackers used in sksurgery"""
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+from collections.abc import Sequence
+from functools import wraps
+import threading
+import time
 import numpy as np
-from sksurgerycore.algorithms.tracking_smoothing import RollingMean, \
-                RollingMeanRotation, quaternion_to_matrix
+from sksurgerycore.algorithms.tracking_smoothing import TrackingSmoother, \
+                quaternions_to_matrices
+from sksurgerycore.algorithms.tracking_filters import \
+                create_smoothing_filters
+
+TrackerFrame = namedtuple('TrackerFrame',
+                          ['port_handles', 'time_stamps', 'frame_numbers',
+                           'tracking', 'tracking_quality'])
+TrackerFrame.__doc__ = """
+An immutable smoothed tracking frame, for all tools, as published
+by SKSBaseTracker.get_latest_frame. port_handles is a tuple, the
+others are read only numpy arrays, with one row per tool. tracking is
+Nx4x4, or Nx1x7 if the tracker uses quaternions.
+"""
+
+
+def _read_only(array):
+    """
+    Returns an array, marked as read only.
+    """
+    array.flags.writeable = False
+    return array
+
+
+class _ToolBuffer():
+    """
+    One tool's row of one of the smoothing buffers, with the getmean and
+    pop methods of the per tool RollingMean and RollingMeanRotation
+    objects that SKSBaseTracker used to keep in lists.
+    """
+    def __init__(self, buffer, row):
+        self._buffer = buffer
+        self._rows = np.array([row], dtype=np.intp)
+
+    def getmean(self):
+        """
+        Returns the smoothed value for the tool.
+        """
+        return self._buffer.getmean(self._rows)[0]
+
+    def pop(self, vector, *args):
+        """
+        Adds a value for the tool, see RollingMean.pop and
+        RollingMeanRotation.pop.
+        """
+        self._buffer.pop(self._rows, np.reshape(vector, (1, -1)), *args)
+
+
+class _ToolBuffers(Sequence):
+    """
+    A read only, list like view of one of the smoothing buffers, with
+    one _ToolBuffer per tool, in the order of the port handles.
+    """
+    def __init__(self, smoother, name):
+        self._smoother = smoother
+        self._name = name
+
+    def __len__(self):
+        return len(self._smoother.port_handles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[row] for row in range(*index.indices(len(self)))]
+        if not -len(self) <= index < len(self):
+            raise IndexError("tool index out of range")
+        return _ToolBuffer(getattr(self._smoother, self._name),
+                           index % len(self))
 
+
+def _start_acquisition_after(start_tracking):
+    """
+    Wraps a start_tracking method, to start the acquisition loop after it.
+    """
+    @wraps(start_tracking)
+    def wrapper(self, *args, **kwargs):
+        result = start_tracking(self, *args, **kwargs)
+        if self.acquisition_rate is not None:
+            self.start_acquisition()
+        return result
+    return wrapper
+
+
+def _stop_acquisition_before(stop_tracking):
+    """
+    Wraps a stop_tracking method, to stop the acquisition loop before it.
+    """
+    @wraps(stop_tracking)
+    def wrapper(self, *args, **kwargs):
+        self.stop_acquisition()
+        return stop_tracking(self, *args, **kwargs)
+    return wrapper
+
+
+# pylint: disable=too-many-public-methods, too-many-instance-attributes
 class SKSBaseTracker(metaclass=ABCMeta):
     """Abstract base class for trackers using in sksurgery.
     Defines methods that all trackers should implement.
+
+    If the configuration sets an 'acquisition rate', in Hz, which needs
+    the derived class to implement acquire_frame, then start_tracking also
+    starts a background thread, that calls acquire_frame at that rate and
+    adds each frame to the smoothing buffers, and stop_tracking stops it.
+    Consumers can then call get_latest_frame without waiting for the
+    hardware.
+
+    The smoothed frame for all tools is computed at most once per new
+    sample, and shared, as an immutable TrackerFrame, by all calls to
+    get_latest_frame until the next sample. Callbacks registered with
+    subscribe are called with each new frame.
+
+    The smoothing buffers for all tools are kept together in a
+    TrackingSmoother, self.smoother. The attributes time_stamps,
+    frame_numbers, qualities, rvec_rolling_means and tvec_rolling_means
+    are read only, list like views of it, with one item per tool, in the
+    order of port_handles, each with getmean and pop methods, so code
+    written for the per tool lists these used to be still works.
+    Setting port_handles replaces the buffers with empty ones
+    for those port handles.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        """
+        Ties the acquisition loop to the derived class's start_tracking
+        and stop_tracking.
+        """
+        super().__init_subclass__(**kwargs)
+        if 'start_tracking' in cls.__dict__:
+            cls.start_tracking = _start_acquisition_after(
+                cls.__dict__['start_tracking'])
+        if 'stop_tracking' in cls.__dict__:
+            cls.stop_tracking = _stop_acquisition_before(
+                cls.__dict__['stop_tracking'])
+
     def __init__(self, configuration = None, tracked_objects = None):
+        """
+        :param configuration: optional dictionary, with keys
+            'smoothing buffer', the length of the rolling mean, default 1,
+            'use quaternions', default False, 'acquisition rate', in Hz,
+            default None for no acquisition loop, and 'smoothing filter'
+            and its parameters, see
+            sksurgerycore.algorithms.tracking_filters.create_smoothing_filters
+        :param tracked_objects: optional list of objects with a name, used
+            as port handles
+        :raises: ValueError if the smoothing filter is not recognised, or
+            the acquisition rate is not greater than zero, or is set and
+            the derived class doesn't override acquire_frame
+        """
         self.buffer_size = 1
         if configuration is not None:
             self.buffer_size = configuration.get('smoothing buffer', 1)
@@ -17,26 +160,77 @@ class SKSBaseTracker(metaclass=ABCMeta):
         self.use_quaternions = False
         if configuration is not None:
             self.use_quaternions = configuration.get('use quaternions', False)
-        self.port_handles = []
-        self.time_stamps = []
-        self.frame_numbers = []
-        self.qualities = []
-        self.rvec_rolling_means = []
-        self.tvec_rolling_means = []
 
+        self.acquisition_rate = None
+        if configuration is not None:
+            self.acquisition_rate = configuration.get('acquisition rate', None)
+        if self.acquisition_rate is not None and self.acquisition_rate <= 0:
+            raise ValueError("Acquisition rate must be greater than zero")
+        if self.acquisition_rate is not None \
+                and type(self).acquire_frame is SKSBaseTracker.acquire_frame:
+            raise ValueError(type(self).__name__ + " does not implement "
+                             "acquire_frame, so can't run an acquisition "
+                             "loop")
+        self._lock = threading.RLock()
+        self._acquisition = None
+        self._acquisition_stop = threading.Event()
+        self._acquisition_error = None
+        self._latest = None
+        self._subscribers = ()
+
+        self._configuration = configuration
+        port_handles = None
         if tracked_objects is not None:
-            for tracked_object in tracked_objects:
-                self.port_handles.append(tracked_object.name)
-                self.time_stamps.append(RollingMean(1, self.buffer_size,
-                        datatype = float))
-                #let's not average the frame numbers, set buffer = 1
-                self.frame_numbers.append(RollingMean(1, 1,
-                        datatype = int))
-                self.qualities.append(RollingMean(1, self.buffer_size,
-                        datatype = float))
-                self.rvec_rolling_means.append(
-                                RollingMeanRotation(self.buffer_size))
-                self.tvec_rolling_means.append(RollingMean(3, self.buffer_size))
+            port_handles = [tracked_object.name
+                            for tracked_object in tracked_objects]
+        self.smoother = self._create_smoother(port_handles)
+
+    def _create_smoother(self, port_handles):
+        """
+        Returns empty smoothing buffers for a list of port handles.
+        """
+        rotation_filter, translation_filter = \
+                        create_smoothing_filters(self._configuration)
+        return TrackingSmoother(self.buffer_size, port_handles,
+                                rotation_filter, translation_filter)
+
+    @property
+    def port_handles(self):
+        """The port handles of the tools in the smoothing buffers"""
+        return self.smoother.port_handles
+
+    @port_handles.setter
+    def port_handles(self, port_handles):
+        """Replaces the smoothing buffers with empty ones for a list
+        of port handles"""
+        with self._lock:
+            self.smoother = self._create_smoother(list(port_handles))
+            self._latest = None
+
+    @property
+    def time_stamps(self):
+        """The time stamp smoothing buffers, one per tool"""
+        return _ToolBuffers(self.smoother, 'time_stamps')
+
+    @property
+    def frame_numbers(self):
+        """The frame number buffers, one per tool"""
+        return _ToolBuffers(self.smoother, 'frame_numbers')
+
+    @property
+    def qualities(self):
+        """The tracking quality smoothing buffers, one per tool"""
+        return _ToolBuffers(self.smoother, 'qualities')
+
+    @property
+    def rvec_rolling_means(self):
+        """The rotation smoothing buffers, one per tool"""
+        return _ToolBuffers(self.smoother, 'rvec_rolling_means')
+
+    @property
+    def tvec_rolling_means(self):
+        """The translation smoothing buffers, one per tool"""
+        return _ToolBuffers(self.smoother, 'tvec_rolling_means')
 
     def get_smooth_frame(self, port_handles):
         """
@@ -59,42 +253,71 @@ class SKSBaseTracker(metaclass=ABCMeta):
 
             tracking_quality : list the tracking quality, one per tool.
         """
-        smth_handles = []
-        smth_times = []
-        smth_frame_nos = []
-        smth_tracking = []
-        smth_qual = []
-        for port_handle in port_handles:
-            try:
-                my_index = self.port_handles.index(port_handle)
-                smth_handles.append(port_handle)
-                smth_times.append(self.time_stamps[my_index].getmean()[0])
-                smth_frame_nos.append(self.frame_numbers[my_index].getmean()[0])
-                mean_quat = self.rvec_rolling_means[my_index].getmean()
-                mean_tvec = self.tvec_rolling_means[my_index].getmean()
-                smth_qual.append(self.qualities[my_index].getmean()[0])
-
-                if self.use_quaternions:
-                    output_matrix = np.full((1,7), np.nan)
-                    output_matrix[0,0:4] = mean_quat
-                    output_matrix[0,4:7] = mean_tvec
-                    smth_tracking.append(output_matrix)
-
-                else:
-                    output_matrix = np.identity(4, dtype=np.float64)
-                    output_matrix[0:3, 0:3] = quaternion_to_matrix(mean_quat)
-                    output_matrix[0:3, 3] = mean_tvec
-                    smth_tracking.append(output_matrix)
-
-            except ValueError:
-                raise ValueError(str(port_handle) + " not found in tracking " +
-                                 "buffers, did you call smooth_tracking " +
-                                 "before add_frame?") from ValueError
-
-        assert len(smth_handles) == len(port_handles)
-
-        return smth_handles, smth_times, smth_frame_nos, smth_tracking, \
-                        smth_qual
+        smth_times, smth_frame_nos, smth_tracking, smth_qual = \
+                        self._smooth_frame(port_handles)
+
+        return list(port_handles), list(smth_times), list(smth_frame_nos), \
+                        list(smth_tracking), list(smth_qual)
+
+    # pylint: disable=too-many-positional-arguments, too-many-arguments
+    def get_smooth_frame_into(self, port_handles, tracking, time_stamps,
+                              frame_numbers, tracking_quality):
+        """
+        As get_smooth_frame, but writes the smoothed data into arrays
+        owned by the caller, rather than building lists, so calling it
+        every frame doesn't create per tool arrays.
+
+        :param port_handles: a list of N port handles to get data for
+        :param tracking: Nx4x4 array for tracking matrices, or Nx7 array
+            for quaternions (qw, qx, qy, qz) and translations (x, y, z).
+            The format is set by the shape, not use_quaternions.
+        :param time_stamps: length N array for the time stamps
+        :param frame_numbers: length N array for the frame numbers
+        :param tracking_quality: length N array for the tracking quality
+        :raises: ValueError if a port handle isn't found, or an array
+            is the wrong shape
+        """
+        count = len(port_handles)
+        if tracking.shape not in ((count, 4, 4), (count, 7)):
+            raise ValueError("Tracking should be Nx4x4 or Nx7, for N "
+                             "port handles")
+        for array in (time_stamps, frame_numbers, tracking_quality):
+            if array.shape != (count,):
+                raise ValueError("Time stamps, frame numbers and qualities "
+                                 "should have one element per port handle")
+
+        with self._lock:
+            time_stamps[:], frame_numbers[:], mean_quats, mean_tvecs, \
+                tracking_quality[:] = self.smoother.get_means(port_handles)
+
+        if tracking.ndim == 2:
+            tracking[:, 0:4] = mean_quats
+            tracking[:, 4:7] = mean_tvecs
+        else:
+            quaternions_to_matrices(mean_quats, out = tracking[:, 0:3, 0:3])
+            tracking[:, 0:3, 3] = mean_tvecs
+            tracking[:, 3, 0:3] = 0.0
+            tracking[:, 3, 3] = 1.0
+
+    def _smooth_frame(self, port_handles):
+        """
+        Returns the smoothed time stamps, frame numbers, tracking
+        and qualities for a list of port handles, as arrays.
+        """
+        with self._lock:
+            smth_times, smth_frame_nos, mean_quats, mean_tvecs, smth_qual = \
+                            self.smoother.get_means(port_handles)
+
+        if self.use_quaternions:
+            smth_tracking = np.concatenate((mean_quats, mean_tvecs), axis=1)
+            smth_tracking = smth_tracking[:, np.newaxis, :]
+        else:
+            smth_tracking = np.zeros((len(port_handles), 4, 4))
+            smth_tracking[:, 0:3, 0:3] = quaternions_to_matrices(mean_quats)
+            smth_tracking[:, 0:3, 3] = mean_tvecs
+            smth_tracking[:, 3, 3] = 1.0
+
+        return smth_times, smth_frame_nos, smth_tracking, smth_qual
 
     # pylint: disable=too-many-positional-arguments
     def add_frame_to_buffer(self, port_handles, time_stamps, frame_numbers,
@@ -111,32 +334,154 @@ class SKSBaseTracker(metaclass=ABCMeta):
         :param quality: list the tracking quality, one per tool.
         :param rot_is_quaternion: True if rotation is a quaternion.
         """
-        for your_index, port_handle in enumerate(port_handles):
-            my_index = None
+        with self._lock:
+            self.smoother.add_frame(port_handles, time_stamps, frame_numbers,
+                                    tracking_rot, tracking_trans, quality,
+                                    rot_is_quaternion)
+            self._latest = None
+            frame = None
+            subscribers = self._subscribers
+            if subscribers:
+                frame = self._publish()
+
+        for callback in subscribers:
+            callback(frame)
+
+    def get_latest_frame(self):
+        """
+        Returns the smoothed frame for every tool in the smoothing buffers,
+        without reading from the tracker. The frame is computed once per
+        new sample, so repeated calls between samples return the same
+        object, without locking. Safe to call while the acquisition loop
+        is running.
+
+        :returns: TrackerFrame, which unpacks like get_smooth_frame
+        :raises: RuntimeError if the acquisition loop failed
+        """
+        if self._acquisition_error is not None:
+            raise RuntimeError("Tracker acquisition failed") \
+                            from self._acquisition_error
+        frame = self._latest
+        if frame is None:
+            with self._lock:
+                frame = self._latest
+                if frame is None:
+                    frame = self._publish()
+        return frame
+
+    def subscribe(self, callback):
+        """
+        Registers a callback to be called with each new TrackerFrame,
+        from the thread that added the sample, so callbacks should
+        return quickly.
+
+        :param callback: callable taking a TrackerFrame
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + (callback,)
+
+    def unsubscribe(self, callback):
+        """
+        Removes a callback registered with subscribe.
+
+        :param callback: the callback to remove
+        :raises: ValueError if the callback isn't subscribed
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+            subscribers.remove(callback)
+            self._subscribers = tuple(subscribers)
+
+    def _publish(self):
+        """
+        Computes the smoothed frame for all tools, and publishes it as the
+        latest frame, with a single reference assignment. Must be called
+        holding the lock.
+        """
+        port_handles = tuple(self.port_handles)
+        smth_times, smth_frame_nos, smth_tracking, smth_qual = \
+                        self._smooth_frame(port_handles)
+        self._latest = TrackerFrame(port_handles, _read_only(smth_times),
+                                    _read_only(smth_frame_nos),
+                                    _read_only(smth_tracking),
+                                    _read_only(smth_qual))
+        return self._latest
+
+    def acquire_frame(self):
+        """
+        Reads one frame from the tracker, without smoothing, for the
+        acquisition loop. Derived classes that support the acquisition
+        loop should override this, the default never has a frame.
+
+        :return: the parameters of add_frame_to_buffer, as a tuple,
+            port_handles, time_stamps, frame_numbers, tracking_rot,
+            tracking_trans, quality and optionally rot_is_quaternion,
+            or None if no new frame is available.
+        """
+        return None
+
+    def is_acquiring(self):
+        """
+        Returns True if the acquisition loop is running.
+        """
+        return self._acquisition is not None and self._acquisition.is_alive()
+
+    def start_acquisition(self):
+        """
+        Starts the acquisition loop, if it isn't already running.
+        Called by start_tracking when an acquisition rate is configured.
+
+        :raises: ValueError if there is no acquisition rate
+        """
+        if self.acquisition_rate is None:
+            raise ValueError("No acquisition rate configured")
+        if self.is_acquiring():
+            return
+        self._acquisition_stop.clear()
+        self._acquisition_error = None
+        self._acquisition = threading.Thread(target=self._acquisition_loop,
+                                             name="tracker acquisition",
+                                             daemon=True)
+        self._acquisition.start()
+
+    def stop_acquisition(self):
+        """
+        Stops the acquisition loop, waiting for the current frame to
+        finish. Does nothing if the loop is not running. Called by
+        stop_tracking.
+        """
+        if self._acquisition is None:
+            return
+        self._acquisition_stop.set()
+        if self._acquisition is not threading.current_thread():
+            self._acquisition.join()
+        self._acquisition = None
+
+    def _acquisition_loop(self):
+        """
+        Calls acquire_frame at the acquisition rate, adding each frame to
+        the smoothing buffers, until stop_acquisition is called. If
+        acquire_frame, or a subscriber, raises, the error is kept for
+        get_latest_frame.
+        """
+        period = 1.0 / self.acquisition_rate
+        next_time = time.monotonic()
+        while not self._acquisition_stop.is_set():
             try:
-                my_index = self.port_handles.index(port_handle)
-
-            except ValueError:
-                self.port_handles.append(port_handle)
-                self.time_stamps.append(RollingMean(1, self.buffer_size,
-                            datatype = float))
-                self.frame_numbers.append(RollingMean(1, 1,
-                            datatype = float))
-                self.qualities.append(RollingMean(1, self.buffer_size,
-                            datatype = float))
-                self.rvec_rolling_means.append(
-                                RollingMeanRotation(self.buffer_size))
-                self.tvec_rolling_means.append(RollingMean(3, self.buffer_size))
-                my_index = self.port_handles.index(port_handle)
-
-            assert my_index >= 0
-
-            self.time_stamps[my_index].pop(time_stamps[your_index])
-            self.frame_numbers[my_index].pop(frame_numbers[your_index])
-            self.rvec_rolling_means[my_index].pop(tracking_rot[your_index],
-                            rot_is_quaternion)
-            self.tvec_rolling_means[my_index].pop(tracking_trans[your_index])
-            self.qualities[my_index].pop(quality[your_index])
+                frame = self.acquire_frame() # pylint: disable=assignment-from-none
+                if frame is not None:
+                    self.add_frame_to_buffer(*frame)
+            except Exception as error: # pylint: disable=broad-except
+                self._acquisition_error = error
+                return
+
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay < 0.0:
+                # We've fallen behind, so don't try to catch up.
+                next_time = time.monotonic()
+                delay = 0.0
+            self._acquisition_stop.wait(delay)
 
 
     @abstractmethod
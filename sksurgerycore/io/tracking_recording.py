@@ -0,0 +1,366 @@
+#  -*- coding: utf-8 -*-
+
+"""
+Classes to record tracking data to a binary file, and to replay it
+through the SKSBaseTracker interface.
+
+The file is a 16 byte header, then one fixed size record
+(RECORD_DTYPE) per tool per frame, appended as the frames arrive.
+As the records are fixed size, a recording is read by memory mapping it
+as a numpy structured array, so each field is a column that can be
+sliced without copying or parsing the file.
+"""
+
+import os
+import time
+import numpy as np
+from sksurgerycore.algorithms.tracking_smoothing import \
+                matrices_to_quaternions
+from sksurgerycore.baseclasses.tracker import SKSBaseTracker
+
+_MAGIC = b'SKSTRACK'
+_VERSION = 1
+_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u8')])
+
+RECORD_DTYPE = np.dtype([('sample', '<i8'),
+                         ('port_handle', 'S32'),
+                         ('port_handle_type', 'u1'),
+                         ('time_stamp', '<f8'),
+                         ('frame_number', '<i8'),
+                         ('quaternion', '<f8', (4,)),
+                         ('translation', '<f8', (3,)),
+                         ('quality', '<f8')])
+"""
+The record for one tool in one frame. sample counts the calls to
+TrackingRecorder.record, so groups the records of a frame. port_handle is
+the utf-8 encoded port handle, of at most 32 bytes, and port_handle_type
+is 0 if the port handle was a str, or 1 if it was an int, so it is
+replayed as the same type. The quaternion is (qw, qx, qy, qz).
+"""
+
+_STR_HANDLE = 0
+_INT_HANDLE = 1
+
+
+def _read_header(file_name):
+    """
+    Checks the header of a recording.
+
+    :raises: ValueError if the file isn't a recording
+    """
+    header = np.fromfile(file_name, dtype=_HEADER_DTYPE, count=1)
+    if header.shape[0] != 1 or header[0]['magic'] != _MAGIC:
+        raise ValueError(file_name + " is not a tracking recording")
+    if header[0]['version'] != _VERSION:
+        raise ValueError(file_name + " has unsupported version " +
+                         str(header[0]['version']))
+
+
+def _encode_port_handle(port_handle):
+    """
+    Returns the bytes and port_handle_type of a port handle.
+
+    :raises: ValueError if the port handle isn't a str or int, or
+        is too long
+    """
+    if isinstance(port_handle, str):
+        handle_type = _STR_HANDLE
+    elif isinstance(port_handle, (int, np.integer)) \
+            and not isinstance(port_handle, (bool, np.bool_)):
+        handle_type = _INT_HANDLE
+    else:
+        raise ValueError("Port handles must be str or int, not " +
+                         type(port_handle).__name__)
+    handle = str(port_handle).encode('utf-8')
+    if len(handle) > 32:
+        raise ValueError("Port handles must be at most 32 bytes")
+    return handle, handle_type
+
+
+def _decode_port_handles(records):
+    """
+    Returns the port handles of some records, as the type they
+    were recorded as.
+    """
+    return [int(handle) if handle_type == _INT_HANDLE
+            else handle.decode('utf-8')
+            for handle, handle_type in zip(records['port_handle'],
+                                           records['port_handle_type'])]
+
+
+def read_recording(file_name):
+    """
+    Memory maps a recording made with TrackingRecorder, read only.
+    A partly written final record, for example if the recording
+    was interrupted, is ignored.
+
+    :param file_name: the recording
+    :return: read only structured array of RECORD_DTYPE
+    :raises: ValueError if the file isn't a recording
+    """
+    _read_header(file_name)
+    count = (os.path.getsize(file_name) - _HEADER_DTYPE.itemsize) \
+            // RECORD_DTYPE.itemsize
+    if count == 0:
+        # mmap can't map an empty range.
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+        records.flags.writeable = False
+        return records
+    return np.memmap(file_name, dtype=RECORD_DTYPE, mode='r',
+                     offset=_HEADER_DTYPE.itemsize, shape=(count,))
+
+
+class TrackingRecorder():
+    """
+    Streams tracking frames to a binary file, as they arrive, so
+    long recordings don't need to be held in memory.
+
+    Usage::
+
+        with TrackingRecorder('tracking.skst') as recorder:
+            for _ in range(1000):
+                recorder.record(*tracker.get_frame())
+    """
+    def __init__(self, file_name, append=False):
+        """
+        :param file_name: the file to record to
+        :param append: if True, and the file is a recording, add
+            to the end of it, otherwise the file is overwritten
+        :raises: ValueError if appending to a file that isn't a recording
+        """
+        self._next_sample = 0
+        if append and os.path.exists(file_name):
+            records = read_recording(file_name)
+            if records.shape[0] > 0:
+                self._next_sample = int(records['sample'][-1]) + 1
+            end = _HEADER_DTYPE.itemsize \
+                    + records.shape[0] * RECORD_DTYPE.itemsize
+            del records
+            # Drop any partly written record before appending.
+            os.truncate(file_name, end)
+            self._file = open(file_name, 'ab') # pylint: disable=consider-using-with
+        else:
+            self._file = open(file_name, 'wb') # pylint: disable=consider-using-with
+            header = np.array([(_MAGIC, _VERSION)], dtype=_HEADER_DTYPE)
+            self._file.write(header.tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def record(self, port_handles, time_stamps, frame_numbers, tracking,
+               tracking_quality):
+        """
+        Appends a frame, in the format returned by SKSBaseTracker.get_frame.
+
+        :param port_handles: list of port handles, one per tool, each a
+            str or an int
+        :param time_stamps: list of time stamps, one per tool
+        :param frame_numbers: list of frame numbers, one per tool
+        :param tracking: list of 4x4 tracking matrices, or of 1x7
+            quaternion and translation arrays
+        :param tracking_quality: list of the tracking quality, one per tool
+        :raises: ValueError if a port handle is too long, or isn't a
+            str or int, or the tracking isn't either format
+        """
+        count = len(port_handles)
+        if count == 0:
+            return
+
+        handles, handle_types = zip(*[_encode_port_handle(port_handle)
+                                      for port_handle in port_handles])
+
+        tracking = np.asarray(tracking, dtype=np.float64)
+        records = np.empty(count, dtype=RECORD_DTYPE)
+        if tracking.shape == (count, 4, 4):
+            records['quaternion'] = matrices_to_quaternions(tracking)
+            records['translation'] = tracking[:, 0:3, 3]
+        elif tracking.size == count * 7:
+            tracking = np.reshape(tracking, (count, 7))
+            records['quaternion'] = tracking[:, 0:4]
+            records['translation'] = tracking[:, 4:7]
+        else:
+            raise ValueError("Tracking should be 4x4 matrices or 1x7 "
+                             "quaternions and translations")
+
+        records['sample'] = self._next_sample
+        records['port_handle'] = handles
+        records['port_handle_type'] = handle_types
+        records['time_stamp'] = time_stamps
+        records['frame_number'] = frame_numbers
+        records['quality'] = tracking_quality
+
+        self._file.write(records.tobytes())
+        self._next_sample += 1
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self._file.close()
+
+
+class ReplayTracker(SKSBaseTracker):
+    """
+    A tracker that replays a recording made with TrackingRecorder.
+
+    The recording is memory mapped, so opening it is fast, and each
+    frame is a slice of the mapped records. Frames are served at the
+    recorded speed, or a multiple of it, measured from start_tracking,
+    skipping frames if get_frame is called less often than they were
+    recorded. The replayed frames go through the same smoothing as a
+    live tracker.
+
+    The configuration is as SKSBaseTracker, plus 'replay speed', the
+    multiple of the recorded speed to replay at, default 1.0, or
+    None to return the next frame on each call to get_frame.
+    """
+    def __init__(self, file_name, configuration = None):
+        """
+        :param file_name: the recording
+        :param configuration: optional configuration dictionary
+        :raises: ValueError if the file isn't a recording, or the replay
+            speed is not greater than zero
+        """
+        super().__init__(configuration)
+
+        self._replay_speed = 1.0
+        if configuration is not None:
+            self._replay_speed = configuration.get('replay speed', 1.0)
+        if self._replay_speed is not None and self._replay_speed <= 0:
+            raise ValueError("Replay speed must be greater than zero")
+
+        self._file_name = file_name
+        self._records = read_recording(file_name)
+        samples = self._records['sample']
+        self._frame_starts = np.zeros(1, dtype=np.intp)
+        if samples.shape[0] > 0:
+            self._frame_starts = np.concatenate(
+                ([0], np.flatnonzero(samples[1:] != samples[:-1]) + 1,
+                 [samples.shape[0]]))
+        self._frame_times = np.array(
+            self._records['time_stamp'][self._frame_starts[:-1]])
+        self._start_time = None
+        self._next_frame = 0
+
+        # The first record of each port handle, of each type.
+        first_indices = []
+        for handle_type in (_STR_HANDLE, _INT_HANDLE):
+            indices = np.flatnonzero(
+                self._records['port_handle_type'] == handle_type)
+            _, first_index = np.unique(
+                self._records['port_handle'][indices], return_index=True)
+            first_indices.append(indices[first_index])
+        first_records = self._records[np.sort(np.concatenate(first_indices))]
+        self.smoother.rows(_decode_port_handles(first_records),
+                           add_missing=True)
+
+    def frame_count(self):
+        """
+        Returns the number of frames in the recording.
+        """
+        return self._frame_starts.shape[0] - 1
+
+    def frame_records(self, index):
+        """
+        Returns the records of a frame, as a read only view of the
+        memory mapped file.
+
+        :param index: the frame index, from 0 to frame_count - 1
+        :return: structured array of RECORD_DTYPE, one record per tool
+        :raises: ValueError if the index is out of range
+        """
+        if not 0 <= index < self.frame_count():
+            raise ValueError("Frame " + str(index) + " is not in the " +
+                             "recording")
+        return self._records[self._frame_starts[index]:
+                             self._frame_starts[index + 1]]
+
+    def is_finished(self):
+        """
+        Returns True when the last frame has been replayed.
+        """
+        return self._next_frame >= self.frame_count()
+
+    def acquire_frame(self):
+        """
+        Returns the frame due at the current replay time, as the
+        parameters of add_frame_to_buffer, or None if it's already been
+        returned. The arrays are views of the recording.
+
+        :raises: ValueError if tracking hasn't been started
+        """
+        if self._start_time is None:
+            raise ValueError("Replay not started, call start_tracking")
+        if self.is_finished():
+            return None
+
+        if self._replay_speed is None:
+            index = self._next_frame
+        else:
+            replay_time = self._frame_times[0] + self._replay_speed \
+                * (time.monotonic() - self._start_time)
+            index = np.searchsorted(self._frame_times, replay_time,
+                                    side='right') - 1
+        if index < self._next_frame:
+            return None
+
+        self._next_frame = index + 1
+        records = self.frame_records(index)
+        return (_decode_port_handles(records), records['time_stamp'],
+                records['frame_number'], records['quaternion'],
+                records['translation'],
+                records['quality'], True)
+
+    def get_frame(self):
+        """
+        Returns the smoothed data for the tools in the most recently
+        replayed frame, after adding the frame due at the current replay
+        time, if any, to the smoothing buffers. See SKSBaseTracker.get_frame.
+
+        :raises: ValueError if tracking hasn't been started
+        """
+        if not self.is_acquiring():
+            frame = self.acquire_frame()
+            if frame is not None:
+                self.add_frame_to_buffer(*frame)
+
+        port_handles = []
+        if self._next_frame > 0:
+            port_handles = _decode_port_handles(
+                self.frame_records(self._next_frame - 1))
+        return self.get_smooth_frame(port_handles)
+
+    def get_tool_descriptions(self):
+        """
+        :return: list of port handles
+        :return: list of tool descriptions
+        """
+        return list(self.port_handles), \
+            ["Replayed from " + self._file_name] * len(self.port_handles)
+
+    def start_tracking(self):
+        """
+        Starts replaying from the first frame.
+        """
+        self._start_time = time.monotonic()
+        self._next_frame = 0
+
+    def stop_tracking(self):
+        """
+        Stops replaying.
+        """
+        self._start_time = None
+
+    def close(self):
+        """
+        Stops replaying, and releases the recording.
+        """
+        self.stop_acquisition()
+        self._start_time = None
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._frame_starts = np.zeros(1, dtype=np.intp)
+        self._frame_times = np.zeros(0)
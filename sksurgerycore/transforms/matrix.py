@@ -160,3 +160,69 @@ def construct_rigid_transformation(rot_m, trans_v):
     rigid_transformation[2][3] = t_v[2]
 
     return rigid_transformation
+
+
+def invert_rigid_transformation(rigid_transformation):
+    """
+    Inverts a 4x4 rigid-body transformation, or a stack of them,
+    using the closed form [R^T, -R^T t], which is cheaper than
+    a general matrix inverse.
+
+    There is no checking that the upper left 3x3 is an orthonormal
+    rotation matrix, see is_rigid_transformation.
+
+    :param rigid_transformation: 4x4 or Nx4x4 rigid transformation(s),
+        numpy array
+    :returns: inverse -- the inverse transformation(s), same shape as input,
+        numpy array
+    """
+    rotation_t = np.swapaxes(rigid_transformation[..., 0:3, 0:3], -1, -2)
+    translation = rigid_transformation[..., 0:3, 3:4]
+
+    inverse = np.zeros(rigid_transformation.shape)
+    inverse[..., 0:3, 0:3] = rotation_t
+    inverse[..., 0:3, 3:4] = -np.matmul(rotation_t, translation)
+    inverse[..., 3, 3] = 1.0
+
+    return inverse
+
+
+def is_rigid_transformation(transform, tolerance=1e-9):
+    """
+    Checks whether a 4x4 matrix, or each of a stack of them, is a
+    rigid-body transformation, i.e. has an orthonormal upper left 3x3
+    and a bottom row of [0, 0, 0, 1]. Unlike
+    sksurgerycore.utilities.validate_matrix.validate_rigid_matrix
+    this does not raise, and does not reject reflections.
+
+    :param transform: 4x4 or Nx4x4 matrices, numpy array
+    :param tolerance: absolute tolerance for the orthonormality check
+    :returns: bool, or length N boolean array for a stack
+    """
+    rotation = transform[..., 0:3, 0:3]
+    residual = np.matmul(np.swapaxes(rotation, -1, -2), rotation) - np.eye(3)
+    orthonormal = np.all(np.abs(residual) <= tolerance, axis=(-2, -1))
+    bottom_row = np.all(transform[..., 3, :] == [0.0, 0.0, 0.0, 1.0],
+                        axis=-1)
+    return np.logical_and(orthonormal, bottom_row)
+
+
+def invert_transformation(transform):
+    """
+    Inverts a 4x4 transformation, or a stack of them, using the closed
+    form rigid inverse where possible, and a general inverse otherwise.
+
+    :param transform: 4x4 or Nx4x4 transformation(s), numpy array
+    :returns: inverse -- the inverse transformation(s), same shape as input,
+        numpy array
+    """
+    rigid = is_rigid_transformation(transform)
+    if np.all(rigid):
+        return invert_rigid_transformation(transform)
+    if not np.any(rigid):
+        return np.linalg.inv(transform)
+
+    inverse = np.empty(transform.shape)
+    inverse[rigid] = invert_rigid_transformation(transform[rigid])
+    inverse[~rigid] = np.linalg.inv(transform[~rigid])
+    return inverse
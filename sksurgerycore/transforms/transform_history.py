@@ -0,0 +1,208 @@
+#  -*- coding: utf-8 -*-
+
+"""Classes and functions for interpolating time stamped 4x4 transforms."""
+
+import math
+import numpy as np
+from sksurgerycore.algorithms.tracking_smoothing import \
+    matrices_to_quaternions, quaternion_to_matrix
+
+
+def slerp(quat_a, quat_b, fraction):
+    """
+    Spherical linear interpolation between two unit quaternions,
+    along the shortest arc.
+
+    :param quat_a: the quaternion at fraction = 0, (w, x, y, z)
+    :param quat_b: the quaternion at fraction = 1, (w, x, y, z)
+    :param fraction: float, normally between 0 and 1
+    :returns: the interpolated unit quaternion
+    """
+    dot = np.dot(quat_a, quat_b)
+    if dot < 0.0:
+        # q and -q are the same rotation, so take the shortest arc.
+        quat_b = -quat_b
+        dot = -dot
+
+    if dot > 0.9995:
+        # The quaternions are nearly parallel, so linear interpolation
+        # is accurate, and avoids dividing by sin(angle) ~ 0.
+        result = quat_a + fraction * (quat_b - quat_a)
+        return result / np.linalg.norm(result)
+
+    angle = math.acos(dot)
+    sin_angle = math.sin(angle)
+    weight_a = math.sin((1.0 - fraction) * angle) / sin_angle
+    weight_b = math.sin(fraction * angle) / sin_angle
+    return weight_a * quat_a + weight_b * quat_b
+
+
+def interpolate_transforms(transform_a, transform_b, fraction):
+    """
+    Interpolates between two 4x4 rigid transforms, using SLERP for the
+    rotation and linear interpolation for the translation.
+
+    :param transform_a: 4x4 rigid transform at fraction = 0
+    :param transform_b: 4x4 rigid transform at fraction = 1
+    :param fraction: float, normally between 0 and 1
+    :returns: 4x4 interpolated rigid transform
+    """
+    quat_a, quat_b = matrices_to_quaternions(
+        np.stack((transform_a, transform_b)))
+    quaternion = slerp(quat_a, quat_b, fraction)
+
+    result = np.eye(4)
+    result[0:3, 0:3] = quaternion_to_matrix(quaternion)
+    result[0:3, 3] = transform_a[0:3, 3] \
+        + fraction * (transform_b[0:3, 3] - transform_a[0:3, 3])
+    return result
+
+
+class _HistoryBuffer:
+    """
+    Internal storage for TransformHistory, that may be shared by
+    copies of a history. Samples are only ever written after the last
+    written sample, so samples already visible to a history are never
+    changed.
+    """
+    def __init__(self, capacity):
+        self.times = np.full(capacity, np.nan)
+        self.transforms = np.zeros((capacity, 4, 4))
+        self.written = 0
+
+
+class TransformHistory:
+    """
+    A bounded history of time stamped 4x4 rigid transforms, for
+    example from a tracker, that can be queried at any time within
+    the range of the history.
+
+    The samples are kept in a preallocated buffer of twice the
+    history size, so adding a sample does no allocation, until the buffer
+    is full, when the newest samples are moved to a new buffer. Samples
+    must be added in increasing time order, so queries can use a binary
+    search, and are O(log n) in the length of the history.
+
+    Copying a history is O(1), as the copy shares the buffer. Either
+    history can then add samples, as samples in the buffer are never
+    overwritten. Only the first to add after the copy writes to the
+    shared buffer, the other moves its samples to a new one.
+
+    Usage::
+
+        history = TransformHistory(100)
+        history.add(0.0, t1)
+        history.add(0.1, t2)
+
+        # Returns t1 and t2 interpolated half way.
+        t3 = history.get(0.05)
+    """
+    def __init__(self, buffer_size):
+        """
+        :param buffer_size: the maximum number of samples to keep.
+        :raises: ValueError
+        """
+        if buffer_size < 1:
+            raise ValueError("Buffer size must be a least 1")
+
+        self._buffer_size = buffer_size
+        self._buffer = _HistoryBuffer(2 * buffer_size)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        """
+        Returns the number of samples in the history.
+        """
+        return self._end - self._start
+
+    def copy(self):
+        """
+        Returns an independent copy of the history, which shares
+        the stored samples until either history adds a sample.
+        """
+        # pylint: disable=protected-access
+        result = TransformHistory.__new__(TransformHistory)
+        result._buffer_size = self._buffer_size
+        result._buffer = self._buffer
+        result._start = self._start
+        result._end = self._end
+        return result
+
+    def time_range(self):
+        """
+        Returns the time stamps of the oldest and newest samples.
+
+        :returns: float, float
+        :raises: ValueError if the history is empty
+        """
+        if self._end == self._start:
+            raise ValueError("history is empty")
+        return self._buffer.times[self._start], \
+            self._buffer.times[self._end - 1]
+
+    def add(self, timestamp, transform):
+        """
+        Adds a time stamped transform, dropping the oldest
+        sample if the history is full.
+
+        :param timestamp: the time stamp, which must be later than the
+            newest sample
+        :param transform: 4x4 rigid transform, which is copied
+        :raises: ValueError
+        """
+        if self._end > self._start \
+                and not timestamp > self._buffer.times[self._end - 1]:
+            raise ValueError("timestamp " + str(timestamp)
+                             + " is not later than the newest sample")
+
+        if self._end == self._buffer.times.shape[0] \
+                or self._buffer.written != self._end:
+            # The buffer is full, or another copy of this history has
+            # written after our newest sample, so move to a new buffer,
+            # keeping the samples that will still be in the history.
+            keep = min(self._end - self._start, self._buffer_size - 1)
+            buffer = _HistoryBuffer(2 * self._buffer_size)
+            buffer.times[0:keep] = \
+                self._buffer.times[self._end - keep:self._end]
+            buffer.transforms[0:keep] = \
+                self._buffer.transforms[self._end - keep:self._end]
+            buffer.written = keep
+            self._buffer = buffer
+            self._start = 0
+            self._end = keep
+
+        self._buffer.times[self._end] = timestamp
+        self._buffer.transforms[self._end] = transform
+        self._end += 1
+        self._buffer.written = self._end
+        self._start = max(self._start, self._end - self._buffer_size)
+
+    def get(self, timestamp):
+        """
+        Returns the transform at the given time, interpolated
+        between the nearest samples either side.
+
+        :param timestamp: the time stamp, which must be within time_range
+        :returns: 4x4 rigid transform
+        :raises: ValueError
+        """
+        oldest_time, newest_time = self.time_range()
+        if not oldest_time <= timestamp <= newest_time:
+            raise ValueError("timestamp " + str(timestamp)
+                             + " is outside the range of the history")
+
+        # Find the first sample at or after timestamp.
+        times = self._buffer.times
+        index = self._start + np.searchsorted(
+            times[self._start:self._end], timestamp)
+
+        if times[index] == timestamp:
+            return np.copy(self._buffer.transforms[index])
+
+        previous = index - 1
+        fraction = (timestamp - times[previous]) \
+            / (times[index] - times[previous])
+        return interpolate_transforms(self._buffer.transforms[previous],
+                                      self._buffer.transforms[index],
+                                      fraction)
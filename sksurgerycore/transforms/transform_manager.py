@@ -3,18 +3,78 @@
 """Class implementing a general purpose 4x4 transformation matrix manager."""
 
 import re
+import threading
+from collections import deque
+from functools import lru_cache
 import numpy as np
+from sksurgerycore.transforms.matrix import invert_transformation
+from sksurgerycore.transforms.transform_history import TransformHistory
+
+_NAME_PATTERN = re.compile("^([a-z]+)2([a-z]+)$")
+
+
+@lru_cache(maxsize=1024)
+def _parse_name(name):
+    """
+    Internal function to validate and split a transform name.
+    The result is cached, so names that have already been seen
+    do no string processing, see TransformManager.is_valid_name.
+    """
+    match = _NAME_PATTERN.match(name)
+    if not match:
+        raise ValueError("name is incorrectly formatted")
+
+    pre, post = match.groups()
+
+    if pre == post:
+        raise ValueError("you shouldn't request the identity:"
+                         + pre + "2" + post)
+
+    return pre, post
+
+
+def _transform_rows(transform, points, out, chunk_size):
+    """
+    Internal function to write R.p + t for each row of the Nx3
+    points into out, chunk_size rows at a time.
+    """
+    rotation_t = transform[0:3, 0:3].T
+    translation = transform[0:3, 3]
+    for start in range(0, points.shape[0], chunk_size):
+        target = out[start:start + chunk_size]
+        np.matmul(points[start:start + chunk_size], rotation_t, out=target)
+        target += translation
+
+
+def _validate_points(points, points_as_columns, chunk_size):
+    """
+    Internal function to validate the points and chunk size
+    passed to TransformManager.transform_points.
+
+    :raises: TypeError, ValueError
+    """
+    if not isinstance(points, np.ndarray):
+        raise TypeError("points is not a numpy array")
+    point_axis = 1 if points_as_columns else 0
+    if points.ndim != 2 or points.shape[1 - point_axis] != 3:
+        raise ValueError("points should be Nx3, or 3xN if "
+                         "points_as_columns")
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError("chunk_size should be at least 1")
 
 
 class TransformManager:
     """
     Class for managing 4x4 transformation matrices.
-    This class is NOT designed to be thread-safe.
+    This class is NOT designed to be thread-safe,
+    see ConcurrentTransformManager.
 
 
     The transforms are required to be 4x4 matrices.
     There is no checking that the upper left 3x3 is
-    an orthonormal rotation matrix.
+    an orthonormal rotation matrix. Inverses are computed
+    lazily, on first use, with a closed form inverse
+    for rigid transforms and a general inverse otherwise.
 
     Usage::
 
@@ -36,13 +96,58 @@ class TransformManager:
 
     and so on.
 
+    If constructed with a history_size, transforms added with a
+    timestamp are also kept in a bounded, per transform,
+    TransformHistory, and get(name, timestamp=t) interpolates every
+    transform along the path at time t before composing them::
+
+        tm = TransformManager(history_size=100)
+        tm.add("pointer2tracker", t1, timestamp=0.00)
+        tm.add("pointer2tracker", t2, timestamp=0.02)
+        tm.add("camera2tracker", t3, timestamp=0.01)
+        tm.add("camera2tracker", t4, timestamp=0.04)
+
+        t5 = tm.get("pointer2camera", timestamp=0.015)
+
+    Indirect transforms are resolved by a breadth first search for
+    the shortest list of nodes between the two coordinate systems.
+    These lists are cached, keyed on (before, after), so repeatedly
+    asking for the same composed transform does not repeat the search.
+    As the cache only stores node lists, replacing a transform via add()
+    does not invalidate it; remove() invalidates the entries that pass
+    through the removed transform, and adding a new transform, which
+    may open a shorter path, clears the cache.
+
+    The caches, of paths and of inverses, are also written by get().
+    Storing a path, and copying the paths in copy(), hold an internal
+    lock, and inverses replace an existing entry, so one thread
+    can copy the manager while others read from it, which is how
+    ConcurrentTransformManager publishes updates. Other changes are not
+    locked. compute_inverses() computes any inverses that are still
+    missing, so that reading doesn't write them.
+
     """
-    def __init__(self):
+    def __init__(self, history_size=None):
         """
         Initialises an empty repository,
         which will be a dictionary of dictionaries.
+        Inverses that have not yet been computed are stored as None.
+
+        :param history_size: if not None, the number of time stamped
+            samples to keep for each transform, see add and get.
         """
+        if history_size is not None and history_size < 1:
+            raise ValueError("history_size must be at least 1")
+        self.history_size = history_size
+        self.histories = {}
+        self._owned_histories = set()
         self.repository = {}
+        self._uninverted = set()
+        self.path_cache = {}
+        self.paths_using_edge = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache_lock = threading.Lock()
 
     @staticmethod
     def is_valid_transform(transform):
@@ -61,6 +166,26 @@ class TransformManager:
         if transform.shape[1] != 4:
             raise ValueError("transform does not have 4 columns")
 
+    @staticmethod
+    def is_valid_trajectory(trajectory):
+        """
+        Validates the trajectory as a Tx4x4 numpy array.
+
+        :param trajectory: Tx4x4 stack of transformation matrices.
+        :raises: TypeError, ValueError
+        """
+        if not isinstance(trajectory, np.ndarray):
+            raise TypeError("trajectory is not a numpy array")
+
+        if trajectory.ndim != 3:
+            raise ValueError("trajectory is not a 3D array")
+
+        if trajectory.shape[1] != 4:
+            raise ValueError("trajectory does not have 4 rows")
+
+        if trajectory.shape[2] != 4:
+            raise ValueError("trajectory does not have 4 columns")
+
     @staticmethod
     def is_valid_name(name):
         """
@@ -76,6 +201,9 @@ class TransformManager:
 
         Identity transforms such as model2model raise ValueError.
 
+        The parsed names are cached, so validating a name that
+        has been seen before is a single dictionary lookup.
+
         :param name: the name of the transform, eg. model2world
         :raises: TypeError, ValueError
         :returns: str, str -- parts of string before and after the 2.
@@ -83,16 +211,7 @@ class TransformManager:
         if not isinstance(name, str):
             raise TypeError("name is not a string")
 
-        if not re.match("^([a-z]+)2([a-z]+)$", name):
-            raise ValueError("name is incorrectly formatted")
-
-        pre, post = name.split("2")
-
-        if pre == post:
-            raise ValueError("you shouldn't request the identity:"
-                             + pre + "2" + post)
-
-        return pre, post
+        return _parse_name(name)
 
     @staticmethod
     def flip_name(name):
@@ -115,8 +234,7 @@ class TransformManager:
         added transform, and its own inverse.
         """
         before, after = self.is_valid_name(name)
-        return after in self.repository \
-            and before in self.repository[after]
+        return self.__exists(before, after)
 
     def count(self):
         """
@@ -129,7 +247,7 @@ class TransformManager:
             count += len(transforms_item)
         return count
 
-    def add(self, name, transform):
+    def add(self, name, transform, timestamp=None):
         """
         Adds a transform called name.
         If the name already exists, the corresponding
@@ -137,15 +255,111 @@ class TransformManager:
 
         :param name: the name of the transform, e.g. model2world
         :param transform: the transform, e.g. 4x4 matrix
+        :param timestamp: optional time stamp, which adds the transform to
+            the history of name, if the manager was constructed
+            with a history_size. Time stamps must increase.
+        :raises: TypeError, ValueError
         """
         before, after = self.is_valid_name(name)
         self.is_valid_transform(transform)
-        if after not in self.repository:
-            self.repository[after] = {}
-        if before not in self.repository:
-            self.repository[before] = {}
-        self.repository[before][after] = transform
-        self.repository[after][before] = np.linalg.inv(transform)
+        if timestamp is not None:
+            if self.history_size is None:
+                raise ValueError("timestamps need a history_size")
+            self.__add_to_history(before, after, timestamp, transform)
+        self.__set_edge(before, after, transform)
+
+    def add_trajectory(self, name, trajectory):
+        """
+        Adds a trajectory called name, i.e. a Tx4x4 stack of the
+        transform at T time points, for example from a recording.
+        If the name already exists, the corresponding
+        transform or trajectory is replaced without warning.
+
+        A trajectory is stored like any other transform, so get()
+        returns a Tx4x4 stack for any path that passes through it,
+        see get_trajectory.
+
+        :param name: the name of the trajectory, e.g. model2world
+        :param trajectory: the trajectory, Tx4x4 ndarray
+        :raises: TypeError, ValueError
+        """
+        self.is_valid_trajectory(trajectory)
+        before, after = self.is_valid_name(name)
+        self.__set_edge(before, after, trajectory)
+
+    def add_many(self, names, transforms, timestamps=None):
+        """
+        Adds a batch of transforms, for example all the tools
+        from one tracker frame, in one call. The names are
+        validated once, the inverses are computed in a single
+        vectorised call, and the cache of resolved paths is
+        updated once for the whole batch.
+
+        The transforms are copied, so the caller can reuse
+        the input array for the next frame. Everything, including the
+        time stamps of names repeated in the batch, is checked before
+        anything is added, so a batch that raises changes nothing.
+
+        :param names: list of N transform names, e.g. [pointer2camera, ...]
+        :param transforms: Nx4x4 ndarray of transforms
+        :param timestamps: optional time stamp for the whole batch, or list
+            of N time stamps, which adds the transforms to their
+            histories, as add does
+        :raises: TypeError, ValueError
+        """
+        if not isinstance(transforms, np.ndarray):
+            raise TypeError("transforms is not a numpy array")
+        if transforms.ndim != 3 or transforms.shape[1:] != (4, 4):
+            raise ValueError("transforms should be an Nx4x4 array")
+        if len(names) != transforms.shape[0]:
+            raise ValueError("there should be one name per transform")
+
+        pairs = [self.is_valid_name(name) for name in names]
+        transforms = np.array(transforms, dtype=np.float64)
+        if timestamps is not None:
+            timestamps = self.__validate_timestamps(pairs, timestamps)
+        inverses = invert_transformation(transforms)
+
+        new_transform = False
+        for index, (before, after) in enumerate(pairs):
+            if timestamps is not None:
+                self.__add_to_history(before, after, timestamps[index],
+                                      transforms[index])
+            if before not in self.repository:
+                self.repository[before] = {}
+            if after not in self.repository:
+                self.repository[after] = {}
+            if after not in self.repository[before]:
+                new_transform = True
+            self.histories.pop((after, before), None)
+            self.repository[before][after] = transforms[index]
+            self.repository[after][before] = inverses[index]
+
+        if new_transform:
+            # A new transform may open a shorter path.
+            self.path_cache = {}
+            self.paths_using_edge = {}
+
+    def update_frame(self, transforms, timestamps=None):
+        """
+        Adds a dictionary of transforms, see add_many.
+
+        :param transforms: dictionary of 4x4 ndarrays, keyed on name
+        :param timestamps: optional time stamp for the whole frame, or
+            dictionary of time stamps, keyed on name, see add_many
+        :raises: TypeError, ValueError
+        """
+        if not transforms:
+            return
+        for transform in transforms.values():
+            self.is_valid_transform(transform)
+        if isinstance(timestamps, dict):
+            if timestamps.keys() != transforms.keys():
+                raise ValueError("there should be one time stamp "
+                                 + "per transform")
+            timestamps = [timestamps[name] for name in transforms]
+        self.add_many(list(transforms.keys()),
+                      np.stack(list(transforms.values())), timestamps)
 
     def remove(self, name):
         """
@@ -155,14 +369,70 @@ class TransformManager:
         :raises: ValueError
         """
         before, after = self.is_valid_name(name)
-        flipped = TransformManager.flip_name(name)
 
-        if not self.exists(name):
+        if not self.__exists(before, after):
             raise ValueError("name:" + name + ", is not in repository.")
-        if not self.exists(flipped):
-            raise ValueError("name:" + flipped + ", is not in repository.")
+        if not self.__exists(after, before): # pylint: disable=arguments-out-of-order
+            raise ValueError("name:" + after + "2" + before
+                             + ", is not in repository.")
         self.repository[before].pop(after)
         self.repository[after].pop(before)
+        self.histories.pop((before, after), None)
+        self.histories.pop((after, before), None)
+        self.__invalidate_paths(before, after)
+
+    def copy(self):
+        """
+        Returns a copy of the manager, which can be changed without
+        changing this one. The stored matrices are shared, as the
+        manager never modifies a matrix after it has been added.
+        The histories are also shared, until either manager adds to
+        one, when that history alone is copied first.
+        The cached paths are copied while holding the cache lock, so
+        threads reading from this manager can't change them meanwhile.
+        """
+        result = TransformManager(self.history_size)
+        result.histories = dict(self.histories)
+        self._owned_histories = set()
+        result.repository = {node: dict(transforms) for node, transforms
+                             in self.repository.items()}
+        result._uninverted = set(self._uninverted) # pylint: disable=protected-access
+        with self._cache_lock:
+            result.path_cache = dict(self.path_cache)
+            result.paths_using_edge = {edge: set(keys) for edge, keys
+                                       in self.paths_using_edge.items()}
+        result.cache_hits = self.cache_hits
+        result.cache_misses = self.cache_misses
+        return result
+
+    def compute_inverses(self):
+        """
+        Computes and stores the inverses that haven't been used yet,
+        which are otherwise computed by get(), on first use.
+        """
+        for before, after in self._uninverted:
+            transforms = self.repository.get(after)
+            if transforms is not None and transforms.get(before, 0) is None:
+                transforms[before] = invert_transformation(
+                    self.repository[before][after])
+        self._uninverted = set()
+
+    def cache_info(self):
+        """
+        Returns statistics about the cache of resolved paths.
+
+        :returns: int, int, int -- hits, misses and current cache size
+        """
+        return self.cache_hits, self.cache_misses, len(self.path_cache)
+
+    def clear_cache(self):
+        """
+        Empties the cache of resolved paths and resets the counters.
+        """
+        self.path_cache = {}
+        self.paths_using_edge = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def multiply_point(self, name, points):
         """
@@ -171,17 +441,77 @@ class TransformManager:
         :returns: ndarray -- 4xN matrix of transformed points
         :raises: ValueError
         """
-        if not self.exists(name):
-            raise ValueError("name:" + name + ", could not be found.")
-
         transform = self.get(name)
 
         return np.matmul(transform, points)
 
-    def get(self, name):
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    def transform_points(self, names, points, out=None, chunk_size=None,
+                         points_as_columns=False):
+        """
+        Transforms non-homogeneous points by one or more named transforms,
+        applying R.p + t directly, so no 4xN homogeneous copy is made.
+
+        Each transform is looked up once per call. If out is given,
+        the result is written into it, and the points are processed
+        in chunks of chunk_size, so no temporaries larger than
+        a chunk are allocated, even for very large clouds.
+
+        :param names: the name of a transform, or a list of K names
+        :param points: Nx3 ndarray of points, or 3xN if points_as_columns
+        :param out: optional ndarray for the result, the same shape
+            as points, or Kx(shape of points) if names is a list
+        :param chunk_size: optional number of points to process at a time
+        :param points_as_columns: if True, points are 3xN
+        :returns: ndarray -- the transformed points, (out if given)
+        :raises: TypeError, ValueError
+        """
+        _validate_points(points, points_as_columns, chunk_size)
+        point_axis = 1 if points_as_columns else 0
+
+        single = isinstance(names, str)
+        if single:
+            names = [names]
+        transforms = [self.get(name) for name in names]
+        if any(transform.ndim != 2 for transform in transforms):
+            raise ValueError("transform_points does not support trajectories")
+
+        shape = (len(names),) + points.shape
+        if out is None:
+            out = np.empty(shape, dtype=np.result_type(points, np.float64))
+            result = out[0] if single else out
+        else:
+            result = out
+            if single:
+                out = out[np.newaxis]
+            if out.shape != shape:
+                raise ValueError("out should have shape "
+                                 + str(shape[1:] if single else shape))
+
+        number_of_points = points.shape[point_axis]
+        if chunk_size is None or chunk_size >= number_of_points:
+            chunk_size = max(number_of_points, 1)
+
+        for index, transform in enumerate(transforms):
+            if points_as_columns:
+                # R.P + t is the transpose of P^T.R^T + t^T
+                _transform_rows(transform, points.T, out[index].T,
+                                chunk_size)
+            else:
+                _transform_rows(transform, points, out[index], chunk_size)
+
+        return result
+
+    def get(self, name, timestamp=None):
         """
         Returns the named transform or throws ValueError.
+        If the path passes through a trajectory, the result
+        is a Tx4x4 trajectory, see get_trajectory.
 
+        :param name: the name of the transform, e.g. model2world
+        :param timestamp: optional time stamp. Transforms along the path
+            that have a history are interpolated at this time,
+            see TransformHistory. Those without use their latest value.
         :raises: ValueError
         """
         before, after = self.is_valid_name(name)
@@ -190,60 +520,340 @@ class TransformManager:
                 or after not in self.repository:
             raise ValueError("name:" + name + ", could not be found.")
 
-        result = self.__get_direct(name)
+        if self.__exists(before, after):
+            return self.__get_edge(before, after, timestamp)
 
-        if result is not None:
-            return result
-
-        # If we didn't find it first time,
-        # search for a list of nodes from after to before.
-        list_of_nodes = [before]
-        self.__get_list(before, after, list_of_nodes)
+        list_of_nodes = self.__get_path(before, after)
+        if list_of_nodes is None:
+            raise ValueError("name:" + name + ", could not be found.")
 
-        # Multiply the nodes together. __get_list returns them
+        # Multiply the nodes together. The list of nodes is
         # in order (from before to after),
         # so in the example model2world, model=before
-        # world=after, so the ordering returned from __get_list
+        # world=after, so the ordering of the list
         # is from model to world. This is so we can simply
         # pre-multiply them in the same order you normally
         # do matrix multiplication.
         result = np.eye(4)
         for node_index in range(0, len(list_of_nodes) - 1):
-            next_name = list_of_nodes[node_index] \
-                        + "2" + list_of_nodes[node_index+1]
-            transform = self.get(next_name)
+            transform = self.__get_edge(list_of_nodes[node_index],
+                                        list_of_nodes[node_index + 1],
+                                        timestamp)
             result = np.matmul(transform, result)
         return result
 
-    def __get_direct(self, name):
+    def get_trajectory(self, name):
         """
-        Internal method to return the named transform or None.
+        Returns the named transform as a Tx4x4 trajectory, composing
+        every transform along the path with one batched matrix
+        multiplication per hop over the whole time axis. Static
+        transforms along the path are broadcast over the time axis.
+        All trajectories along the path must have the same length.
+
+        :returns: ndarray -- Tx4x4 trajectory, or 1x4x4 if there are no
+            trajectories on the path
+        :raises: ValueError
         """
-        before, after = self.is_valid_name(name)
-        if self.exists(name):
-            return self.repository[before][after]
+        result = self.get(name)
+        if result.ndim == 2:
+            result = result[np.newaxis]
+        return result
+
+    def __add_to_history(self, before, after, timestamp, transform):
+        """
+        Internal method to add a time stamped transform to the history
+        of the transform from before to after, copying the history first
+        if it is shared with a copy of this manager.
+        """
+        key = (before, after)
+        history = self.histories.get(key)
+        if history is None:
+            history = TransformHistory(self.history_size)
+        elif key not in self._owned_histories:
+            history = history.copy()
+        history.add(timestamp, transform)
+        self.histories[key] = history
+        self._owned_histories.add(key)
+
+    def __validate_timestamps(self, pairs, timestamps):
+        """
+        Internal method to check a batch of time stamps, before any
+        are added, so a failed batch leaves the manager unchanged.
+        A name repeated in the batch must have increasing time stamps.
+
+        :returns: list of one time stamp per pair
+        :raises: ValueError
+        """
+        if self.history_size is None:
+            raise ValueError("timestamps need a history_size")
+        if np.ndim(timestamps) == 0:
+            timestamps = [timestamps] * len(pairs)
+        if len(timestamps) != len(pairs):
+            raise ValueError("there should be one time stamp per transform")
+        # The newest time of each history, as it will be after the
+        # earlier transforms in the batch have been added.
+        newest = {}
+        for pair, timestamp in zip(pairs, timestamps):
+            if pair not in newest:
+                history = self.histories.get(pair)
+                newest[pair] = history.time_range()[1] \
+                    if history is not None and len(history) > 0 else None
+            if newest[pair] is not None and not timestamp > newest[pair]:
+                raise ValueError("timestamp " + str(timestamp)
+                                 + " is not later than the newest sample")
+            newest[pair] = timestamp
+            # Adding a transform drops the history of its inverse.
+            newest[(pair[1], pair[0])] = None
+        return timestamps
+
+    def __set_edge(self, before, after, transform):
+        """
+        Internal method to store a transform given the already
+        validated parts of its name. The inverse is computed lazily.
+        """
+        if after not in self.repository:
+            self.repository[after] = {}
+        if before not in self.repository:
+            self.repository[before] = {}
+        if after not in self.repository[before]:
+            # A new transform may open a shorter path.
+            self.path_cache = {}
+            self.paths_using_edge = {}
+        # Any history recorded in the opposite direction is now stale.
+        self.histories.pop((after, before), None)
+        self.repository[before][after] = transform
+        self.repository[after][before] = None
+        self._uninverted.add((before, after))
+
+    def __exists(self, before, after):
+        """
+        Internal method to check for a stored transform,
+        given the already validated parts of its name.
+        """
+        return after in self.repository \
+            and before in self.repository[after]
+
+    def __get_edge(self, before, after, timestamp=None):
+        """
+        Internal method to return a stored transform, computing
+        and storing the inverse on first use. If timestamp is not None,
+        and the transform has a history, it is interpolated at that time.
+        """
+        if timestamp is not None:
+            history = self.histories.get((before, after))
+            if history is not None:
+                return history.get(timestamp)
+            history = self.histories.get((after, before))
+            if history is not None:
+                return invert_transformation(history.get(timestamp))
+
+        transform = self.repository[before][after]
+        if transform is None:
+            transform = invert_transformation(self.repository[after][before])
+            # Replacing an existing entry, so copy() needn't lock.
+            self.repository[before][after] = transform
+        return transform
+
+    def __get_path(self, before, after):
+        """
+        Internal method to return the (possibly cached) list of nodes
+        from before to after, or None if there is no such path.
+        """
+        key = (before, after)
+        list_of_nodes = self.path_cache.get(key)
+        if list_of_nodes is not None:
+            self.cache_hits += 1
+            return list_of_nodes
+
+        self.cache_misses += 1
+        list_of_nodes = self.__get_list(before, after)
+        if list_of_nodes is None:
+            return None
+
+        with self._cache_lock:
+            self.path_cache[key] = list_of_nodes
+            for node_index in range(0, len(list_of_nodes) - 1):
+                edge = frozenset((list_of_nodes[node_index],
+                                  list_of_nodes[node_index + 1]))
+                self.paths_using_edge.setdefault(edge, set()).add(key)
+        return list_of_nodes
+
+    def __invalidate_paths(self, before, after):
+        """
+        Internal method to drop the cached paths that pass through
+        the transform between before and after, in either direction.
+        """
+        for key in self.paths_using_edge.pop(frozenset((before, after)),
+                                             set()):
+            self.path_cache.pop(key, None)
+
+    def __get_list(self, before, after):
+        """
+        Internal method to work out the shortest list of nodes,
+        from before to after, equivalent to the transform
+        referred to by name. This is an iterative breadth first
+        search, so it returns the path with the fewest
+        multiplications and is not limited by the recursion depth.
+
+        :returns: list of nodes, or None if there is no path
+        """
+        previous = {before: None}
+        frontier = deque([before])
+
+        while frontier:
+            node = frontier.popleft()
+            for candidate in self.repository[node]:
+                if candidate in previous:
+                    continue
+                previous[candidate] = node
+                if candidate == after:
+                    list_of_nodes = [after]
+                    while previous[list_of_nodes[-1]] is not None:
+                        list_of_nodes.append(previous[list_of_nodes[-1]])
+                    list_of_nodes.reverse()
+                    return list_of_nodes
+                frontier.append(candidate)
+
         return None
 
-    def __get_list(self, before, after, list_of_nodes):
+
+class ConcurrentTransformManager:
+    """
+    A TransformManager that can be shared between threads, for example
+    tracker, video and user interface threads, designed for many
+    readers and few writers.
+
+    Updates use read-copy-update. Each writer takes a lock, copies the
+    current TransformManager, applies its change to the copy, and then
+    publishes the copy by replacing a single reference. Readers never
+    take the write lock: each call works on whichever snapshot was current
+    when it started, so it always sees a consistent graph. Inverses are
+    computed before a snapshot is published, so readers don't write
+    them. The one exception is the cache of resolved paths: a reader
+    that resolves a new indirect path stores it under the snapshot's
+    cache lock, so it can wait while a writer copies the cached
+    paths, though not while it copies the rest of the graph. Reads
+    that hit the cache never lock.
+
+    As every update copies the graph, updates should be batched with
+    add_many or update_frame, giving one copy per tracker frame rather
+    than one per tool. Histories are shared between snapshots, and only
+    those that an update adds to are copied, see TransformHistory.copy.
+    To make several reads from the same version of the graph, call
+    snapshot() and read from the returned manager.
+
+    Usage::
+
+        tm = ConcurrentTransformManager()
+
+        # Tracker thread
+        tm.update_frame({"pointer2tracker": t1, "camera2tracker": t2})
+
+        # Render thread
+        t3 = tm.get("pointer2camera")
+    """
+    def __init__(self, history_size=None):
         """
-        Internal method to work out a list of transforms
-        equivalent to the transform referred to by name.
+        :param history_size: see TransformManager
         """
-        candidates = self.repository[before]
+        self._snapshot = TransformManager(history_size)
+        self._write_lock = threading.Lock()
 
-        if after in candidates:
-            list_of_nodes.append(after)
-            return
+    def snapshot(self):
+        """
+        Returns the current version of the graph, as a TransformManager.
+        It is not changed by later updates, and should only be read.
+        """
+        return self._snapshot
 
-        for candidate in candidates:
+    def exists(self, name):
+        """
+        See TransformManager.exists.
+        """
+        return self._snapshot.exists(name)
 
-            if candidate in list_of_nodes:
-                continue
+    def count(self):
+        """
+        See TransformManager.count.
+        """
+        return self._snapshot.count()
 
-            list_of_nodes.append(candidate)
-            self.__get_list(candidate, after, list_of_nodes)
+    def get(self, name, timestamp=None):
+        """
+        See TransformManager.get.
+        """
+        return self._snapshot.get(name, timestamp)
 
-            if list_of_nodes[-1] == after:
-                break
+    def get_trajectory(self, name):
+        """
+        See TransformManager.get_trajectory.
+        """
+        return self._snapshot.get_trajectory(name)
 
-            list_of_nodes.pop()
+    def multiply_point(self, name, points):
+        """
+        See TransformManager.multiply_point.
+        """
+        return self._snapshot.multiply_point(name, points)
+
+    def transform_points(self, names, points, **kwargs):
+        """
+        See TransformManager.transform_points.
+        """
+        return self._snapshot.transform_points(names, points, **kwargs)
+
+    def cache_info(self):
+        """
+        See TransformManager.cache_info. As readers don't lock,
+        the counters are approximate while several threads are reading.
+        """
+        return self._snapshot.cache_info()
+
+    def add(self, name, transform, timestamp=None):
+        """
+        See TransformManager.add.
+        """
+        self.__update(TransformManager.add, name, transform, timestamp)
+
+    def add_trajectory(self, name, trajectory):
+        """
+        See TransformManager.add_trajectory.
+        """
+        self.__update(TransformManager.add_trajectory, name, trajectory)
+
+    def add_many(self, names, transforms, timestamps=None):
+        """
+        See TransformManager.add_many.
+        """
+        self.__update(TransformManager.add_many, names, transforms,
+                      timestamps)
+
+    def update_frame(self, transforms, timestamps=None):
+        """
+        See TransformManager.update_frame.
+        """
+        self.__update(TransformManager.update_frame, transforms, timestamps)
+
+    def remove(self, name):
+        """
+        See TransformManager.remove.
+        """
+        self.__update(TransformManager.remove, name)
+
+    def clear_cache(self):
+        """
+        See TransformManager.clear_cache.
+        """
+        self.__update(TransformManager.clear_cache)
+
+    def __update(self, method, *args):
+        """
+        Internal method to apply method to a copy of the current
+        snapshot, compute its inverses, and publish the copy. If method
+        raises, nothing is published.
+        """
+        with self._write_lock:
+            updated = self._snapshot.copy()
+            method(updated, *args)
+            updated.compute_inverses()
+            self._snapshot = updated
@@ -28,8 +28,8 @@ def test_average_quat():
     answer = aveq.average_quaternions(array)
 
     #this is just a regression test, I have no idea if it is mathematically
-    #correct
-    expected_answer = [-0.89693696, 0.0, -0.21045113, 0.38886298]
+    #correct. The sign agrees with the closest input quaternion.
+    expected_answer = [0.89693696, 0.0, 0.21045113, -0.38886298]
 
     assert np.allclose(answer, expected_answer, rtol=1e-05, atol=1e-10)
 
@@ -61,3 +61,35 @@ def test_weighted_average_quat():
     answer = aveq.weighted_average_quaternions(array, weights)
 
     assert np.allclose(answer, quat3, rtol=1e-05, atol=1e-10)
+
+
+def test_average_quat_batch():
+    """
+    Test batched average quaternions matches the single versions
+    """
+    rng = np.random.default_rng(0)
+    quaternions = rng.normal(size=(20, 50, 4))
+    quaternions /= np.linalg.norm(quaternions, axis=2, keepdims=True)
+    weights = rng.uniform(size=(20, 50))
+
+    answers = aveq.average_quaternions_batch(quaternions)
+    weighted_answers = aveq.average_quaternions_batch(quaternions, weights)
+    assert answers.shape == (20, 4)
+
+    for index in range(20):
+        assert np.allclose(answers[index],
+                           aveq.average_quaternions(quaternions[index]))
+        assert np.allclose(weighted_answers[index],
+                           aveq.weighted_average_quaternions(
+                               quaternions[index], weights[index]))
+
+    shared_weights = aveq.average_quaternions_batch(quaternions,
+                                                    weights[0])
+    assert np.allclose(shared_weights[1],
+                       aveq.weighted_average_quaternions(quaternions[1],
+                                                         weights[0]))
+
+    with pytest.raises(ValueError):
+        aveq.average_quaternions_batch(quaternions[0])
+    with pytest.raises(ValueError):
+        aveq.average_quaternions_batch(quaternions, np.zeros(50))
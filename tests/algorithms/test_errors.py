@@ -9,3 +9,27 @@ def test_empty_fixed():
     """Raise type error fixed or moving is not a numpy array"""
     with pytest.raises(TypeError):
         e.compute_fre(None, None, np.ones(1, 3), np.ones(3, 3))
+
+
+def test_weighted_fre():
+    """Weighted FRE should match FRE for equal weights"""
+    fixed = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 2.0, 0.0],
+                      [0.0, 0.0, 3.0]])
+    moving = fixed + [[0.0, 0.0, 1.0], [0.0, 0.0, -1.0], [0.0, 0.0, 0.0],
+                      [0.0, 0.0, 0.0]]
+    rotation = np.eye(3)
+    translation = np.zeros((3, 1))
+
+    fre = e.compute_fre(fixed, moving, rotation, translation)
+    assert np.isclose(e.compute_weighted_fre(fixed, moving, rotation,
+                                             translation, np.ones(4)), fre)
+    assert np.isclose(e.compute_weighted_fre(fixed, moving, rotation,
+                                             translation,
+                                             np.array([1.0, 1.0, 0.0, 0.0])),
+                      1.0)
+    weights = np.tile(np.diag([1.0, 1.0, 0.0]), (4, 1, 1))
+    assert np.isclose(e.compute_weighted_fre(fixed, moving, rotation,
+                                             translation, weights), 0.0)
+    with pytest.raises(ValueError):
+        e.compute_weighted_fre(fixed, moving, rotation, translation,
+                               np.ones(3))
@@ -0,0 +1,100 @@
+#  -*- coding: utf-8 -*-
+"""Tests for iterative closest point registration"""
+import numpy as np
+import pytest
+import sksurgerycore.algorithms.icp as sicp
+import sksurgerycore.algorithms.tracking_smoothing as ts
+
+
+def _make_surface(number_of_points=5000):
+    """Points and normals on an ellipsoid, which has no symmetries
+    to register to the wrong pose."""
+    rng = np.random.default_rng(0)
+    unit = rng.normal(size=(number_of_points, 3))
+    unit /= np.linalg.norm(unit, axis=1, keepdims=True)
+    radii = np.array([60.0, 40.0, 25.0])
+    points = unit * radii
+    normals = points / np.square(radii)
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return points, normals
+
+
+def _make_moving(fixed, number_of_points=500):
+    """A subset of the surface, moved by a small rigid transform."""
+    rng = np.random.default_rng(1)
+    rotation = ts.quaternions_to_matrices(ts.rvecs_to_quaternions(
+        np.array([[0.1, -0.05, 0.08]])))[0]
+    translation = np.array([[2.0], [-3.0], [1.5]])
+    subset = fixed[rng.choice(fixed.shape[0], number_of_points,
+                              replace=False)]
+    moving = np.matmul(subset - translation.T, rotation)
+    return moving, rotation, translation
+
+
+@pytest.mark.parametrize("method", ['point_to_point', 'point_to_plane'])
+def test_register(method):
+    """Both variants should recover the transform."""
+    fixed, normals = _make_surface()
+    moving, rotation, translation = _make_moving(fixed)
+
+    registration = sicp.IterativeClosestPoint(fixed, normals)
+    rot, trans, rms = registration.register(moving, method=method,
+                                            max_iterations=100)
+    assert np.allclose(rot, rotation, atol=1e-3)
+    assert np.allclose(trans, translation, atol=0.05)
+    assert rms < 0.01
+
+
+def test_register_initial_guess():
+    """Starting at the answer should converge at once."""
+    fixed, normals = _make_surface()
+    moving, rotation, translation = _make_moving(fixed)
+
+    registration = sicp.IterativeClosestPoint(fixed, normals)
+    rot, trans, rms = registration.register(
+        moving, rotation=rotation, translation=translation,
+        max_iterations=2)
+    assert np.allclose(rot, rotation)
+    assert np.allclose(trans, translation)
+    assert rms < 1e-6
+
+
+def test_register_max_distance():
+    """Points away from the surface should be ignored."""
+    fixed, normals = _make_surface()
+    moving, rotation, translation = _make_moving(fixed)
+    moving[0:20] *= 2.0
+
+    registration = sicp.IterativeClosestPoint(fixed, normals)
+    rot, trans, _ = registration.register(
+        moving, method='point_to_plane', max_distance=10.0)
+    assert np.allclose(rot, rotation, atol=1e-3)
+    assert np.allclose(trans, translation, atol=0.05)
+
+    with pytest.raises(ValueError):
+        registration.register(moving + 1000.0, max_distance=10.0)
+
+
+def test_invalid_inputs():
+    """Invalid inputs should raise."""
+    fixed, normals = _make_surface(100)
+    with pytest.raises(TypeError):
+        sicp.IterativeClosestPoint(fixed, normals.tolist())
+    with pytest.raises(ValueError):
+        sicp.IterativeClosestPoint(fixed, normals[0:10])
+    with pytest.raises(ValueError):
+        sicp.IterativeClosestPoint(fixed, np.zeros((100, 3)))
+
+    without_normals = sicp.IterativeClosestPoint(fixed)
+    with pytest.raises(ValueError):
+        without_normals.register(fixed, method='point_to_plane')
+
+    registration = sicp.IterativeClosestPoint(fixed, normals)
+    with pytest.raises(TypeError):
+        registration.register(fixed.tolist())
+    with pytest.raises(ValueError):
+        registration.register(np.zeros((10, 2)))
+    with pytest.raises(ValueError):
+        registration.register(fixed, method='point_to_line')
+    with pytest.raises(ValueError):
+        registration.register(fixed, max_iterations=0)
@@ -0,0 +1,105 @@
+#  -*- coding: utf-8 -*-
+"""Tests for the KD-tree"""
+import numpy as np
+import pytest
+import sksurgerycore.algorithms.kdtree as kd
+
+
+def _brute_force(points, queries):
+    """Nearest neighbours by comparing every pair."""
+    squared = np.sum(np.square(queries[:, np.newaxis, :]
+                               - points[np.newaxis, :, :]), axis=2)
+    indices = np.argmin(squared, axis=1)
+    return np.sqrt(squared[np.arange(queries.shape[0]), indices]), indices
+
+
+@pytest.mark.parametrize("number_of_points,leaf_size",
+                         [(1, 16), (2, 1), (17, 4), (1000, 16), (999, 7)])
+def test_query_matches_brute_force(number_of_points, leaf_size):
+    """The tree should find the same neighbours as a brute force search."""
+    rng = np.random.default_rng(number_of_points)
+    points = rng.uniform(-10, 10, (number_of_points, 3))
+    queries = rng.uniform(-15, 15, (200, 3))
+
+    tree = kd.KDTree(points, leaf_size=leaf_size)
+    assert len(tree) == number_of_points
+    distances, indices = tree.query(queries)
+    expected_distances, expected_indices = _brute_force(points, queries)
+    assert np.allclose(distances, expected_distances)
+    assert np.array_equal(indices, expected_indices)
+
+
+def test_query_on_a_grid():
+    """Points on a grid have many equal coordinates at the splits,
+    and queries on the grid are exactly on the splitting planes."""
+    grid = np.stack(np.meshgrid(np.arange(10.0), np.arange(10.0),
+                                np.arange(5.0)), axis=-1).reshape(-1, 3)
+    rng = np.random.default_rng(1)
+    queries = np.concatenate((grid[rng.choice(500, 100)],
+                              rng.uniform(-2, 11, (100, 3)).round(1)))
+
+    tree = kd.KDTree(grid, leaf_size=3)
+    distances, _ = tree.query(queries)
+    assert np.allclose(distances, _brute_force(grid, queries)[0])
+
+
+def test_query_on_a_surface():
+    """Queries near a surface, as for ICP."""
+    rng = np.random.default_rng(0)
+    angles = rng.uniform(0, 2 * np.pi, (2000, 2))
+    points = np.stack([np.cos(angles[:, 0]) * np.sin(angles[:, 1]),
+                       np.sin(angles[:, 0]) * np.sin(angles[:, 1]),
+                       np.cos(angles[:, 1])], axis=1) * 50
+    queries = points[rng.choice(2000, 300)] + rng.normal(0, 1, (300, 3))
+
+    distances, indices = kd.KDTree(points).query(queries)
+    expected_distances, expected_indices = _brute_force(points, queries)
+    assert np.allclose(distances, expected_distances)
+    assert np.array_equal(indices, expected_indices)
+
+
+def test_query_max_distance():
+    """Points further than max_distance should have no neighbour."""
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-10, 10, (500, 3))
+    queries = rng.uniform(-20, 20, (200, 3))
+
+    distances, indices = kd.KDTree(points).query(queries, max_distance=2.0)
+    expected_distances, expected_indices = _brute_force(points, queries)
+    close = expected_distances < 2.0
+    assert np.any(close)
+    assert np.any(~close)
+    assert np.allclose(distances[close], expected_distances[close])
+    assert np.array_equal(indices[close], expected_indices[close])
+    assert np.all(np.isinf(distances[~close]))
+    assert np.all(indices[~close] == -1)
+
+
+def test_query_nothing_close():
+    """Queries all further than max_distance, and no queries."""
+    tree = kd.KDTree(np.random.default_rng(2).uniform(-10, 10, (500, 3)))
+    distances, indices = tree.query(np.full((5, 3), 100.0), max_distance=1.0)
+    assert np.all(np.isinf(distances))
+    assert np.all(indices == -1)
+
+    distances, indices = tree.query(np.zeros((0, 3)))
+    assert distances.shape == (0,)
+    assert indices.shape == (0,)
+
+
+def test_invalid_inputs():
+    """Invalid points and queries should raise."""
+    with pytest.raises(TypeError):
+        kd.KDTree([[0.0, 0.0, 0.0]])
+    with pytest.raises(ValueError):
+        kd.KDTree(np.zeros((3, 2)))
+    with pytest.raises(ValueError):
+        kd.KDTree(np.zeros((0, 3)))
+    with pytest.raises(ValueError):
+        kd.KDTree(np.zeros((3, 3)), leaf_size=0)
+
+    tree = kd.KDTree(np.zeros((3, 3)))
+    with pytest.raises(TypeError):
+        tree.query([[0.0, 0.0, 0.0]])
+    with pytest.raises(ValueError):
+        tree.query(np.zeros(3))
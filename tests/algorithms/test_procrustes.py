@@ -2,9 +2,12 @@
 
 # pylint: skip-file
 
+import os
+import timeit
 import numpy as np
 import pytest
 import sksurgerycore.algorithms.procrustes as p
+from sksurgerycore.algorithms.errors import compute_weighted_fre
 
 
 def test_empty_fixed():
@@ -213,3 +216,221 @@ def test_rotation_result():
     assert np.allclose(expected_translation, translation, 0.001, 0.001)
     assert np.allclose(expected_rotation, rotation, 0.001, 0.001)
     assert error < 0.001
+
+
+def test_batch_matches_single():
+    """The batched version should match the single version,
+    including for the reflection data above."""
+    rng = np.random.default_rng(0)
+    moving = rng.uniform(-100, 100, (50, 6, 3))
+    fixed = moving + rng.normal(0, 1, (50, 6, 3))
+    fixed[0] = moving[0] * [-1, 1, 1]
+    fixed[1, :, 2] = 5.0
+    for index in range(2, 50):
+        angles = rng.uniform(-np.pi, np.pi, 3)
+        cos, sin = np.cos(angles[0]), np.sin(angles[0])
+        rotation = np.array([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
+        fixed[index] = np.matmul(moving[index], rotation.T) + angles
+
+    rotations, translations, fres = p.orthogonal_procrustes_batch(fixed,
+                                                                  moving)
+    assert rotations.shape == (50, 3, 3)
+    assert translations.shape == (50, 3, 1)
+    assert fres.shape == (50,)
+    assert np.allclose(np.linalg.det(rotations), 1.0)
+
+    for index in range(50):
+        rotation, translation, fre = p.orthogonal_procrustes(fixed[index],
+                                                             moving[index])
+        assert np.allclose(rotations[index], rotation)
+        assert np.allclose(translations[index], translation)
+        assert np.isclose(fres[index], fre)
+
+
+def test_batch_invalid_inputs():
+
+    with pytest.raises(TypeError):
+        p.orthogonal_procrustes_batch(None, np.ones((2, 3, 3)))
+    with pytest.raises(TypeError):
+        p.orthogonal_procrustes_batch(np.ones((2, 3, 3)), None)
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes_batch(np.ones((3, 3)), np.ones((3, 3)))
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes_batch(np.ones((2, 3, 3)), np.ones((2, 3, 4)))
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes_batch(np.ones((2, 2, 3)), np.ones((2, 2, 3)))
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes_batch(np.ones((2, 4, 3)), np.ones((3, 4, 3)))
+
+
+def test_horn_matches_arun():
+    """Horn's method should give the same results as Arun's,
+    including for the reflection data, and the batched version."""
+    fixed = np.zeros((4, 3))
+    fixed[0][1] = 1
+    fixed[2][0] = 2
+    fixed[3][0] = 4
+    moving = np.copy(fixed)
+    moving[2][0] = -2
+    moving[3][0] = -4
+    rotation, translation, error = p.orthogonal_procrustes(fixed, moving,
+                                                           method='horn')
+    assert np.allclose(rotation, np.diag([-1.0, 1.0, -1.0]))
+    assert np.allclose(translation, np.zeros((3, 1)))
+    assert error < 0.0000001
+
+    rng = np.random.default_rng(1)
+    moving = rng.uniform(-100, 100, (20, 5, 3))
+    fixed = np.matmul(moving, p.orthogonal_procrustes_batch(
+        rng.normal(size=(20, 5, 3)), rng.normal(size=(20, 5, 3)))[0]) \
+        + rng.normal(0, 1, (20, 5, 3)) + [10, -20, 30]
+    fixed[0] = moving[0] * [-1, 1, 1]
+
+    rotations, translations, fres = p.orthogonal_procrustes_batch(
+        fixed, moving, method='horn')
+    arun_rotations, arun_translations, arun_fres = \
+        p.orthogonal_procrustes_batch(fixed, moving)
+    assert np.allclose(rotations, arun_rotations)
+    assert np.allclose(translations, arun_translations)
+    assert np.allclose(fres, arun_fres)
+
+    for index in range(20):
+        rotation, translation, fre = p.orthogonal_procrustes(
+            fixed[index], moving[index], method='horn')
+        assert np.allclose(rotation, rotations[index])
+        assert np.allclose(translation, translations[index])
+        assert np.isclose(fre, fres[index])
+
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes(fixed[0], moving[0], method='kabsch')
+    with pytest.raises(ValueError):
+        p.orthogonal_procrustes_batch(fixed, moving, method='kabsch')
+
+
+@pytest.mark.skipif("SKSURGERYCORE_BENCHMARK" not in os.environ,
+                    reason="benchmark, set SKSURGERYCORE_BENCHMARK to run")
+def test_horn_latency():
+    """Prints the latency of each method for small N. Skipped unless
+    SKSURGERYCORE_BENCHMARK is set, run with pytest -s to see the
+    timings. There is no assertion, as timings on shared machines vary."""
+    rng = np.random.default_rng(2)
+    moving = rng.uniform(-100, 100, (4, 3))
+    fixed = moving[:, [1, 2, 0]] + rng.normal(0, 0.5, (4, 3))
+
+    for method in ['arun', 'horn']:
+        latency = min(timeit.repeat(
+            lambda: p.orthogonal_procrustes(fixed, moving, method=method),
+            number=200, repeat=5)) / 200
+        print(method, "latency", latency * 1e6, "us")
+
+
+def _random_registration(rng, number_of_points):
+    """Random moving points, and a random rigid transform."""
+    moving = rng.uniform(-100, 100, (number_of_points, 3))
+    rotation = p.orthogonal_procrustes(rng.normal(size=(4, 3)),
+                                       rng.normal(size=(4, 3)))[0]
+    translation = rng.uniform(-50, 50, (3, 1))
+    fixed = np.matmul(moving, rotation.T) + translation.T
+    return fixed, moving, rotation, translation
+
+
+def test_weighted_scalar():
+    """Equal weights should match the unweighted registration,
+    and zero weights should ignore points."""
+    rng = np.random.default_rng(3)
+    fixed, moving, rotation, translation = _random_registration(rng, 8)
+    noisy = fixed + rng.normal(0, 2, fixed.shape)
+
+    expected = p.orthogonal_procrustes(noisy, moving)
+    result = p.weighted_orthogonal_procrustes(noisy, moving, np.full(8, 3.0))
+    for expected_value, value in zip(expected, result):
+        assert np.allclose(expected_value, value)
+
+    noisy[0] += 100.0
+    weights = np.ones(8)
+    weights[0] = 0.0
+    result = p.weighted_orthogonal_procrustes(noisy, moving, weights)
+    expected = p.orthogonal_procrustes(noisy[1:], moving[1:])
+    for expected_value, value in zip(expected, result):
+        assert np.allclose(expected_value, value)
+
+    #isotropic weight matrices are the same as scalar weights
+    weights = rng.uniform(0.5, 2.0, 8)
+    scalar_result = p.weighted_orthogonal_procrustes(noisy, moving, weights)
+    matrix_result = p.weighted_orthogonal_procrustes(
+        noisy, moving, weights[:, np.newaxis, np.newaxis] * np.eye(3))
+    for scalar_value, matrix_value in zip(scalar_result, matrix_result):
+        assert np.allclose(scalar_value, matrix_value)
+
+
+def test_weighted_anisotropic():
+    """With anisotropic noise, weighting by the inverse covariance
+    should find the minimum of the weighted error, and be more
+    accurate than the unweighted registration."""
+    rng = np.random.default_rng(4)
+    number_of_points = 200
+    fixed, moving, rotation, translation = \
+        _random_registration(rng, number_of_points)
+
+    # noise is large along a random direction for each point.
+    directions = rng.normal(size=(number_of_points, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    covariances = 0.01 * np.eye(3) \
+        + 25.0 * directions[:, :, np.newaxis] * directions[:, np.newaxis, :]
+    noise = rng.normal(size=(number_of_points, 3)) * 0.1 \
+        + directions * rng.normal(0, 5.0, (number_of_points, 1))
+    noisy = fixed + noise
+    weights = np.linalg.inv(covariances)
+
+    R, T, fre = p.weighted_orthogonal_procrustes(noisy, moving, weights)
+    unweighted_R, unweighted_T, _ = p.orthogonal_procrustes(noisy, moving)
+    assert np.allclose(np.matmul(R, R.T), np.eye(3))
+    assert np.isclose(np.linalg.det(R), 1.0)
+
+    def target_error(test_R, test_T):
+        return np.linalg.norm(np.matmul(moving, test_R.T) + test_T.T - fixed)
+
+    assert target_error(R, T) < 0.2 * target_error(unweighted_R,
+                                                   unweighted_T)
+
+    # small perturbations should all increase the weighted error
+    for _ in range(20):
+        rvec = rng.normal(0, 1e-4, 3)
+        angle = np.linalg.norm(rvec)
+        axis = rvec / angle
+        skew = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]],
+                         [-axis[1], axis[0], 0]])
+        small_rotation = np.eye(3) + np.sin(angle) * skew \
+            + (1 - np.cos(angle)) * np.matmul(skew, skew)
+        perturbed_fre = compute_weighted_fre(
+            noisy, moving, np.matmul(small_rotation, R),
+            T + rng.normal(0, 1e-3, (3, 1)), weights)
+        assert perturbed_fre > fre
+
+
+def test_weighted_invalid_inputs():
+
+    fixed = np.ones((4, 3))
+    with pytest.raises(TypeError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, [1, 1, 1, 1])
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, np.ones(3))
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, np.ones((4, 2, 2)))
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, -np.ones(4))
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, np.zeros(4))
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, np.zeros((4, 3, 3)))
+
+    #weight matrices should be symmetric positive semi-definite
+    asymmetric = np.tile(np.eye(3), (4, 1, 1))
+    asymmetric[1, 0, 1] = 0.5
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, asymmetric)
+    indefinite = np.tile(np.diag([1.0, 1.0, -0.5]), (4, 1, 1))
+    with pytest.raises(ValueError):
+        p.weighted_orthogonal_procrustes(fixed, fixed, indefinite)
+    semi_definite = np.tile(np.diag([1.0, 1.0, 0.0]), (4, 1, 1))
+    p.weighted_orthogonal_procrustes(fixed, fixed, semi_definite)
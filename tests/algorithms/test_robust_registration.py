@@ -0,0 +1,94 @@
+#  -*- coding: utf-8 -*-
+"""Tests for robust registration"""
+import numpy as np
+import pytest
+import sksurgerycore.algorithms.procrustes as p
+import sksurgerycore.algorithms.robust_registration as rr
+
+
+def _make_data(seed, number_of_points=100, number_of_outliers=10):
+    """Points related by a random rigid transform, with small noise,
+    and some points moved a long way."""
+    rng = np.random.default_rng(seed)
+    moving = rng.uniform(-100, 100, (number_of_points, 3))
+    rotation = p.orthogonal_procrustes(rng.normal(size=(4, 3)),
+                                       rng.normal(size=(4, 3)))[0]
+    translation = rng.uniform(-50, 50, (3, 1))
+    fixed = np.matmul(moving, rotation.T) + translation.T \
+        + rng.normal(0, 0.2, (number_of_points, 3))
+    outliers = rng.choice(number_of_points, number_of_outliers, replace=False)
+    fixed[outliers] += rng.uniform(20, 50, (number_of_outliers, 3))
+    is_outlier = np.zeros(number_of_points, dtype=bool)
+    is_outlier[outliers] = True
+    return fixed, moving, rotation, translation, is_outlier
+
+
+def test_ransac():
+    """RANSAC should find the outliers, and be repeatable with a seed."""
+    fixed, moving, rotation, translation, is_outlier = _make_data(0)
+
+    unrobust_rotation = p.orthogonal_procrustes(fixed, moving)[0]
+    assert not np.allclose(unrobust_rotation, rotation, atol=0.01)
+
+    rot, trans, fre, inliers = rr.ransac_procrustes(
+        fixed, moving, iterations=200, threshold=2.0, seed=1)
+    assert np.array_equal(inliers, ~is_outlier)
+    assert np.allclose(rot, rotation, atol=0.01)
+    assert np.allclose(trans, translation, atol=0.5)
+    assert fre < 0.5
+
+    again = rr.ransac_procrustes(fixed, moving, iterations=200,
+                                 threshold=2.0, seed=1, method='horn')
+    assert np.allclose(again[0], rot)
+    assert np.array_equal(again[3], inliers)
+
+
+def test_ransac_chunks():
+    """Many points means the hypotheses are scored in chunks."""
+    fixed, moving, rotation, _, is_outlier = _make_data(2, 20000, 2000)
+    rot, _, _, inliers = rr.ransac_procrustes(fixed, moving, iterations=60,
+                                              threshold=2.0, seed=3)
+    assert np.array_equal(inliers, ~is_outlier)
+    assert np.allclose(rot, rotation, atol=0.01)
+
+
+def test_ransac_invalid():
+    """Invalid parameters should raise ValueError."""
+    fixed, moving, _, _, _ = _make_data(4)
+    with pytest.raises(ValueError):
+        rr.ransac_procrustes(fixed, moving, iterations=0)
+    with pytest.raises(ValueError):
+        rr.ransac_procrustes(fixed, moving, threshold=0.0)
+    with pytest.raises(ValueError):
+        rr.ransac_procrustes(fixed, moving, iterations=5, threshold=1e-6,
+                             seed=0)
+    with pytest.raises(TypeError):
+        rr.ransac_procrustes(None, moving)
+
+
+def test_trimmed():
+    """Trimmed least squares should drop the outliers."""
+    fixed, moving, rotation, translation, is_outlier = _make_data(5, 100, 5)
+    rot, trans, fre, kept = rr.trimmed_procrustes(fixed, moving,
+                                                  inlier_fraction=0.9)
+    assert np.count_nonzero(kept) == 90
+    assert not np.any(kept & is_outlier)
+    assert np.allclose(rot, rotation, atol=0.01)
+    assert np.allclose(trans, translation, atol=0.5)
+    assert fre < 0.5
+
+    #refining a RANSAC result
+    fixed, moving, rotation, _, is_outlier = _make_data(6, 100, 10)
+    rot, trans, _, _ = rr.ransac_procrustes(fixed, moving, iterations=100,
+                                            threshold=2.0, seed=0)
+    _, _, _, kept = rr.trimmed_procrustes(fixed, moving, 0.85,
+                                          rotation=rot, translation=trans)
+    assert not np.any(kept & is_outlier)
+
+    _, _, fre, kept = rr.trimmed_procrustes(fixed[0:4], moving[0:4], 0.1)
+    assert np.count_nonzero(kept) == 3
+
+    with pytest.raises(ValueError):
+        rr.trimmed_procrustes(fixed, moving, inlier_fraction=0.0)
+    with pytest.raises(ValueError):
+        rr.trimmed_procrustes(fixed, moving, max_iterations=0)
@@ -0,0 +1,178 @@
+#  -*- coding: utf-8 -*-
+"""Tests for the low latency tracking filters"""
+import numpy as np
+import pytest
+import sksurgerycore.algorithms.tracking_filters as filters
+from sksurgerycore.algorithms.tracking_smoothing import RollingMeanArray, \
+                rvecs_to_quaternions
+
+
+def _filter_stream(smoother, samples, time_stamps):
+    """
+    Runs a stream of samples, one row, through a filter, returning
+    the estimate after each sample.
+    """
+    smoother.add_rows(1)
+    rows = np.array([0])
+    estimates = np.empty(samples.shape)
+    for index, sample in enumerate(samples):
+        smoother.pop(rows, sample[np.newaxis, :],
+                     time_stamps = time_stamps[index:index + 1])
+        estimates[index] = smoother.getmean(rows)[0]
+    return estimates
+
+
+def _make_filters():
+    """
+    A rolling mean and each filter, set up for similar smoothing
+    of a 60 Hz stream.
+    """
+    return {'rolling mean': RollingMeanArray(3, 9),
+            'exponential': filters.ExponentialFilterArray(3, alpha=0.2),
+            'one euro': filters.OneEuroFilterArray(
+                3, min_cutoff=1.0, beta=0.1),
+            'kalman': filters.KalmanFilterArray(
+                3, process_noise=100.0, measurement_noise=1.0)}
+
+
+def test_jitter_when_still():
+    """
+    On a noisy stationary tool, every filter should reduce jitter.
+    """
+    rng = np.random.default_rng(0)
+    time_stamps = np.arange(600) / 60.0
+    samples = np.array([10.0, -20.0, 30.0]) + rng.normal(size=(600, 3))
+    raw_jitter = np.std(samples[100:], axis=0).mean()
+
+    for name, smoother in _make_filters().items():
+        estimates = _filter_stream(smoother, samples, time_stamps)
+        jitter = np.std(estimates[100:], axis=0).mean()
+        assert jitter < 0.5 * raw_jitter, name
+
+
+def test_latency_when_moving():
+    """
+    On a tool moving at constant speed, the rolling mean and
+    exponential filters lag, the One Euro filter lags less, and the
+    Kalman filter has no steady state lag.
+    """
+    time_stamps = np.arange(600) / 60.0
+    speed = 60.0
+    samples = np.zeros((600, 3))
+    samples[:, 0] = speed * time_stamps
+
+    lags = {}
+    for name, smoother in _make_filters().items():
+        estimates = _filter_stream(smoother, samples, time_stamps)
+        lags[name] = np.mean(samples[300:, 0] - estimates[300:, 0]) / speed
+
+    # A rolling mean of 9 samples lags by 4 samples
+    assert np.isclose(lags['rolling mean'], 4.0 / 60.0)
+    assert lags['one euro'] < 0.25 * lags['exponential']
+    assert abs(lags['kalman']) < 1e-6
+
+
+def test_rotation_filters():
+    """
+    Rotation filters should return unit quaternions close to a
+    constant input, regardless of the input's sign.
+    """
+    rvec = np.array([[0.3, -0.2, 0.5]])
+    expected = rvecs_to_quaternions(rvec)[0]
+    for smoother in [filters.ExponentialFilterArray(rotation=True),
+                     filters.OneEuroFilterArray(rotation=True),
+                     filters.KalmanFilterArray(rotation=True)]:
+        smoother.add_rows(2)
+        assert np.all(np.isnan(smoother.getmean([0, 1])))
+        for index in range(10):
+            sign = 1.0 if index % 2 == 0 else -1.0
+            smoother.pop([0], sign * expected[np.newaxis, :],
+                         is_quaternion = True)
+            smoother.pop([1], rvec)
+        means = smoother.getmean([0, 1])
+        assert np.allclose(means[0], expected)
+        assert np.allclose(means[1], expected)
+        assert np.allclose(np.linalg.norm(means, axis=1), 1.0)
+
+
+def test_missing_samples_held():
+    """
+    Samples with nans should be ignored.
+    """
+    smoother = filters.KalmanFilterArray(3)
+    smoother.add_rows(2)
+    smoother.pop([0, 1], [[1.0, 2.0, 3.0], [np.nan, np.nan, np.nan]])
+    smoother.pop([0, 1], [[np.nan, 0.0, 0.0], [4.0, 5.0, 6.0]])
+    means = smoother.getmean([1, 0])
+    assert np.allclose(means, [[4.0, 5.0, 6.0], [1.0, 2.0, 3.0]])
+
+
+def test_first_time_step():
+    """
+    The first sample's time step should be the default period, so a
+    filter behaves the same whatever the clock's origin.
+    """
+    time_stamps = np.arange(120) / 60.0
+    samples = np.zeros((120, 3))
+    samples[:, 0] = 60.0 * time_stamps
+
+    for name in ['one euro', 'kalman']:
+        from_zero = _filter_stream(_make_filters()[name], samples,
+                                   time_stamps)
+        from_epoch = _filter_stream(_make_filters()[name], samples,
+                                    time_stamps + 1.7e9)
+        assert np.allclose(from_epoch, from_zero, atol=1e-3), name
+
+
+def test_time_step_when_hidden():
+    """
+    After a tool is hidden, the time step should be from its last
+    valid sample, so the Kalman filter predicts where it has moved to.
+    """
+    time_stamps = np.arange(91) / 60.0
+    samples = np.zeros((91, 3))
+    samples[:, 0] = 60.0 * time_stamps
+    samples[60:90] = np.nan
+
+    estimates = _filter_stream(
+        filters.KalmanFilterArray(3, process_noise=100.0), samples,
+        time_stamps)
+    assert np.allclose(estimates[59:90], estimates[59])
+    assert abs(estimates[90, 0] - 90.0) < 1.0
+
+
+def test_filter_base_class():
+    """
+    The base class should not be usable without an _update.
+    """
+    with pytest.raises(TypeError):
+        _ = filters.SmoothingFilterArray() # pylint: disable=abstract-class-instantiated
+
+
+def test_create_smoothing_filters():
+    """
+    Filters should be selected by the configuration dictionary.
+    """
+    assert filters.create_smoothing_filters() == (None, None)
+    assert filters.create_smoothing_filters(
+        {'smoothing filter': 'rolling mean'}) == (None, None)
+
+    for name, filter_type in [('exponential', filters.ExponentialFilterArray),
+                              ('one euro', filters.OneEuroFilterArray),
+                              ('kalman', filters.KalmanFilterArray)]:
+        rotation, translation = filters.create_smoothing_filters(
+            {'smoothing filter': name})
+        assert isinstance(rotation, filter_type)
+        assert isinstance(translation, filter_type)
+
+    with pytest.raises(ValueError):
+        filters.create_smoothing_filters({'smoothing filter': 'median'})
+    with pytest.raises(ValueError):
+        filters.create_smoothing_filters({'smoothing filter': 'exponential',
+                                          'smoothing alpha': 0.0})
+    with pytest.raises(ValueError):
+        filters.create_smoothing_filters({'smoothing filter': 'one euro',
+                                          'one euro beta': -1.0})
+    with pytest.raises(ValueError):
+        filters.create_smoothing_filters({'smoothing filter': 'kalman',
+                                          'smoothing frequency': 0.0})
@@ -4,6 +4,7 @@ import math
 import numpy as np
 import pytest
 import sksurgerycore.algorithms.tracking_smoothing as reg
+from sksurgerycore.algorithms.averagequaternions import average_quaternions
 
 
 def test_rvec_to_quaterion():
@@ -40,6 +41,42 @@ def test_quaterion_to_matrix():
 
     assert np.allclose(rot_mat, rot_mat1, rtol=1e-05, atol=1e-10)
 
+def test_vectorised_conversions():
+    """
+    Test the vectorised conversions match the single rotation versions,
+    including nans and zero rotations.
+    """
+    rng = np.random.default_rng(2)
+    rvecs = rng.uniform(-math.pi, math.pi, (100, 3))
+    rvecs[3] = 0.0
+    rvecs[5] = np.nan
+    rvecs[7, 1] = np.nan
+
+    quaternions = reg.rvecs_to_quaternions(rvecs)
+    rot_mats = reg.quaternions_to_matrices(quaternions)
+    assert quaternions.shape == (100, 4)
+    assert rot_mats.shape == (100, 3, 3)
+
+    for index in range(100):
+        quaternion = reg._rvec_to_quaternion(rvecs[index]) # pylint: disable=protected-access
+        assert np.allclose(quaternion, quaternions[index], rtol=1e-12,
+                           atol=1e-12, equal_nan=True)
+        assert np.allclose(reg.quaternion_to_matrix(quaternion),
+                           rot_mats[index], rtol=1e-12, atol=1e-12,
+                           equal_nan=True)
+
+    assert np.array_equal(quaternions[3], [1.0, 0.0, 0.0, 0.0])
+    assert np.isnan(quaternions[7]).all()
+    assert reg.rvecs_to_quaternions([0.0, 0.0, 0.0]).shape == (1, 4)
+
+    back = reg.matrices_to_quaternions(rot_mats)
+    alignment = np.abs(np.sum(back * quaternions, axis=1))
+    assert np.allclose(alignment[~np.isnan(alignment)], 1.0)
+    assert np.isnan(back[5]).all()
+    assert np.array_equal(reg.matrices_to_quaternions(np.eye(4)),
+                          [[1.0, 0.0, 0.0, 0.0]])
+
+
 def test_rolling_mean_no_buffer():
     """
     Try doing a rolling mean with zero buffer.
@@ -95,6 +132,37 @@ def test_rolling_mean_four_values():
                        atol=1e-10)
 
 
+def test_rolling_mean_vs_nanmean():
+    """
+    Test the running sums give the same answer as nanmean over the
+    window, including partially nan vectors, after many wraps.
+    """
+    rng = np.random.default_rng(0)
+    window = []
+    mean_buffer = reg.RollingMean(vector_size=3, buffer_size=4)
+    for _ in range(50):
+        vector = rng.uniform(-100.0, 100.0, 3)
+        vector[rng.uniform(size=3) < 0.3] = np.nan
+        window = ([vector] + window)[0:4]
+        mean_buffer.pop(vector)
+        with np.errstate(invalid='ignore'):
+            expected = np.nansum(window, 0) / np.sum(~np.isnan(window), 0)
+        assert np.allclose(expected, mean_buffer.getmean(), rtol=1e-10,
+                           atol=1e-10, equal_nan=True)
+
+
+def test_rolling_mean_integers():
+    """
+    Test rolling mean of an integer buffer, which starts at -1
+    """
+    mean_buffer = reg.RollingMean(vector_size=1, buffer_size=2, datatype=int)
+    assert mean_buffer.getmean()[0] == -1.0
+    mean_buffer.pop(3)
+    assert mean_buffer.getmean()[0] == 1.0
+    mean_buffer.pop(5)
+    assert mean_buffer.getmean()[0] == 4.0
+
+
 def test_rolling_rotation_no_buffer():
     """
     Try doing a rolling rotation mean with zero buffer.
@@ -158,8 +226,9 @@ def test_rolling_rot_four_values():
 
     expected_answer0 = reg._rvec_to_quaternion([0.0, 0.0, -math.pi/4.0]) # pylint: disable=protected-access
     #the next ones more of a regression test, I haven't independently
-    #calculated this answer.
-    expected_answer1 = [-0.87602709, 0.0, -0.27843404, 0.39376519]
+    #calculated this answer. The sign agrees with the newest quaternion,
+    #q and -q being the same rotation.
+    expected_answer1 = [0.87602709, 0.0, 0.27843404, -0.39376519]
 
     mean_buffer = reg.RollingMeanRotation(buffer_size=3)
     mean_buffer.pop(rvec0)
@@ -172,3 +241,101 @@ def test_rolling_rot_four_values():
 
     assert np.allclose(expected_answer1, mean_buffer.getmean(), rtol=1e-05,
                        atol=1e-10)
+
+
+def test_rolling_rot_vs_average():
+    """
+    Test the incremental average matches average_quaternions over the
+    window, after many wraps of the buffer.
+    """
+    rng = np.random.default_rng(1)
+    window = []
+    mean_buffer = reg.RollingMeanRotation(buffer_size=5)
+    for _ in range(40):
+        rvec = rng.uniform(-0.5, 0.5, 3) + [0.0, 1.0, 0.0]
+        if rng.uniform() < 0.2:
+            rvec[:] = np.nan
+        window = ([reg._rvec_to_quaternion(rvec)] + window)[0:5] # pylint: disable=protected-access
+        mean_buffer.pop(rvec)
+        valid = [quat for quat in window if not np.isnan(quat).any()]
+        if not valid:
+            assert np.isnan(mean_buffer.getmean()).all()
+            continue
+        expected = average_quaternions(np.array(valid))
+        if np.dot(expected, valid[0]) < 0.0:
+            expected = -expected
+        assert np.allclose(expected, mean_buffer.getmean(), rtol=1e-05,
+                           atol=1e-8)
+
+
+def test_mean_array_vs_rolling_mean():
+    """
+    Test the array versions give the same answers as a list of
+    the single versions, with rows updated at different times.
+    """
+    rng = np.random.default_rng(3)
+    means = [reg.RollingMean(3, 4) for _ in range(6)]
+    rotations = [reg.RollingMeanRotation(4) for _ in range(6)]
+    mean_array = reg.RollingMeanArray(3, 4)
+    rotation_array = reg.RollingMeanRotationArray(4)
+
+    with pytest.raises(ValueError):
+        _ = reg.RollingMeanArray(3, 0)
+
+    mean_array.add_rows(2)
+    rotation_array.add_rows(2)
+    assert np.isnan(mean_array.getmean([0, 1])).all()
+    assert np.isnan(rotation_array.getmean([0, 1])).all()
+    mean_array.add_rows(4)
+    rotation_array.add_rows(4)
+    assert len(mean_array) == 6
+    assert len(rotation_array) == 6
+
+    for _ in range(30):
+        rows = np.flatnonzero(rng.uniform(size=6) < 0.7)
+        vectors = rng.uniform(-10.0, 10.0, (rows.shape[0], 3))
+        vectors[rng.uniform(size=vectors.shape) < 0.1] = np.nan
+        rvecs = rng.uniform(-0.5, 0.5, (rows.shape[0], 3)) + [1.0, 0.0, 0.0]
+        rvecs[rng.uniform(size=rows.shape[0]) < 0.2] = np.nan
+
+        mean_array.pop(rows, vectors)
+        rotation_array.pop(rows, rvecs)
+        for index, row in enumerate(rows):
+            means[row].pop(vectors[index])
+            rotations[row].pop(rvecs[index])
+
+        all_rows = np.arange(6)
+        expected = np.array([mean.getmean() for mean in means])
+        assert np.allclose(expected, mean_array.getmean(all_rows),
+                           equal_nan=True)
+        expected = np.array([rotation.getmean() for rotation in rotations])
+        assert np.allclose(expected, rotation_array.getmean(all_rows),
+                           equal_nan=True)
+
+
+def test_tracking_smoother():
+    """
+    Test the tracking smoother, including repeated port handles
+    """
+    smoother = reg.TrackingSmoother(2, ["a", "b"])
+    assert smoother.port_handles == ["a", "b"]
+
+    with pytest.raises(ValueError):
+        smoother.get_means(["c"])
+
+    smoother.add_frame(["c", "a", "a"], [1.0, 2.0, 3.0], [1, 2, 3],
+                       [[0.0, 0.0, 0.0]] * 3,
+                       [[1.0, 1.0, 1.0], [2.0, 2.0, 2.0], [4.0, 4.0, 4.0]],
+                       [0.5, 0.5, 1.0])
+    assert smoother.port_handles == ["a", "b", "c"]
+
+    times, frame_numbers, quaternions, translations, qualities = \
+        smoother.get_means(["a", "b", "c"])
+
+    assert np.allclose(times, [2.5, np.nan, 1.0], equal_nan=True)
+    assert np.allclose(frame_numbers, [3, np.nan, 1], equal_nan=True)
+    assert np.allclose(quaternions[[0, 2]], [[1.0, 0.0, 0.0, 0.0]] * 2)
+    assert np.isnan(quaternions[1]).all()
+    assert np.allclose(translations, [[3.0] * 3, [np.nan] * 3, [1.0] * 3],
+                       equal_nan=True)
+    assert np.allclose(qualities, [0.75, np.nan, 0.5], equal_nan=True)
@@ -7,6 +7,7 @@
 import pytest
 import numpy as np
 import sksurgerycore.algorithms.errors as err
+import sksurgerycore.algorithms.vector_math as vm
 
 
 def measure_tre_1(mean_fle_squared, target):
@@ -94,6 +95,76 @@ def test_invalid_because_target_wrong_columns():
         err.compute_tre_from_fle(np.ones((3, 3)), 1, np.ones((1, 4)))
 
 
-def test_invalid_because_fiducials_wrong_rows():
+def test_invalid_because_target_no_rows():
+    with pytest.raises(ValueError):
+        err.compute_tre_from_fle(np.ones((3, 3)), 1, np.ones((0, 3)))
+
+
+def test_invalid_because_chunk_size():
+    with pytest.raises(ValueError):
+        err.compute_tre_from_fle(np.ones((3, 3)), 1, np.ones((1, 3)),
+                                 chunk_size=0)
+
+
+def _tre_per_point(fiducials, mean_fle_squared, target):
+    """The previous calculation, for one target, one point at a time."""
+    centroid = np.mean(fiducials, axis=0)
+    covariance = np.cov(fiducials.T)
+    _, eigen_vectors_matrix = np.linalg.eig(covariance)
+
+    f_array = np.zeros(3)
+    for axis_index in range(3):
+        sum_f_k_squared = 0
+        for fiducial in fiducials:
+            f_k = vm.distance_from_line(centroid,
+                                        eigen_vectors_matrix[axis_index],
+                                        fiducial)
+            sum_f_k_squared = sum_f_k_squared + f_k * f_k
+        f_array[axis_index] = np.sqrt(sum_f_k_squared / fiducials.shape[0])
+
+    inner_sum = 0
+    for axis_index in range(3):
+        d_k = vm.distance_from_line(centroid,
+                                    eigen_vectors_matrix[axis_index],
+                                    target)
+        inner_sum = inner_sum + (d_k * d_k / (f_array[axis_index] *
+                                              f_array[axis_index]))
+
+    return (mean_fle_squared / fiducials.shape[0]) * \
+        (1 + (1./3.) * inner_sum)
+
+
+def test_tre_many_targets():
+    """Many targets should give the same TRE as the previous per point
+    calculation."""
+    rng = np.random.default_rng(0)
+    fiducials = rng.uniform(-50, 50, (6, 3))
+    targets = rng.uniform(-100, 100, (1000, 3))
+
+    expected = np.array([_tre_per_point(fiducials, 0.5, target)
+                         for target in targets])
+    errors = err.compute_tre_from_fle(fiducials, 0.5, targets)
+    assert errors.shape == (1000,)
+    assert np.allclose(errors, expected)
+
+    chunked = err.compute_tre_from_fle(fiducials, 0.5, targets,
+                                       chunk_size=7)
+    assert np.allclose(chunked, expected)
+
+
+def test_tre_streamed_chunks():
+    """Streamed chunks should give the same TRE as all the targets."""
+    rng = np.random.default_rng(1)
+    fiducials = rng.uniform(-50, 50, (4, 3))
+    targets = rng.uniform(-100, 100, (300, 3))
+
+    expected = err.compute_tre_from_fle(fiducials, 1, targets)
+    chunks = err.compute_tre_from_fle_chunks(
+        fiducials, 1, (targets[i:i + 100] for i in range(0, 300, 100)))
+    assert np.allclose(np.concatenate(list(chunks)), expected)
+
+    with pytest.raises(ValueError):
+        err.compute_tre_from_fle_chunks(np.ones((2, 3)), 1, [targets])
     with pytest.raises(ValueError):
-        err.compute_tre_from_fle(np.ones((3, 3)), 1, np.ones((2, 3)))
+        list(err.compute_tre_from_fle_chunks(fiducials, 1,
+                                             [np.ones((2, 4))]))
@@ -2,6 +2,8 @@
 Tests for skcore baseclasses
 """
 import math
+import time
+import warnings
 import pytest
 import numpy as np
 
@@ -36,6 +38,29 @@ class BadTracker(SKSBaseTracker):# pylint: disable=abstract-method
         pass
 
 
+class AsyncTracker(GoodTracker):
+    # pylint: disable=missing-function-docstring
+    """
+    A tracker with an acquire_frame method, for the acquisition loop.
+    """
+    def __init__(self, configuration = None, tracked_objects = None):
+        super().__init__(configuration, tracked_objects)
+        self.frames_acquired = 0
+        self.tracking = False
+    def acquire_frame(self):
+        self.frames_acquired += 1
+        if self.frames_acquired == 1000:
+            raise IOError("Tracker disconnected")
+        return (["test rb"], [float(self.frames_acquired)],
+                [self.frames_acquired], [[0.0, 0.0, 0.0]],
+                [[float(self.frames_acquired), 0.0, 0.0]], [1.0])
+    def start_tracking(self):
+        self.tracking = True
+    def stop_tracking(self):
+        assert not self.is_acquiring()
+        self.tracking = False
+
+
 class RigidBody():
     """
     A dummy rigid body class for testing SKSBaseTracker
@@ -304,3 +329,244 @@ def test_tracker_quaternions():
     transform[0,4:7] = [3.333333, 83.33333, 166.666667]
     assert np.allclose(tracking[test_index], transform)
     assert tracking_quality[test_index] == 0.6
+
+
+def test_tracker_smoothing_filter():
+    """
+    The smoothing filter should be set by the configuration.
+    """
+    config = {'smoothing filter' : 'exponential',
+              'smoothing alpha' : 0.5}
+    tracker = GoodTracker(config, [RigidBody('test rb')])
+
+    for time_stamp, x_pos in [(1.0, 0.0), (2.0, 10.0), (3.0, 20.0)]:
+        tracker.add_frame_to_buffer(["test rb"], [time_stamp], [0],
+                                    [[0.0, 0.0, 0.0]], [[x_pos, 0.0, 0.0]],
+                                    [1.0])
+
+    _, time_stamps, _, tracking, _ = tracker.get_smooth_frame(["test rb"])
+    assert time_stamps[0] == 3.0
+    assert np.allclose(tracking[0][0:3, 3], [12.5, 0.0, 0.0])
+    assert np.allclose(tracking[0][0:3, 0:3], np.eye(3))
+
+    with pytest.raises(ValueError):
+        GoodTracker({'smoothing filter' : 'median'})
+
+
+def _wait_for(condition, timeout=5.0):
+    """
+    Waits for a condition to become true.
+    """
+    end_time = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end_time:
+        time.sleep(0.001)
+    return condition()
+
+
+def test_tracker_acquisition_loop():
+    """
+    With an acquisition rate set, start_tracking should start acquiring
+    frames in the background, and stop_tracking should stop it.
+    """
+    tracker = AsyncTracker({'acquisition rate' : 1000.0})
+    assert not tracker.is_acquiring()
+
+    tracker.start_tracking()
+    assert tracker.tracking
+    assert tracker.is_acquiring()
+    assert _wait_for(lambda: tracker.frames_acquired > 5)
+
+    port_handles, time_stamps, frame_numbers, tracking, _ = \
+                    tracker.get_latest_frame()
+    assert port_handles == ("test rb",)
+    assert frame_numbers[0] > 0
+    assert np.isclose(tracking[0][0, 3], time_stamps[0])
+
+    tracker.stop_tracking()
+    assert not tracker.tracking
+    assert not tracker.is_acquiring()
+    frames_acquired = tracker.frames_acquired
+    time.sleep(0.01)
+    assert tracker.frames_acquired == frames_acquired
+
+    #stopping twice is fine, and we can restart.
+    tracker.stop_acquisition()
+    tracker.start_tracking()
+    assert _wait_for(lambda: tracker.frames_acquired > frames_acquired)
+    tracker.stop_tracking()
+
+
+def test_tracker_acquisition_errors():
+    """
+    Errors in the acquisition loop should be reported to consumers.
+    """
+    with pytest.raises(ValueError):
+        AsyncTracker({'acquisition rate' : 0.0})
+
+    tracker = AsyncTracker()
+    tracker.start_tracking()
+    assert not tracker.is_acquiring()
+    with pytest.raises(ValueError):
+        tracker.start_acquisition()
+    assert GoodTracker().acquire_frame() is None
+    with pytest.raises(ValueError):
+        GoodTracker({'acquisition rate' : 1.0})
+
+    tracker = AsyncTracker({'acquisition rate' : 1.0e6})
+    tracker.frames_acquired = 990
+    tracker.start_acquisition()
+    assert _wait_for(lambda: not tracker.is_acquiring())
+    with pytest.raises(RuntimeError):
+        tracker.get_latest_frame()
+    tracker.stop_tracking()
+
+
+def test_tracker_latest_frame():
+    """
+    The latest frame should be computed once per sample, be
+    immutable, and be sent to subscribers.
+    """
+    tracker = AsyncTracker()
+    frame = tracker.get_latest_frame()
+    assert frame.port_handles == ()
+    assert frame.tracking.shape == (0, 4, 4)
+
+    received = []
+    tracker.subscribe(received.append)
+    tracker.add_frame_to_buffer(*tracker.acquire_frame())
+    assert len(received) == 1
+
+    frame = tracker.get_latest_frame()
+    assert frame is received[0]
+    assert tracker.get_latest_frame() is frame
+    port_handles, time_stamps, frame_numbers, tracking, quality = frame
+    assert port_handles == ("test rb",)
+    assert time_stamps[0] == 1.0
+    assert frame_numbers[0] == 1
+    assert np.allclose(tracking[0][0:3, 3], [1.0, 0.0, 0.0])
+    assert quality[0] == 1.0
+    with pytest.raises(ValueError):
+        tracking[0][0, 0] = 2.0
+
+    tracker.unsubscribe(received.append)
+    with pytest.raises(ValueError):
+        tracker.unsubscribe(received.append)
+    tracker.add_frame_to_buffer(*tracker.acquire_frame())
+    assert len(received) == 1
+    new_frame = tracker.get_latest_frame()
+    assert new_frame is not frame
+    assert new_frame.time_stamps[0] == 2.0
+    assert frame.time_stamps[0] == 1.0
+
+    quaternion_tracker = AsyncTracker({'use quaternions' : True})
+    quaternion_tracker.add_frame_to_buffer(*quaternion_tracker.acquire_frame())
+    assert np.allclose(quaternion_tracker.get_latest_frame().tracking,
+                       [[[1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]]])
+
+
+def test_tracker_smooth_frame_into():
+    """
+    get_smooth_frame_into should match get_smooth_frame, writing into
+    the arrays it is given.
+    """
+    tracker = AsyncTracker({'smoothing buffer' : 3})
+    for _ in range(4):
+        tracker.add_frame_to_buffer(*tracker.acquire_frame())
+    tracker.add_frame_to_buffer(["other rb"], [1.5], [7], [[0.3, 0.0, 0.1]],
+                                [[1.0, 2.0, 3.0]], [0.25])
+
+    port_handles = ["other rb", "test rb"]
+    _, time_stamps, frame_numbers, tracking, quality = \
+                    tracker.get_smooth_frame(port_handles)
+
+    out_tracking = np.full((2, 4, 4), 5.0)
+    out_times = np.zeros(2)
+    out_frame_numbers = np.zeros(2, dtype=int)
+    out_quality = np.zeros(2)
+    tracker.get_smooth_frame_into(port_handles, out_tracking, out_times,
+                                  out_frame_numbers, out_quality)
+    assert np.allclose(out_tracking, tracking)
+    assert np.array_equal(out_times, time_stamps)
+    assert np.array_equal(out_frame_numbers, frame_numbers)
+    assert np.array_equal(out_quality, quality)
+
+    out_quaternions = np.zeros((2, 7))
+    tracker.get_smooth_frame_into(port_handles, out_quaternions, out_times,
+                                  out_frame_numbers, out_quality)
+    tracker.use_quaternions = True
+    _, _, _, tracking, _ = tracker.get_smooth_frame(port_handles)
+    assert np.allclose(out_quaternions, np.concatenate(tracking))
+
+    with pytest.raises(ValueError):
+        tracker.get_smooth_frame_into(port_handles, np.zeros((2, 4)),
+                                      out_times, out_frame_numbers,
+                                      out_quality)
+    with pytest.raises(ValueError):
+        tracker.get_smooth_frame_into(port_handles, out_quaternions,
+                                      np.zeros(3), out_frame_numbers,
+                                      out_quality)
+    with pytest.raises(ValueError):
+        tracker.get_smooth_frame_into(["missing"], out_quaternions[0:1],
+                                      out_times[0:1], out_frame_numbers[0:1],
+                                      out_quality[0:1])
+
+
+def test_tracker_per_tool_buffers():
+    """
+    The per tool buffers should still work like lists of rolling means,
+    and setting the port handles should reset the buffers.
+    """
+    tracker = GoodTracker({'smoothing buffer' : 2},
+                          [RigidBody('test rb'), RigidBody('other rb')])
+    tracker.add_frame_to_buffer(["other rb", "test rb"], [1.0, 2.0], [3, 4],
+                                [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]],
+                                [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]],
+                                [0.5, 1.0])
+
+    index = tracker.port_handles.index("test rb")
+    assert len(tracker.time_stamps) == 2
+    assert tracker.time_stamps[index].getmean()[0] == 2.0
+    assert tracker.time_stamps[-2].getmean()[0] == 2.0
+    assert tracker.frame_numbers[index].getmean()[0] == 4
+    assert tracker.qualities[index].getmean()[0] == 1.0
+    assert np.allclose(tracker.tvec_rolling_means[index].getmean(),
+                       [4.0, 5.0, 6.0])
+    assert np.allclose(tracker.rvec_rolling_means[index].getmean(),
+                       [1.0, 0.0, 0.0, 0.0])
+    assert len(tracker.qualities[0:1]) == 1
+    with pytest.raises(IndexError):
+        _ = tracker.qualities[2]
+
+    tracker.tvec_rolling_means[index].pop([6.0, 7.0, 8.0])
+    tracker.rvec_rolling_means[index].pop(
+        [math.cos(math.pi / 4), 0.0, 0.0, math.sin(math.pi / 4)], True)
+    assert np.allclose(tracker.tvec_rolling_means[index].getmean(),
+                       [5.0, 6.0, 7.0])
+    assert np.allclose(tracker.rvec_rolling_means[index].getmean(),
+                       [math.cos(math.pi / 8), 0.0, 0.0,
+                        math.sin(math.pi / 8)])
+
+    tracker.port_handles = ["new rb"]
+    assert tracker.port_handles == ["new rb"]
+    assert len(tracker.tvec_rolling_means) == 1
+    assert np.all(np.isnan(tracker.tvec_rolling_means[0].getmean()))
+    with pytest.raises(ValueError):
+        tracker.get_smooth_frame(["test rb"])
+
+
+def test_tracker_frame_numbers():
+    """
+    Frame numbers should be kept as given, including missing ones.
+    """
+    tracker = GoodTracker(tracked_objects = [RigidBody('test rb')])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        tracker.add_frame_to_buffer(["test rb", "new rb"], [1.0, 1.0],
+                                    [np.nan, 2.7],
+                                    [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]],
+                                    [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]],
+                                    [1.0, 1.0])
+        _, _, frame_numbers, _, _ = \
+            tracker.get_smooth_frame(["test rb", "new rb"])
+    assert np.isnan(frame_numbers[0])
+    assert frame_numbers[1] == 2.7
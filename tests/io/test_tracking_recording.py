@@ -0,0 +1,175 @@
+# coding=utf-8
+
+"""Tests for tracking recording and replay"""
+
+import time
+import pytest
+import numpy as np
+import sksurgerycore.io.tracking_recording as rec
+from sksurgerycore.transforms.matrix import construct_rx_matrix, \
+                construct_rigid_transformation
+
+
+def _make_frame(index):
+    """
+    A frame of two tools, rotating about x and moving along x.
+    """
+    transforms = []
+    for tool in range(2):
+        rotation = construct_rx_matrix(10.0 * index + tool, False)
+        transforms.append(construct_rigid_transformation(
+            rotation, [float(index), float(tool), 0.0]))
+    return (["pointer", 2], [0.01 * index, 0.01 * index], [index, index],
+            transforms, [1.0, 0.5])
+
+
+def _record(file_name, frames, append=False):
+    """
+    Records some frames to a file.
+    """
+    with rec.TrackingRecorder(file_name, append) as recorder:
+        for index in frames:
+            recorder.record(*_make_frame(index))
+
+
+def test_record_and_read(tmp_path):
+    """
+    Records should be written, and appended, as fixed size records.
+    """
+    file_name = str(tmp_path / "tracking.skst")
+    _record(file_name, range(5))
+    records = rec.read_recording(file_name)
+    assert records.shape == (10,)
+    assert records.dtype == rec.RECORD_DTYPE
+    assert not records.flags.writeable
+    assert np.array_equal(records['sample'], np.repeat(np.arange(5), 2))
+    assert records['port_handle'][1] == b'2'
+    assert np.array_equal(records['port_handle_type'], np.tile([0, 1], 5))
+    assert np.allclose(records['translation'][8], [4.0, 0.0, 0.0])
+    assert np.allclose(records['quality'], np.tile([1.0, 0.5], 5))
+    del records
+
+    #a partly written record is dropped before appending.
+    with open(file_name, 'ab') as out_file:
+        out_file.write(b'partial')
+    assert rec.read_recording(file_name).shape == (10,)
+    _record(file_name, range(5, 7), append=True)
+    records = rec.read_recording(file_name)
+    assert np.array_equal(records['sample'], np.repeat(np.arange(7), 2))
+    assert np.array_equal(records['frame_number'][10:], [5, 5, 6, 6])
+
+    with rec.TrackingRecorder(file_name) as recorder:
+        recorder.record([], [], [], [], [])
+        with pytest.raises(ValueError):
+            recorder.record(["a" * 33], [0.0], [0], [np.eye(4)], [1.0])
+        with pytest.raises(ValueError):
+            recorder.record(["a"], [0.0], [0], [np.eye(3)], [1.0])
+        with pytest.raises(ValueError):
+            recorder.record([1.5], [0.0], [0], [np.eye(4)], [1.0])
+    assert rec.read_recording(file_name).shape == (0,)
+
+    with open(file_name, 'wb') as out_file:
+        out_file.write(b'not a recording')
+    with pytest.raises(ValueError):
+        rec.read_recording(file_name)
+
+
+def test_replay_next_frame(tmp_path):
+    """
+    With no replay speed, each call to get_frame replays the next frame.
+    """
+    file_name = str(tmp_path / "tracking.skst")
+    _record(file_name, range(5))
+    tracker = rec.ReplayTracker(file_name, {'replay speed' : None})
+    assert tracker.frame_count() == 5
+    assert tracker.port_handles == ["pointer", 2]
+    assert tracker.get_tool_descriptions()[0] == ["pointer", 2]
+    with pytest.raises(ValueError):
+        tracker.get_frame()
+    with pytest.raises(ValueError):
+        tracker.frame_records(5)
+
+    tracker.start_tracking()
+    for index in range(5):
+        port_handles, time_stamps, frame_numbers, tracking, quality = \
+                        tracker.get_frame()
+        expected = _make_frame(index)
+        assert port_handles == ["pointer", 2]
+        assert isinstance(port_handles[1], int)
+        assert np.allclose(time_stamps, expected[1])
+        assert np.array_equal(frame_numbers, expected[2])
+        assert np.allclose(tracking, expected[3])
+        assert np.allclose(quality, expected[4])
+    assert tracker.is_finished()
+    assert tracker.acquire_frame() is None
+    assert np.allclose(tracker.get_frame()[3], _make_frame(4)[3])
+
+    #frames are views of the memory mapped file.
+    records = tracker.frame_records(2)
+    assert np.shares_memory(records, tracker.frame_records(2))
+    assert np.allclose(records['translation'][0], [2.0, 0.0, 0.0])
+    tracker.close()
+    assert tracker.frame_count() == 0
+
+
+def test_replay_speed(tmp_path):
+    """
+    Replaying at a multiple of the recorded speed should skip frames
+    that aren't asked for in time.
+    """
+    file_name = str(tmp_path / "tracking.skst")
+    _record(file_name, range(100))
+
+    with pytest.raises(ValueError):
+        rec.ReplayTracker(file_name, {'replay speed' : 0.0})
+
+    tracker = rec.ReplayTracker(file_name, {'replay speed' : 20.0,
+                                            'use quaternions' : True})
+    tracker.start_tracking()
+    _, _, frame_numbers, tracking, _ = tracker.get_frame()
+    assert frame_numbers[0] < 50
+    assert tracking[0].shape == (1, 7)
+
+    time.sleep(0.06)
+    _, _, later_frame_numbers, _, _ = tracker.get_frame()
+    assert later_frame_numbers[0] > frame_numbers[0] + 10
+    tracker.stop_tracking()
+    with pytest.raises(ValueError):
+        tracker.acquire_frame()
+
+
+def test_replay_acquisition_loop(tmp_path):
+    """
+    The replay tracker should work with the acquisition loop.
+    """
+    file_name = str(tmp_path / "tracking.skst")
+    _record(file_name, range(10))
+    tracker = rec.ReplayTracker(file_name, {'replay speed' : None,
+                                            'acquisition rate' : 1000.0})
+    tracker.start_tracking()
+    end_time = time.monotonic() + 5.0
+    while not tracker.is_finished() and time.monotonic() < end_time:
+        time.sleep(0.001)
+    tracker.stop_tracking()
+    frame = tracker.get_latest_frame()
+    assert np.array_equal(frame.frame_numbers, [9, 9])
+    assert np.allclose(frame.tracking, _make_frame(9)[3])
+
+
+def test_replay_port_handle_types(tmp_path):
+    """
+    Int port handles should be replayed as ints, and kept apart from
+    a str port handle with the same text.
+    """
+    file_name = str(tmp_path / "tracking.skst")
+    with rec.TrackingRecorder(file_name) as recorder:
+        recorder.record([1, np.int64(2)], [0.0, 0.0], [0, 0],
+                        [np.eye(4)] * 2, [1.0, 1.0])
+        recorder.record(["1", 2], [0.01, 0.01], [1, 1],
+                        [np.eye(4)] * 2, [1.0, 1.0])
+
+    tracker = rec.ReplayTracker(file_name, {'replay speed' : None})
+    assert tracker.port_handles == [1, 2, "1"]
+    tracker.start_tracking()
+    assert tracker.get_frame()[0] == [1, 2]
+    assert tracker.get_frame()[0] == ["1", 2]
@@ -424,3 +424,29 @@ def test_construct_rigid_transformation():
 
 # test_construct_rigid_transformation()
 
+
+
+def test_invert_rigid_transformation():
+    rot_m = mat.construct_rotm_from_euler(10, 20, 30, "zyx", False)
+    rigid = mat.construct_rigid_transformation(rot_m, [10.0, -20.0, 30.0])
+
+    assert mat.is_rigid_transformation(rigid)
+    assert np.allclose(mat.invert_rigid_transformation(rigid),
+                       np.linalg.inv(rigid))
+    assert np.allclose(mat.invert_transformation(rigid),
+                       np.linalg.inv(rigid))
+
+
+def test_invert_transformation_stack():
+    rot_m = mat.construct_rotm_from_euler(10, 20, 30, "zyx", False)
+    rigid = mat.construct_rigid_transformation(rot_m, [10.0, -20.0, 30.0])
+    scaled = np.copy(rigid)
+    scaled[0:3, 0:3] *= 2.0
+    stack = np.stack([rigid, scaled, rigid])
+
+    assert np.array_equal(mat.is_rigid_transformation(stack),
+                          [True, False, True])
+    assert np.allclose(mat.invert_transformation(stack),
+                       np.linalg.inv(stack))
+    assert np.allclose(mat.invert_transformation(stack[1:2]),
+                       np.linalg.inv(stack[1:2]))
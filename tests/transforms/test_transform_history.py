@@ -0,0 +1,231 @@
+#  -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+import sksurgerycore.transforms.matrix as mat
+import sksurgerycore.transforms.transform_history as th
+import sksurgerycore.transforms.transform_manager as m
+
+
+def create_rigid(angle_z, translation):
+    rotation = mat.construct_rz_matrix(angle_z, False)
+    return mat.construct_rigid_transformation(rotation, translation)
+
+
+def test_invalid_buffer_size():
+
+    with pytest.raises(ValueError):
+        th.TransformHistory(0)
+
+
+def test_empty_history():
+
+    history = th.TransformHistory(5)
+    assert len(history) == 0
+    with pytest.raises(ValueError):
+        history.get(0.0)
+
+
+def test_interpolate_transforms():
+
+    r = th.interpolate_transforms(create_rigid(0, [0, 0, 0]),
+                                  create_rigid(90, [10, 20, 30]), 0.5)
+    assert np.allclose(r, create_rigid(45, [5, 10, 15]))
+
+    # Takes the shortest arc
+    r = th.interpolate_transforms(create_rigid(170, [0, 0, 0]),
+                                  create_rigid(-170, [0, 0, 0]), 0.5)
+    assert np.allclose(r, create_rigid(180, [0, 0, 0]))
+
+    # Nearly parallel quaternions
+    r = th.interpolate_transforms(create_rigid(10, [0, 0, 0]),
+                                  create_rigid(10.001, [0, 0, 0]), 0.5)
+    assert np.allclose(r, create_rigid(10.0005, [0, 0, 0]))
+
+
+def test_interpolate_half_turns():
+
+    for rotation in [mat.construct_rx_matrix(179, False),
+                     mat.construct_ry_matrix(179, False),
+                     mat.construct_rz_matrix(179, False),
+                     mat.construct_rotm_from_euler(30, 60, 90, "zyx", False)]:
+        transform = mat.construct_rigid_transformation(rotation, [1, 2, 3])
+        for fraction in [0.0, 1.0]:
+            r = th.interpolate_transforms(transform, transform, fraction)
+            assert np.allclose(r, transform)
+
+
+def test_history_get():
+
+    history = th.TransformHistory(4)
+    history.add(1.0, create_rigid(0, [0, 0, 0]))
+    history.add(2.0, create_rigid(20, [10, 0, 0]))
+
+    with pytest.raises(ValueError):
+        history.add(2.0, create_rigid(0, [0, 0, 0]))
+
+    assert np.allclose(history.get(1.0), create_rigid(0, [0, 0, 0]))
+    assert np.allclose(history.get(1.5), create_rigid(10, [5, 0, 0]))
+    assert np.allclose(history.get(2.0), create_rigid(20, [10, 0, 0]))
+
+    with pytest.raises(ValueError):
+        history.get(0.5)
+    with pytest.raises(ValueError):
+        history.get(2.5)
+
+
+def test_history_wraps():
+
+    history = th.TransformHistory(4)
+    for i in range(11):
+        history.add(float(i), create_rigid(10 * i, [i, 0, 0]))
+
+    assert len(history) == 4
+    assert history.time_range() == (7.0, 10.0)
+    for time in np.linspace(7.0, 10.0, 13):
+        assert np.allclose(history.get(time),
+                           create_rigid(10 * time, [time, 0, 0]))
+
+    with pytest.raises(ValueError):
+        history.get(6.5)
+
+
+def test_history_copy():
+
+    history = th.TransformHistory(4)
+    for i in range(6):
+        history.add(float(i), create_rigid(0, [i, 0, 0]))
+
+    copied = history.copy()
+    copied.add(6.0, create_rigid(0, [60, 0, 0]))
+    history.add(6.0, create_rigid(0, [6, 0, 0]))
+    for i in range(7, 20):
+        history.add(float(i), create_rigid(0, [i, 0, 0]))
+
+    assert copied.time_range() == (3.0, 6.0)
+    assert np.allclose(copied.get(5.5), create_rigid(0, [32.5, 0, 0]))
+    assert history.time_range() == (16.0, 19.0)
+    assert np.allclose(history.get(18.5), create_rigid(0, [18.5, 0, 0]))
+
+    # Adding to one history leaves the samples of the other unchanged.
+    again = copied.copy()
+    again.add(7.0, create_rigid(0, [70, 0, 0]))
+    assert len(copied) == 4
+    assert copied.time_range() == (3.0, 6.0)
+    assert again.time_range() == (4.0, 7.0)
+
+
+def test_manager_get_at():
+
+    tm = m.TransformManager(history_size=10)
+    tm.add("pointer2tracker", create_rigid(0, [0, 0, 0]), timestamp=0.0)
+    tm.add("pointer2tracker", create_rigid(20, [0, 0, 0]), timestamp=2.0)
+    tm.add("camera2tracker", create_rigid(0, [0, 0, 0]), timestamp=1.0)
+    tm.add("camera2tracker", create_rigid(0, [30, 0, 0]), timestamp=4.0)
+    tm.add("tip2pointer", create_rigid(0, [0, 5, 0]))
+
+    # Without a time, we get the latest transforms.
+    expected = np.matmul(np.linalg.inv(create_rigid(0, [30, 0, 0])),
+                         np.matmul(create_rigid(20, [0, 0, 0]),
+                                   create_rigid(0, [0, 5, 0])))
+    assert np.allclose(tm.get("tip2camera"), expected)
+
+    expected = np.matmul(np.linalg.inv(create_rigid(0, [10, 0, 0])),
+                         np.matmul(create_rigid(20, [0, 0, 0]),
+                                   create_rigid(0, [0, 5, 0])))
+    assert np.allclose(tm.get("tip2camera", timestamp=2.0), expected)
+    assert np.allclose(tm.get("tracker2camera", timestamp=2.0),
+                       np.linalg.inv(create_rigid(0, [10, 0, 0])))
+    assert np.allclose(tm.get("pointer2tracker", timestamp=1.0),
+                       create_rigid(10, [0, 0, 0]))
+
+    with pytest.raises(ValueError):
+        tm.get("tip2camera", timestamp=0.5)
+
+    # Adding the opposite direction drops the history.
+    tm.add("tracker2pointer", np.eye(4))
+    assert np.allclose(tm.get("pointer2tracker", timestamp=10.0), np.eye(4))
+
+    tm.remove("camera2tracker")
+    assert ("camera", "tracker") not in tm.histories
+
+
+def test_manager_timestamp_needs_history():
+
+    with pytest.raises(ValueError):
+        m.TransformManager(history_size=0)
+
+    tm = m.TransformManager()
+    with pytest.raises(ValueError):
+        tm.add("a2b", np.eye(4), timestamp=1.0)
+
+
+def test_manager_add_many_timestamps():
+
+    tm = m.TransformManager(history_size=10)
+    tm.add_many(["pointer2tracker", "camera2tracker"],
+                np.stack([create_rigid(0, [0, 0, 0])] * 2), timestamps=0.0)
+    tm.add_many(["pointer2tracker", "camera2tracker"],
+                np.stack([create_rigid(20, [0, 0, 0]),
+                          create_rigid(0, [10, 0, 0])]),
+                timestamps=[2.0, 1.0])
+    tm.update_frame({"pointer2tracker": create_rigid(40, [0, 0, 0])},
+                    timestamps=4.0)
+    tm.update_frame({"camera2tracker": create_rigid(0, [30, 0, 0])},
+                    timestamps={"camera2tracker": 3.0})
+
+    assert np.allclose(tm.get("pointer2tracker", timestamp=3.0),
+                       create_rigid(30, [0, 0, 0]))
+    assert np.allclose(tm.get("camera2tracker", timestamp=2.0),
+                       create_rigid(0, [20, 0, 0]))
+    assert np.allclose(tm.get("pointer2tracker"), create_rigid(40, [0, 0, 0]))
+
+    # A failed batch changes nothing.
+    with pytest.raises(ValueError):
+        tm.add_many(["pointer2tracker", "camera2tracker"],
+                    np.stack([np.eye(4)] * 2), timestamps=[5.0, 3.0])
+    with pytest.raises(ValueError):
+        tm.add_many(["pointer2tracker", "camera2tracker"],
+                    np.stack([np.eye(4)] * 2), timestamps=[5.0])
+    with pytest.raises(ValueError):
+        tm.update_frame({"pointer2tracker": np.eye(4)},
+                        timestamps={"camera2tracker": 5.0})
+    with pytest.raises(ValueError):
+        tm.add_many(["needle2tracker", "pointer2tracker", "pointer2tracker"],
+                    np.stack([np.eye(4)] * 3), timestamps=5.0)
+    assert tm.histories[("pointer", "tracker")].time_range() == (0.0, 4.0)
+    assert np.allclose(tm.get("pointer2tracker"), create_rigid(40, [0, 0, 0]))
+    assert not tm.exists("needle2tracker")
+    assert ("needle", "tracker") not in tm.histories
+
+    # A name repeated with increasing time stamps is added in order.
+    tm.add_many(["pointer2tracker", "pointer2tracker"],
+                np.stack([create_rigid(50, [0, 0, 0]),
+                          create_rigid(60, [0, 0, 0])]),
+                timestamps=[5.0, 6.0])
+    assert tm.histories[("pointer", "tracker")].time_range() == (0.0, 6.0)
+    assert np.allclose(tm.get("pointer2tracker", timestamp=5.5),
+                       create_rigid(55, [0, 0, 0]))
+
+    with pytest.raises(ValueError):
+        m.TransformManager().add_many(["a2b"], np.eye(4)[np.newaxis],
+                                      timestamps=1.0)
+
+
+def test_manager_copy_shares_histories():
+
+    tm = m.ConcurrentTransformManager(history_size=10)
+    tm.update_frame({"pointer2tracker": create_rigid(0, [0, 0, 0]),
+                     "camera2tracker": create_rigid(0, [0, 0, 0])},
+                    timestamps=0.0)
+    snapshot = tm.snapshot()
+    tm.update_frame({"pointer2tracker": create_rigid(0, [10, 0, 0])},
+                    timestamps=1.0)
+
+    # Only the history that changed is a new object.
+    assert tm.snapshot().histories[("camera", "tracker")] \
+        is snapshot.histories[("camera", "tracker")]
+    assert len(snapshot.histories[("pointer", "tracker")]) == 1
+    assert len(tm.snapshot().histories[("pointer", "tracker")]) == 2
+    assert np.allclose(tm.get("pointer2tracker", timestamp=0.5),
+                       create_rigid(0, [5, 0, 0]))
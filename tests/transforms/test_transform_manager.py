@@ -1,5 +1,8 @@
 #  -*- coding: utf-8 -*-
 
+import string
+import sys
+import threading
 import numpy as np
 import pytest
 import sksurgerycore.transforms.transform_manager as m
@@ -294,3 +297,467 @@ def test_get_path_with_y_shape():
     assert np.allclose(
         np.matmul(np.matmul(c2f, np.matmul(e2c, d2e)), f2g), r, test_manager_matrix_tolerance)
 
+
+
+def test_get_disconnected_raises():
+
+    tm = m.TransformManager()
+    tm.add("a2b", create_test_matrix(1))
+    tm.add("c2d", create_test_matrix(2))
+
+    with pytest.raises(ValueError):
+        tm.get("a2d")
+
+
+def test_path_cache_hits_and_misses():
+
+    a2b = create_test_matrix(1)
+    b2c = create_test_matrix(2)
+
+    tm = m.TransformManager()
+    tm.add("a2b", a2b)
+    tm.add("b2c", b2c)
+
+    tm.get("a2c")
+    assert tm.cache_info() == (0, 1, 1)
+    tm.get("a2c")
+    assert tm.cache_info() == (1, 1, 1)
+
+    # Direct transforms never need the cache.
+    tm.get("a2b")
+    assert tm.cache_info() == (1, 1, 1)
+
+    tm.clear_cache()
+    assert tm.cache_info() == (0, 0, 0)
+
+
+def test_path_cache_survives_replacement():
+
+    tm = m.TransformManager()
+    tm.add("a2b", create_test_matrix(1))
+    tm.add("b2c", create_test_matrix(2))
+    tm.get("a2c")
+
+    b2c = create_test_matrix(5)
+    tm.add("b2c", b2c)
+    r = tm.get("a2c")
+
+    assert tm.cache_info() == (1, 1, 1)
+    assert np.allclose(
+        np.matmul(b2c, create_test_matrix(1)), r,
+        test_manager_matrix_tolerance)
+
+
+def test_path_cache_invalidated_on_remove():
+
+    tm = m.TransformManager()
+    tm.add("a2b", create_test_matrix(1))
+    tm.add("b2c", create_test_matrix(2))
+    tm.add("d2e", create_test_matrix(3))
+    tm.add("e2f", create_test_matrix(4))
+    tm.get("a2c")
+    tm.get("d2f")
+    assert tm.cache_info()[2] == 2
+
+    tm.remove("c2b")
+    assert tm.cache_info()[2] == 1
+
+    with pytest.raises(ValueError):
+        tm.get("a2c")
+
+    tm.get("f2d")
+    assert tm.cache_info()[2] == 2
+
+
+def test_get_shortest_path():
+
+    a2b = create_test_matrix(1)
+    b2c = create_test_matrix(2)
+    c2d = create_test_matrix(3)
+    a2e = create_test_matrix(4)
+    e2d = create_test_matrix(5)
+
+    tm = m.TransformManager()
+    tm.add("a2b", a2b)
+    tm.add("b2c", b2c)
+    tm.add("c2d", c2d)
+    tm.get("a2d")
+    tm.add("a2e", a2e)
+    tm.add("e2d", e2d)
+
+    # The cached path through b and c is dropped,
+    # as adding e2d opens a shorter one.
+    r = tm.get("a2d")
+
+    assert np.allclose(np.matmul(e2d, a2e), r, test_manager_matrix_tolerance)
+
+
+def test_get_long_chain():
+
+    number_of_frames = 2000
+    names = ["f" + "".join(chr(ord('a') + int(digit)) for digit in str(i))
+             for i in range(number_of_frames)]
+
+    tm = m.TransformManager()
+    for i in range(number_of_frames - 1):
+        tm.add(names[i] + "2" + names[i + 1], create_test_matrix(1))
+
+    r = tm.get(names[0] + "2" + names[-1])
+
+    expected = np.eye(4)
+    expected[0:3, 3] = np.array([1, 2, 3]) * (number_of_frames - 1)
+    assert np.allclose(r, expected, test_manager_matrix_tolerance)
+
+
+def test_inverse_is_lazy():
+
+    t = create_test_matrix(1)
+    tm = m.TransformManager()
+    tm.add("model2world", t)
+    assert tm.repository["world"]["model"] is None
+    assert tm.count() == 2
+
+    r = tm.get("world2model")
+    assert np.allclose(np.linalg.inv(t), r, test_manager_matrix_tolerance)
+    assert tm.repository["world"]["model"] is r
+
+    tm.add("hand2world", t)
+    tm.add_trajectory("eye2world", np.stack([t] * 3))
+    tm.compute_inverses()
+    assert tm.repository["world"]["model"] is r
+    assert np.allclose(tm.repository["world"]["hand"], np.linalg.inv(t),
+                       test_manager_matrix_tolerance)
+    assert tm.repository["world"]["eye"].shape == (3, 4, 4)
+
+
+def test_inverse_of_non_rigid():
+
+    t = create_test_matrix(1)
+    t[0][0] = 2
+    tm = m.TransformManager()
+    tm.add("model2world", t)
+
+    r = tm.get("world2model")
+    assert np.allclose(np.linalg.inv(t), r, test_manager_matrix_tolerance)
+
+
+def test_add_many():
+
+    a2b = create_test_matrix(1)
+    b2c = create_test_matrix(2)
+    c2d = create_test_matrix(3)
+
+    tm = m.TransformManager()
+    tm.add("a2b", a2b)
+    tm.get("a2b")
+    stack = np.stack([a2b, b2c, c2d])
+    tm.add_many(["a2b", "b2c", "c2d"], stack)
+    stack[:] = 0
+
+    assert tm.count() == 6
+    assert np.allclose(tm.get("b2c"), b2c, test_manager_matrix_tolerance)
+    assert np.allclose(tm.get("c2b"), np.linalg.inv(b2c),
+                       test_manager_matrix_tolerance)
+    assert np.allclose(tm.get("a2d"), np.matmul(c2d, np.matmul(b2c, a2b)),
+                       test_manager_matrix_tolerance)
+
+    # Updating existing transforms keeps the cached path.
+    c2d = create_test_matrix(7)
+    tm.add_many(["a2b", "b2c", "c2d"], np.stack([a2b, b2c, c2d]))
+    assert np.allclose(tm.get("a2d"), np.matmul(c2d, np.matmul(b2c, a2b)),
+                       test_manager_matrix_tolerance)
+    assert tm.cache_info()[0:2] == (1, 1)
+
+
+def test_add_many_invalid():
+
+    tm = m.TransformManager()
+    with pytest.raises(TypeError):
+        tm.add_many(["a2b"], None)
+    with pytest.raises(ValueError):
+        tm.add_many(["a2b"], np.ones((1, 3, 4)))
+    with pytest.raises(ValueError):
+        tm.add_many(["a2b", "b2c"], np.ones((1, 4, 4)))
+    with pytest.raises(ValueError):
+        tm.add_many(["a2a"], np.ones((1, 4, 4)))
+    assert tm.count() == 0
+
+
+def test_update_frame():
+
+    a2b = create_test_matrix(1)
+    c2b = create_test_matrix(2)
+
+    tm = m.TransformManager()
+    tm.update_frame({})
+    tm.update_frame({"a2b": a2b, "c2b": c2b})
+
+    assert np.allclose(tm.get("a2c"), np.matmul(np.linalg.inv(c2b), a2b),
+                       test_manager_matrix_tolerance)
+
+    with pytest.raises(ValueError):
+        tm.update_frame({"a2b": np.eye(3)})
+
+
+def test_invalid_name_unhashable():
+
+    with pytest.raises(TypeError):
+        m.TransformManager.is_valid_name(["model2world"])
+
+
+def test_valid_name_repeated():
+
+    assert m.TransformManager.is_valid_name("model2world") \
+        == ("model", "world")
+    assert m.TransformManager.is_valid_name("model2world") \
+        == ("model", "world")
+    with pytest.raises(ValueError):
+        m.TransformManager.is_valid_name("world2world")
+    with pytest.raises(ValueError):
+        m.TransformManager.is_valid_name("world2world")
+
+
+def test_transform_points():
+
+    a2b = create_test_matrix(1)
+    a2b[0:3, 0:3] = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    b2c = create_test_matrix(4)
+
+    tm = m.TransformManager()
+    tm.add("a2b", a2b)
+    tm.add("b2c", b2c)
+
+    points = np.random.default_rng(0).uniform(-10, 10, (1000, 3))
+    homogeneous = np.vstack((points.T, np.ones((1, 1000))))
+    expected_b = np.matmul(a2b, homogeneous)[0:3].T
+    expected_c = tm.multiply_point("a2c", homogeneous)[0:3].T
+
+    r = tm.transform_points("a2b", points)
+    assert r.shape == (1000, 3)
+    assert np.allclose(r, expected_b, test_manager_matrix_tolerance)
+
+    r = tm.transform_points("a2b", points.T, points_as_columns=True)
+    assert r.shape == (3, 1000)
+    assert np.allclose(r, expected_b.T, test_manager_matrix_tolerance)
+
+    out = np.empty((2, 1000, 3))
+    r = tm.transform_points(["a2b", "a2c"], points, out=out, chunk_size=64)
+    assert r is out
+    assert np.allclose(out[0], expected_b, test_manager_matrix_tolerance)
+    assert np.allclose(out[1], expected_c, test_manager_matrix_tolerance)
+
+    out = np.empty((3, 1000))
+    tm.transform_points("a2c", points.T, out=out, chunk_size=7,
+                        points_as_columns=True)
+    assert np.allclose(out, expected_c.T, test_manager_matrix_tolerance)
+
+
+def test_transform_points_invalid():
+
+    tm = m.TransformManager()
+    tm.add("a2b", np.eye(4))
+
+    with pytest.raises(TypeError):
+        tm.transform_points("a2b", None)
+    with pytest.raises(ValueError):
+        tm.transform_points("a2b", np.ones((4, 4)))
+    with pytest.raises(ValueError):
+        tm.transform_points("a2b", np.ones((10, 3)), out=np.ones((3, 10)))
+    with pytest.raises(ValueError):
+        tm.transform_points("a2b", np.ones((10, 3)), chunk_size=0)
+    with pytest.raises(ValueError):
+        tm.transform_points("a2b", np.ones((10, 3)), out=np.ones((10, 3)),
+                            chunk_size=-1)
+    with pytest.raises(ValueError):
+        tm.transform_points("a2c", np.ones((10, 3)))
+
+
+def test_invalid_trajectory():
+
+    tm = m.TransformManager()
+    with pytest.raises(TypeError):
+        tm.add_trajectory("a2b", None)
+    with pytest.raises(ValueError):
+        tm.add_trajectory("a2b", np.eye(4))
+    with pytest.raises(ValueError):
+        tm.add_trajectory("a2b", np.ones((5, 3, 4)))
+    with pytest.raises(ValueError):
+        tm.add_trajectory("a2b", np.ones((5, 4, 3)))
+
+
+def test_get_trajectory():
+
+    number_of_samples = 100
+    model2tracker = np.stack([create_test_matrix(i)
+                              for i in range(number_of_samples)])
+    camera2tracker = np.stack([create_test_matrix(-2 * i)
+                               for i in range(number_of_samples)])
+    model2model = create_test_matrix(3)
+
+    tm = m.TransformManager()
+    tm.add_trajectory("model2tracker", model2tracker)
+    tm.add_trajectory("camera2tracker", camera2tracker)
+    tm.add("image2model", model2model)
+
+    r = tm.get_trajectory("image2camera")
+
+    assert r.shape == (number_of_samples, 4, 4)
+    for i in range(number_of_samples):
+        expected = np.matmul(np.linalg.inv(camera2tracker[i]),
+                             np.matmul(model2tracker[i], model2model))
+        assert np.allclose(r[i], expected, test_manager_matrix_tolerance)
+
+    assert tm.get_trajectory("image2model").shape == (1, 4, 4)
+
+    with pytest.raises(ValueError):
+        tm.transform_points("image2camera", np.ones((10, 3)))
+
+    tm.add_trajectory("camera2tracker", camera2tracker[0:10])
+    with pytest.raises(ValueError):
+        tm.get_trajectory("image2camera")
+
+
+def test_copy_is_independent():
+
+    tm = m.TransformManager(history_size=5)
+    tm.add("a2b", create_test_matrix(1), timestamp=1.0)
+    tm.add("b2c", create_test_matrix(2))
+    tm.get("a2c")
+
+    copied = tm.copy()
+    copied.add("a2b", create_test_matrix(3), timestamp=2.0)
+    copied.remove("b2c")
+
+    assert tm.exists("b2c")
+    assert np.allclose(tm.get("a2b"), create_test_matrix(1))
+    assert len(tm.histories[("a", "b")]) == 1
+    assert len(copied.histories[("a", "b")]) == 2
+    assert tm.cache_info() == (0, 1, 1)
+
+
+def test_concurrent_manager():
+
+    tm = m.ConcurrentTransformManager()
+    tm.add("a2b", create_test_matrix(1))
+    tm.add_many(["b2c"], create_test_matrix(2)[np.newaxis])
+    tm.add_trajectory("c2d", np.stack([np.eye(4)] * 3))
+    tm.update_frame({"d2e": np.eye(4)})
+
+    # Inverses are computed before publishing, so reads don't write them.
+    for transforms in tm.snapshot().repository.values():
+        assert all(transform is not None for transform in transforms.values())
+    assert tm.exists("b2a")
+    assert tm.count() == 8
+    expected = np.matmul(create_test_matrix(2), create_test_matrix(1))
+    assert np.allclose(tm.get("a2c"), expected)
+    assert tm.get_trajectory("a2d").shape == (3, 4, 4)
+    assert np.allclose(tm.multiply_point("a2c", np.ones((4, 1)))[0:3, 0],
+                       expected[0:3, 3] + 1)
+    assert np.allclose(tm.transform_points("a2c", np.zeros((1, 3)),
+                                           chunk_size=1),
+                       expected[0:3, 3])
+    assert tm.cache_info()[1] > 0
+
+    snapshot = tm.snapshot()
+    tm.remove("d2e")
+    tm.clear_cache()
+    assert snapshot.exists("d2e")
+    assert not tm.exists("d2e")
+    assert tm.cache_info() == (0, 0, 0)
+
+    # A failed update publishes nothing.
+    with pytest.raises(ValueError):
+        tm.remove("d2e")
+    with pytest.raises(ValueError):
+        tm.add("e2f", np.eye(4), timestamp=1.0)
+    assert not tm.exists("e2f")
+
+
+def test_concurrent_manager_stress():
+    """
+    Writers update a2b and b2c together, so that a2c is always
+    the identity. Readers must never see a half finished update.
+    """
+    tm = m.ConcurrentTransformManager()
+    tm.update_frame({"a2b": np.eye(4), "b2c": np.eye(4)})
+    errors = []
+    stop = threading.Event()
+
+    def writer(seed):
+        for i in range(500):
+            a2b = create_test_matrix(seed * 1000 + i)
+            tm.update_frame({"a2b": a2b, "b2c": np.linalg.inv(a2b)})
+
+    def reader():
+        while not stop.is_set():
+            if not np.allclose(tm.get("a2c"), np.eye(4)):
+                errors.append(tm.get("a2c"))
+
+    writers = [threading.Thread(target=writer, args=(seed,))
+               for seed in range(2)]
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+
+
+def test_concurrent_manager_stress_add_remove():
+    """
+    A writer adds and removes a transform, which clears and invalidates
+    the path cache, while readers fill the cache from random indirect
+    paths. Copying the cache must not race with the readers.
+    """
+    names = ["n" + first + second for first in string.ascii_lowercase[0:8]
+             for second in string.ascii_lowercase[0:8]]
+    tm = m.ConcurrentTransformManager()
+    tm.update_frame({name + "2" + names[index // 2]: np.eye(4)
+                     for index, name in enumerate(names) if index > 0})
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        try:
+            for _ in range(500):
+                tm.add("extra2" + names[5], np.eye(4))
+                for _ in range(10):
+                    # Copies the cache while the readers are refilling it.
+                    tm.add("extra2" + names[5], np.eye(4))
+                tm.remove("extra2" + names[5])
+        except Exception as error: # pylint: disable=broad-exception-caught
+            errors.append(error)
+
+    def reader(seed):
+        pairs = [(before, after) for before in names for after in names
+                 if before != after]
+        np.random.default_rng(seed).shuffle(pairs)
+        index = 0
+        while not stop.is_set():
+            before, after = pairs[index % len(pairs)]
+            index += 1
+            try:
+                tm.get(before + "2" + after)
+            except Exception as error: # pylint: disable=broad-exception-caught
+                errors.append(error)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        readers = [threading.Thread(target=reader, args=(seed,))
+                   for seed in range(6)]
+        writer_thread = threading.Thread(target=writer)
+        for thread in readers + [writer_thread]:
+            thread.start()
+        writer_thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not errors